@@ -9,7 +9,6 @@ import sys
 import json
 import time
 import datetime
-import numpy as np
 import argparse
 
 # Import mongo
@@ -21,6 +20,9 @@ from caesar_rest import __version__, __date__
 from caesar_rest import logger
 from caesar_rest import accounter
 from caesar_rest.accounter import update_account_info
+from caesar_rest import storage_usage
+from caesar_rest.accounter import job_stats_refresher
+from caesar_rest.job_events import job_event_bus, job_event_watcher
 
 #### GET SCRIPT ARGS ####
 def str2bool(v):
@@ -42,6 +44,13 @@ def get_args():
 	parser.add_argument('-datadir','--datadir', dest='datadir', default='/opt/caesar-rest/data', required=False, type=str, help='Directory where to store uploaded data') 
 	parser.add_argument('-jobdir','--jobdir', dest='jobdir', default='/opt/caesar-rest/jobs', required=False, type=str, help='Directory where to store jobs') 
 	parser.add_argument('-job_monitoring_period','--job_monitoring_period', dest='job_monitoring_period', default=30, required=False, type=int, help='Job monitoring poll period in seconds') 
+	parser.add_argument('-reconcile_period','--reconcile_period', dest='reconcile_period', default=21600, required=False, type=int, help='Period in seconds of full storage scans reconciling storage usage counters (default=21600)') 
+	parser.add_argument('--no-job-events', dest='job_events', action='store_false', help='Do not refresh user job stats on job state changes, only at each accounting cycle')
+	parser.set_defaults(job_events=True)
+	parser.add_argument('--no-changestreams', dest='changestreams', action='store_false', help='Do not use MongoDB change streams to watch job state transitions, poll active jobs instead')
+	parser.set_defaults(changestreams=True)
+	parser.add_argument('-job_events_poll_period','--job_events_poll_period', dest='job_events_poll_period', default=2, required=False, type=float, help='Job state polling period in seconds when change streams are not used (default=2)')
+	parser.add_argument('-reconcile_nthreads','--reconcile_nthreads', dest='reconcile_nthreads', default=8, required=False, type=int, help='Number of threads used to scan storage when reconciling storage usage counters (default=8)') 
 
 	# - DB options
 	parser.add_argument('-dbhost','--dbhost', dest='dbhost', default='localhost', required=False, type=str, help='Host of MongoDB database (default=localhost)')
@@ -115,19 +124,40 @@ def main():
 		sys.exit(1)
 
 
+	#============================================
+	#==   START JOB EVENT WATCHER
+	#============================================
+	# - Refresh job stats of users as soon as their jobs change state (between accounting cycles)
+	if args.job_events:
+		logger.info("Starting job event watcher ...")
+		job_event_bus.add_listener(job_stats_refresher)
+		job_event_watcher.initialize(db, args.job_events_poll_period, args.changestreams)
+		if job_event_watcher.start()<0:
+			logger.warn("Failed to start job event watcher, job stats will be updated only at each accounting cycle ...")
+
 	#============================================
 	#==   ACCOUNTING MONITORING LOOP
 	#============================================
+	last_reconcile_time= 0
 	try:
 		while True:
+			# - Rescan storage and reconcile storage usage counters (at startup and every reconcile period)
+			if time.time()-last_reconcile_time>=args.reconcile_period:
+				if storage_usage.reconcile_storage_usage(db, jobdir, datadir, args.reconcile_nthreads)<0:
+					logger.warn("Failed to reconcile storage usage counters (see logs) ...")
+				last_reconcile_time= time.time()
+
 			# - Monitor accounts in DB
 			logger.info("Monitoring accounts ...")
 			if update_account_info(db, jobdir, datadir)<0:
 				logger.warn("Failed to monitor accounts (see logs) ...")
 
-			# - Sleeping a bit before monitoring again
+			# - Sleeping a bit before monitoring again, refreshing job stats on job state changes meanwhile
 			logger.info("Sleeping %s seconds ..." % job_monitoring_period)
-			time.sleep(job_monitoring_period)
+			t_next= time.time() + job_monitoring_period
+			while time.time()<t_next:
+				if job_stats_refresher.wait(t_next-time.time()):
+					job_stats_refresher.flush(db)
 						
 	except KeyboardInterrupt:
 		logger.info("Job monitoring interrupted with ctrl-c signal")
@@ -9,8 +9,8 @@ import sys
 import json
 import time
 import datetime
-import numpy as np
 import argparse
+import gc
 
 import structlog
 import logging
@@ -19,7 +19,10 @@ import logging
 import caesar_rest
 from caesar_rest import __version__, __date__
 from caesar_rest import logger
+from caesar_rest import handler_stream
+from caesar_rest.log_utils import log_dispatcher, log_rate_limiter, make_log_formatter, LOG_FORMATS
 from caesar_rest.config import Config
+from caesar_rest import img_utils
 ## from caesar_rest.data_manager import DataManager  ### DEPRECATED
 from caesar_rest.job_configurator import JobConfigurator
 from caesar_rest.app import create_app
@@ -28,6 +31,18 @@ from caesar_rest import mongo
 from caesar_rest import celery
 from caesar_rest import jobmgr_kube
 from caesar_rest import jobmgr_slurm
+from caesar_rest.job_events import job_event_watcher
+from caesar_rest.bulk_writer import job_update_writer
+from caesar_rest.quotas import quota_manager
+from caesar_rest.token_cache import token_cache, jwks_verifier
+
+# - uWSGI modules (available only when the app is run by uWSGI)
+try:
+	import uwsgi
+	from uwsgidecorators import postfork
+except ImportError:
+	uwsgi= None
+	postfork= None
 
 #### GET SCRIPT ARGS ####
 def str2bool(v):
@@ -48,8 +63,13 @@ def get_args():
 	# - Specify cmd options
 	parser.add_argument('-datadir','--datadir', dest='datadir', default='/opt/caesar-rest/data', required=False, type=str, help='Directory where to store uploaded data') 
 	parser.add_argument('-jobdir','--jobdir', dest='jobdir', default='/opt/caesar-rest/jobs', required=False, type=str, help='Directory where to store jobs') 
+	parser.add_argument('-catalogdir','--catalogdir', dest='catalogdir', default='', required=False, type=str, help='Directory where to store columnar source catalogs of completed jobs (default=empty, ingestion disabled)') 
+	parser.add_argument('-preview_renderer','--preview_renderer', dest='preview_renderer', default='fast', required=False, type=str, help='Renderer of image+regions plots made after caesar jobs. Options are: {fast,matplotlib} (matplotlib=publication quality but slow) (default=fast)') 
 	parser.add_argument('-job_scheduler','--job_scheduler', dest='job_scheduler', default='celery', required=False, type=str, help='Job scheduler to be used. Options are: {celery,kubernetes,slurm} (default=celery)')
 	parser.add_argument('-job_monitoring_period','--job_monitoring_period', dest='job_monitoring_period', default=5, required=False, type=int, help='Job monitoring poll period in seconds') 
+	parser.add_argument('-job_update_batch_size','--job_update_batch_size', dest='job_update_batch_size', default=100, required=False, type=int, help='Max number of job updates written with a single DB bulk write (default=100)') 
+	parser.add_argument('-job_update_flush_period','--job_update_flush_period', dest='job_update_flush_period', default=10, required=False, type=float, help='Max time in seconds deferred job updates are kept before being written to DB (default=10)') 
+	parser.add_argument('-job_update_metrics_period','--job_update_metrics_period', dest='job_update_metrics_period', default=300, required=False, type=float, help='Period in seconds of DB write metrics logs (default=300, 0=never)') 
 	parser.add_argument('--debug', dest='debug', action='store_true')	
 	parser.set_defaults(debug=True)
 
@@ -60,6 +80,9 @@ def get_args():
 	parser.add_argument('-logdir','--logdir', dest='logdir', default='/opt/caesar-rest/logs', required=False, type=str, help='Directory where to store logs')
 	parser.add_argument('-logfile','--logfile', dest='logfile', default='app_logs.json', required=False, type=str, help='Name of json log file')
 	parser.add_argument('-logfile_maxsize','--logfile_maxsize', dest='logfile_maxsize', default=5.0, required=False, type=float, help='Max file size in MB (default=5)')
+	parser.add_argument('-logformat','--logformat', dest='logformat', default='json', required=False, type=str, help='Console log format {json,console} (default=json)')
+	parser.add_argument('-log_rate_burst','--log_rate_burst', dest='log_rate_burst', default=10, required=False, type=int, help='Max number of repetitive log events of the same type emitted per period (0=no limit) (default=10)')
+	parser.add_argument('-log_rate_period','--log_rate_period', dest='log_rate_period', default=60, required=False, type=float, help='Rate limit period of repetitive log events in seconds (default=60)')
 
 
 	# - AAI options
@@ -67,6 +90,9 @@ def get_args():
 	parser.set_defaults(aai=False)	
 	parser.add_argument('-secretfile','--secretfile', dest='secretfile', default='config/client_secrets.json', required=False, type=str, help='File (.json) with client credentials for AAI')
 	parser.add_argument('-openid_realm','--openid_realm', dest='openid_realm', default='neanias-development', required=False, type=str, help='OpenID realm used in AAI (defaul=neanias-development)') 
+	parser.add_argument('-token_validation','--token_validation', dest='token_validation', default='introspection', required=False, type=str, help='Access token validation method {introspection,jwks}: remote introspection or local JWT signature verification against identity provider JWKS keys (default=introspection)') 
+	parser.add_argument('-jwks_uri','--jwks_uri', dest='jwks_uri', default='', required=False, type=str, help='Identity provider JWKS url used with jwks token validation. If empty it is discovered from issuer openid configuration (default=empty)') 
+	parser.add_argument('-token_cache_size','--token_cache_size', dest='token_cache_size', default=1024, required=False, type=int, help='Max number of validated access tokens cached per process (0=no cache) (default=1024)') 
 	parser.add_argument('--ssl', dest='ssl', action='store_true')	
 	parser.set_defaults(ssl=False)
 	
@@ -77,6 +103,10 @@ def get_args():
 	parser.add_argument('--no-db', dest='db', action='store_false')
 	parser.add_argument('--db', dest='db', action='store_true')	
 	parser.set_defaults(db=True)
+	parser.add_argument('--no-changestreams', dest='changestreams', action='store_false', help='Do not use MongoDB change streams to watch job state transitions, poll active jobs instead')
+	parser.set_defaults(changestreams=True)
+	parser.add_argument('-job_events_poll_period','--job_events_poll_period', dest='job_events_poll_period', default=2, required=False, type=float, help='Job state polling period in seconds when change streams are not used (default=2)')
+	parser.add_argument('-job_events_max_wsgi_streams','--job_events_max_wsgi_streams', dest='job_events_max_wsgi_streams', default=1, required=False, type=int, help='Max number of job event streams served concurrently by each WSGI process, each one holding a worker thread (default=1, 0=no limit)')
 	parser.add_argument('-dbhost','--dbhost', dest='dbhost', default='localhost', required=False, type=str, help='Host of MongoDB database (default=localhost)')
 	parser.add_argument('-dbname','--dbname', dest='dbname', default='caesardb', required=False, type=str, help='Name of MongoDB database (default=caesardb)')
 	parser.add_argument('-dbport','--dbport', dest='dbport', default=27017, required=False, type=int, help='Port of MongoDB database (default=27017)')
@@ -113,6 +143,14 @@ def get_args():
 	parser.add_argument('-slurm_jobdir','--slurm_jobdir', dest='slurm_jobdir', default='/mnt/storage/jobs', required=False, type=str, help='Path at which the job directory is mounted in Slurm cluster')	
 	parser.add_argument('-slurm_datadir','--slurm_datadir', dest='slurm_datadir', default='/mnt/storage/data', required=False, type=str, help='Path at which the data directory is mounted in Slurm cluster')	
 	parser.add_argument('-slurm_max_cores_per_job','--slurm_max_cores_per_job', dest='slurm_max_cores_per_job', default=4, required=False, type=int, help='Slurm maximum number of cores reserved for a job (default=4)')
+	parser.add_argument('-slurm_pool_maxsize','--slurm_pool_maxsize', dest='slurm_pool_maxsize', default=16, required=False, type=int, help='Max number of keep-alive connections to Slurm rest service (default=16)')
+	parser.add_argument('-slurm_max_retries','--slurm_max_retries', dest='slurm_max_retries', default=3, required=False, type=int, help='Max number of retries of failed Slurm rest requests (default=3)')
+
+	# - Quota options
+	parser.add_argument('-quota_max_storage','--quota_max_storage', dest='quota_max_storage', default=0, required=False, type=float, help='Max storage (data+jobs) per user in GB (0=no quota) (default=0)')
+	parser.add_argument('-quota_max_active_jobs','--quota_max_active_jobs', dest='quota_max_active_jobs', default=0, required=False, type=int, help='Max number of concurrent (pending/running) jobs per user (0=no quota) (default=0)')
+	parser.add_argument('-quota_max_cpu_hours','--quota_max_cpu_hours', dest='quota_max_cpu_hours', default=0, required=False, type=float, help='Max job runtime per user in hours (0=no quota) (default=0)')
+	parser.add_argument('-quota_cache_ttl','--quota_cache_ttl', dest='quota_cache_ttl', default=10, required=False, type=float, help='Time in seconds user usage counters are cached before being read again from DB (default=10)')
 	
 
 	# - Volume mount options
@@ -140,8 +178,15 @@ except Exception as ex:
 # - Dir options
 datadir= args.datadir
 jobdir= args.jobdir
+catalogdir= args.catalogdir
 debug= args.debug
 
+# - Post-processing options
+preview_renderer= args.preview_renderer
+if preview_renderer not in img_utils.PREVIEW_RENDERERS:
+	logger.error("Unsupported preview renderer (hint: supported are {fast,matplotlib})!")
+	sys.exit(1)
+
 # - Log level options
 loglevel= args.loglevel
 logtofile= args.logtofile
@@ -149,13 +194,20 @@ logdir= args.logdir
 logfile= args.logfile
 logfilepath= os.path.join(logdir,logfile)
 logfile_maxsize= args.logfile_maxsize
+logformat= args.logformat
+if logformat not in LOG_FORMATS:
+	logger.error("Unsupported log format (hint: supported are {json,console})!")
+	sys.exit(1)
+
+# - Set console log format and rate limits of repetitive log events
+handler_stream.setFormatter(make_log_formatter(logformat))
+log_rate_limiter.burst= args.log_rate_burst
+log_rate_limiter.period= args.log_rate_period
 
 if logtofile:
 	logger.info("Enabling logging to file %s ..." % logfilepath)
 	
-	formatter_file= structlog.stdlib.ProcessorFormatter(
-		processor=structlog.processors.JSONRenderer(),
-	)
+	formatter_file= make_log_formatter('json')
 
 	try:
 		handler_file= logging.handlers.RotatingFileHandler(
@@ -168,7 +220,7 @@ if logtofile:
 		sys.exit(1)
 
 	handler_file.setFormatter(formatter_file)
-	logger.addHandler(handler_file)
+	log_dispatcher.add_handler(handler_file)
 
 logger.info("Setting log level to %s ..." % loglevel)
 logger.setLevel(loglevel)
@@ -179,6 +231,10 @@ logger.setLevel(loglevel)
 use_aai= args.aai
 secret_file= args.secretfile
 openid_realm= args.openid_realm
+token_validation= args.token_validation
+if token_validation not in ('introspection', 'jwks'):
+	logger.error("Unsupported token validation method (hint: supported are {introspection,jwks})!")
+	sys.exit(1)
 ssl= args.ssl
 
 # - App options
@@ -253,6 +309,8 @@ slurm_queue= args.slurm_queue
 slurm_jobdir= args.slurm_jobdir
 slurm_datadir= args.slurm_datadir
 slurm_max_cores_per_job= args.slurm_max_cores_per_job
+slurm_pool_maxsize= args.slurm_pool_maxsize
+slurm_max_retries= args.slurm_max_retries
 	
 #===============================
 #==   INIT
@@ -262,8 +320,17 @@ logger.info("Creating app configuration ...")
 config= Config()
 config.UPLOAD_FOLDER= datadir
 config.JOB_DIR= jobdir
+config.CATALOG_DIR= catalogdir
+config.PREVIEW_RENDERER= preview_renderer
 config.USE_AAI= False
 config.JOB_MONITORING_PERIOD= job_monitoring_period
+config.JOB_UPDATE_BATCH_SIZE= args.job_update_batch_size
+config.JOB_UPDATE_FLUSH_PERIOD= args.job_update_flush_period
+config.JOB_UPDATE_METRICS_PERIOD= args.job_update_metrics_period
+job_update_writer.initialize(config.JOB_UPDATE_BATCH_SIZE, config.JOB_UPDATE_FLUSH_PERIOD, config.JOB_UPDATE_METRICS_PERIOD)
+config.JOB_EVENTS_USE_CHANGE_STREAMS= args.changestreams
+config.JOB_EVENTS_POLL_PERIOD= args.job_events_poll_period
+config.JOB_EVENTS_MAX_WSGI_STREAMS= args.job_events_max_wsgi_streams
 
 if use_aai and oidc is not None:
 	config.USE_AAI= True
@@ -271,6 +338,9 @@ if use_aai and oidc is not None:
 	config.OIDC_CLIENT_SECRETS= secret_file
 	config.OIDC_OPENID_REALM= openid_realm
 	config.OIDC_TOKEN_TYPE_HINT = 'access_token'
+	config.OIDC_TOKEN_VALIDATION= token_validation
+	config.OIDC_JWKS_URI= args.jwks_uri
+	config.OIDC_TOKEN_CACHE_SIZE= args.token_cache_size
 
 
 if use_db and mongo is not None:
@@ -298,6 +368,13 @@ config.SLURM_PORT= slurm_port
 config.SLURM_JOB_DIR= slurm_jobdir
 config.SLURM_DATA_DIR= slurm_datadir
 config.SLURM_MAX_CORE_PER_JOB= slurm_max_cores_per_job
+config.SLURM_POOL_MAXSIZE= slurm_pool_maxsize
+config.SLURM_MAX_RETRIES= slurm_max_retries
+
+config.QUOTA_MAX_STORAGE= args.quota_max_storage
+config.QUOTA_MAX_ACTIVE_JOBS= args.quota_max_active_jobs
+config.QUOTA_MAX_CPU_HOURS= args.quota_max_cpu_hours
+config.QUOTA_CACHE_TTL= args.quota_cache_ttl
 
 config.MOUNT_RCLONE_VOLUME= args.mount_rclone_volume
 config.MOUNT_VOLUME_PATH= args.mount_volume_path
@@ -308,6 +385,9 @@ config.LOG_TO_FILE= logtofile
 config.LOG_LEVEL= loglevel
 config.LOG_DIR= logdir
 config.LOG_FILE= logfile
+config.LOG_FORMAT= logformat
+config.LOG_RATE_BURST= args.log_rate_burst
+config.LOG_RATE_PERIOD= args.log_rate_period
 
 # - Create data manager (DEPRECATED BY MONGO)
 ##logger.info("Creating data manager ...")
@@ -340,20 +420,25 @@ if use_aai and oidc is not None:
 		oidc.init_app(app)
 	except:
 		logger.error("Failed to initialize OIDC to app!")
+
+	# - Set token cache and JWKS verifier options
+	token_cache.maxsize= config.OIDC_TOKEN_CACHE_SIZE
+	jwks_verifier.jwks_uri= config.OIDC_JWKS_URI
+	jwks_verifier.issuer= oidc.client_secrets.get('issuer', '') if getattr(oidc, 'client_secrets', None) else ''
+	logger.info("Validating access tokens with method %s (token cache size=%d) ..." % (config.OIDC_TOKEN_VALIDATION, config.OIDC_TOKEN_CACHE_SIZE))
 else:
 	logger.info("Starting app without AAI ...")
 
 #===============================
-#==   INIT MONGO TO APP
+#==   PRELOAD READ-ONLY STATE
 #===============================
-if use_db and mongo is not None:
-	logger.info("Initializing MongoDB to app ...")
-	try:
-		mongo.init_app(app)
-	except:
-		logger.error("Failed to initialize MongoDB to app!")
-else:
-	logger.info("Starting app without mongo backend ...")
+# - Build app option schemas and serialized app descriptions once
+#   NB: In uWSGI preload mode (lazy-apps=false) this is done in master and shared copy-on-write by workers
+logger.info("Preloading app configurators ...")
+jobcfg.preload()
+
+# - Set quota usage cache lifetime
+quota_manager.cache_ttl= config.QUOTA_CACHE_TTL
 
 #============================================
 #==   INIT KUBERNETES CLIENT (if enabled)
@@ -392,6 +477,8 @@ if job_scheduler=='slurm' and jobmgr_slurm is not None:
 	jobmgr_slurm.app_jobdir= config.JOB_DIR
 	jobmgr_slurm.app_datadir= config.UPLOAD_FOLDER
 	jobmgr_slurm.max_cores= config.SLURM_MAX_CORE_PER_JOB
+	jobmgr_slurm.pool_maxsize= config.SLURM_POOL_MAXSIZE
+	jobmgr_slurm.max_retries= config.SLURM_MAX_RETRIES
 
 	# - Initialize client
 	logger.info("Initializing Slurm job manager ...")
@@ -403,6 +490,66 @@ if job_scheduler=='slurm' and jobmgr_slurm is not None:
 		logger.error("Failed to initialize Slurm job manager (err=%s)!" % str(e))
 		sys.exit(1)
 
+#============================================
+#==   INIT CONNECTIONS
+#============================================
+def is_uwsgi_preload():
+	""" Return True if app is loaded by uWSGI master before forking workers (lazy-apps=false) """
+
+	if uwsgi is None or postfork is None:
+		return False
+
+	def is_set(opt):
+		value= uwsgi.opt.get(opt, False)
+		if isinstance(value, bytes):
+			value= value.decode('utf-8')
+		return value is True or str(value).lower() in ('true', '1', 'yes', 'on')
+
+	return is_set('master') and not is_set('lazy-apps') and not is_set('lazy')
+
+
+def init_connections(forked=False):
+	""" Create connection-holding objects (Mongo client, scheduler HTTP sessions). In uWSGI preload mode this is run in each worker after fork. """
+
+	# - Init mongo
+	if use_db and mongo is not None:
+		logger.info("Initializing MongoDB to app (pid=%d) ..." % os.getpid())
+		try:
+			mongo.init_app(app)
+		except:
+			logger.error("Failed to initialize MongoDB to app!")
+
+		# - Set DB to job event watcher (started on first event subscription)
+		job_event_watcher.initialize(mongo.db, config.JOB_EVENTS_POLL_PERIOD, config.JOB_EVENTS_USE_CHANGE_STREAMS)
+	else:
+		logger.info("Starting app without mongo backend ...")
+
+	if not forked:
+		return
+
+	# - Make sure log listener thread runs in worker (restarted by fork hook)
+	log_dispatcher.start()
+
+	# - Recreate scheduler clients holding connection pools created in master
+	if job_scheduler=='kubernetes' and jobmgr_kube is not None:
+		if jobmgr_kube.create_batch_api_instance()<0:
+			logger.error("Failed to create Kube batch API instance in worker (pid=%d)!" % os.getpid())
+	if job_scheduler=='slurm' and jobmgr_slurm is not None:
+		if jobmgr_slurm.create_session() is None:
+			logger.error("Failed to create Slurm HTTP session in worker (pid=%d)!" % os.getpid())
+
+
+if is_uwsgi_preload():
+	logger.info("App preloaded in uWSGI master, connections will be created in workers after fork ...")
+	postfork(lambda: init_connections(forked=True))
+
+	# - Move objects created so far to GC permanent generation, so that collections in workers
+	#   do not touch (and copy) memory pages shared with master (python>=3.7)
+	if hasattr(gc, 'freeze'):
+		gc.freeze()
+else:
+	init_connections()
+
 
 ###################
 ##   MAIN EXEC   ##
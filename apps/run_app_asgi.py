@@ -0,0 +1,77 @@
+from __future__ import print_function
+
+############################################################
+#              MODULE IMPORTS
+############################################################
+# - Standard modules
+import sys
+import argparse
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses ASGI server arguments and returns them with the remaining (app) arguments"""
+	parser = argparse.ArgumentParser(description="Run caesar-rest ASGI front-end (all other options are passed to run_app.py)", add_help=False)
+
+	parser.add_argument('-asgi_host','--asgi_host', dest='asgi_host', default='127.0.0.1', required=False, type=str, help='Host where ASGI server listens (default=127.0.0.1)')
+	parser.add_argument('-asgi_port','--asgi_port', dest='asgi_port', default=8000, required=False, type=int, help='Port where ASGI server listens (default=8000)')
+	parser.add_argument('-asgi_root_path','--asgi_root_path', dest='asgi_root_path', default='', required=False, type=str, help='Root path when served behind a proxy under a sub-path (default=empty)')
+	parser.add_argument('-asgi_keepalive','--asgi_keepalive', dest='asgi_keepalive', default=65, required=False, type=int, help='HTTP keep-alive timeout in seconds (default=65)')
+	parser.add_argument('--no_wsgi_fallback', dest='wsgi_fallback', action='store_false', help='Do not forward requests not served by async handlers to the Flask app')
+	parser.set_defaults(wsgi_fallback=True)
+
+	return parser.parse_known_args()
+
+
+#===========================
+#==   PARSE ARGS
+#===========================
+# - Leave app options to run_app, which parses them at import
+args, app_argv= get_args()
+sys.argv= [sys.argv[0]] + app_argv
+
+# - Create config, job configurator and Flask app (app options are parsed by run_app at import)
+import run_app
+from caesar_rest import logger
+from caesar_rest.asgi_app import create_asgi_app
+
+#===============================
+#==   CREATE ASGI APP
+#===============================
+logger.info("Creating ASGI app ...")
+try:
+	wsgi_app= run_app.app if args.wsgi_fallback else None
+	asgi_app= create_asgi_app(run_app.config, run_app.jobcfg, wsgi_app)
+except ImportError as e:
+	logger.error("Failed to create ASGI app (err=%s)!" % str(e))
+	sys.exit(1)
+
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+
+	#===============================
+	#==   RUN APP
+	#===============================
+	try:
+		import uvicorn
+	except ImportError:
+		logger.error("uvicorn module not found, cannot run ASGI server (hint: install uvicorn)!")
+		sys.exit(1)
+
+	logger.info("Running ASGI app on %s:%d ..." % (args.asgi_host, args.asgi_port))
+	uvicorn.run(
+		asgi_app,
+		host=args.asgi_host,
+		port=args.asgi_port,
+		root_path=args.asgi_root_path,
+		timeout_keep_alive=args.asgi_keepalive,
+		proxy_headers=True,
+		log_config=None
+	)
+
+	sys.exit(0)
+
@@ -9,7 +9,6 @@ import sys
 import json
 import time
 import datetime
-import numpy as np
 import argparse
 
 # Import mongo
@@ -19,6 +18,7 @@ from pymongo import MongoClient
 import caesar_rest
 from caesar_rest import __version__, __date__
 from caesar_rest import logger
+from caesar_rest import celery
 from caesar_rest import jobmgr_kube
 from caesar_rest import jobmgr_slurm
 from caesar_rest import job_monitor
@@ -46,8 +46,18 @@ def get_args():
 	parser.add_argument('-dbhost','--dbhost', dest='dbhost', default='localhost', required=False, type=str, help='Host of MongoDB database (default=localhost)')
 	parser.add_argument('-dbname','--dbname', dest='dbname', default='caesardb', required=False, type=str, help='Name of MongoDB database (default=caesardb)')
 	parser.add_argument('-dbport','--dbport', dest='dbport', default=27017, required=False, type=int, help='Port of MongoDB database (default=27017)')
-
+	parser.add_argument('-nthreads','--nthreads', dest='nthreads', default=8, required=False, type=int, help='Number of threads used to query job status for each scheduler (default=8)')
+	parser.add_argument('-job_update_batch_size','--job_update_batch_size', dest='job_update_batch_size', default=100, required=False, type=int, help='Max number of job updates written with a single DB bulk write (default=100)')
+	parser.add_argument('-job_update_metrics_period','--job_update_metrics_period', dest='job_update_metrics_period', default=300, required=False, type=float, help='Period in seconds of DB write metrics logs (default=300, 0=never)')
+	parser.add_argument('-catalogdir','--catalogdir', dest='catalogdir', default='', required=False, type=str, help='Directory where to store columnar source catalogs of completed jobs (default=empty, ingestion disabled)')
 	
+	# - Celery broker options (archives of completed jobs are created by tasks on the postprocess queue)
+	parser.add_argument('-broker_host','--broker_host', dest='broker_host', default='localhost', required=False, type=str, help='Host of Celery broker (default=localhost)')
+	parser.add_argument('-broker_port','--broker_port', dest='broker_port', default=5672, required=False, type=int, help='Port of Celery broker (default=5672)')
+	parser.add_argument('-broker_proto','--broker_proto', dest='broker_proto', default='amqp', required=False, type=str, help='Protocol of Celery broker (default=amqp)')
+	parser.add_argument('-broker_user','--broker_user', dest='broker_user', default='guest', required=False, type=str, help='Username used in Celery broker (default=guest)')
+	parser.add_argument('-broker_pass','--broker_pass', dest='broker_pass', default='guest', required=False, type=str, help='Password used in Celery broker (default=guest)')
+
 	# - Kubernetes scheduler options
 	parser.add_argument('--kube_incluster', dest='kube_incluster', action='store_true')	
 	parser.set_defaults(kube_incluster=False)
@@ -55,12 +65,17 @@ def get_args():
 	parser.add_argument('-kube_cafile','--kube_cafile', dest='kube_cafile', default='', required=False, type=str, help='Kube certificate authority file path')
 	parser.add_argument('-kube_keyfile','--kube_keyfile', dest='kube_keyfile', default='', required=False, type=str, help='Kube private key file path')
 	parser.add_argument('-kube_certfile','--kube_certfile', dest='kube_certfile', default='', required=False, type=str, help='Kube certificate file path')
+	parser.add_argument('--kube_watch', dest='kube_watch', action='store_true', help='Track Kube job status with a single watch stream instead of querying each job at every monitoring cycle')	
+	parser.set_defaults(kube_watch=False)
+	parser.add_argument('-kube_watch_timeout','--kube_watch_timeout', dest='kube_watch_timeout', default=300, required=False, type=int, help='Server-side timeout in seconds of each Kube job watch request (default=300)')
 	
 	# - Slurm scheduler options
 	parser.add_argument('-slurm_keyfile','--slurm_keyfile', dest='slurm_keyfile', default='', required=False, type=str, help='Slurm rest service private key file path')
 	parser.add_argument('-slurm_user','--slurm_user', dest='slurm_user', default='cirasa', required=False, type=str, help='Username enabled to run in Slurm cluster')
 	parser.add_argument('-slurm_host','--slurm_host', dest='slurm_host', default='SLURM_HOST', required=False, type=str, help='Slurm cluster host/ipaddress')
 	parser.add_argument('-slurm_port','--slurm_port', dest='slurm_port', default=6820, required=False, type=int, help='Slurm rest service port')
+	parser.add_argument('-slurm_pool_maxsize','--slurm_pool_maxsize', dest='slurm_pool_maxsize', default=16, required=False, type=int, help='Max number of keep-alive connections to Slurm rest service (default=16)')
+	parser.add_argument('-slurm_max_retries','--slurm_max_retries', dest='slurm_max_retries', default=3, required=False, type=int, help='Max number of retries of failed Slurm rest requests (default=3)')
 	
 	args = parser.parse_args()	
 
@@ -94,6 +109,12 @@ def main():
 		logger.error("Chosen scheduler is Kubernetes but kube client failed to be instantiated (see previous logs)!")
 		sys.exit(1)
 
+	#===============================
+	#==   SET CELERY BROKER
+	#===============================
+	broker_url= args.broker_proto + '://' + args.broker_user + ':' + args.broker_pass + '@' + args.broker_host + ':' + str(args.broker_port) + '/'
+	celery.conf.broker_url= broker_url
+
 	#===============================
 	#==   INIT MONGO CLIENT
 	#===============================
@@ -145,6 +166,13 @@ def main():
 			logger.error("Failed to initialize Kube job manager (err=%s)!" % str(e))
 			sys.exit(1)
 
+		# - Start job watch
+		if args.kube_watch:
+			logger.info("Starting Kube job watch ...")
+			if jobmgr_kube.start_job_watch(timeout=args.kube_watch_timeout)<0:
+				logger.error("Failed to start Kube job watch, see logs!")
+				sys.exit(1)
+
 	#============================================
 	#==   INIT SLURM CLIENT (if enabled)
 	#============================================
@@ -155,6 +183,8 @@ def main():
 		jobmgr_slurm.port= args.slurm_port
 		jobmgr_slurm.keyfile= args.slurm_keyfile
 		jobmgr_slurm.username= args.slurm_user
+		jobmgr_slurm.pool_maxsize= args.slurm_pool_maxsize
+		jobmgr_slurm.max_retries= args.slurm_max_retries
 		
 		# - Initialize client
 		logger.info("Initializing Slurm job manager ...")
@@ -169,19 +199,21 @@ def main():
 	#============================================
 	#==   MONITORING LOOP
 	#============================================
+	job_monitor.job_monitor_writer.initialize(max_size=args.job_update_batch_size, flush_period=0, metrics_period=args.job_update_metrics_period)
+
 	try:
 		while True:
 			# - Monitor jobs in DB
-			logger.info("Monitoring jobs ...")
-			if monitor_jobs(db)<0:
-				logger.warn("Failed to monitor jobs (see logs) ...")
+			logger.debug("Monitoring jobs ...")
+			if monitor_jobs(db, args.catalogdir, nthreads=args.nthreads, db_host=args.dbhost, db_port=args.dbport)<0:
+				logger.warn("Failed to monitor jobs (see logs) ...", event_type="jobmonitor.failure")
 
 			# - Sleeping a bit before monitoring again
-			logger.info("Sleeping %s seconds ..." % job_monitoring_period)
+			logger.debug("Sleeping %s seconds ..." % job_monitoring_period)
 			time.sleep(job_monitoring_period)
 						
 	except KeyboardInterrupt:
-		logger.info("Job monitoring interrupted with ctrl-c signal")
+		logger.info("Job monitoring interrupted with ctrl-c signal ...")
 		return -1	
 
 
@@ -20,10 +20,12 @@ import logging.handlers
 
 # - Create the struct logger
 import structlog
+from caesar_rest.log_utils import log_dispatcher, log_rate_limiter, make_log_formatter
 
 structlog.configure(
 	processors=[
 		structlog.stdlib.filter_by_level,
+		log_rate_limiter,
 		structlog.processors.TimeStamper(fmt="iso"),
 #		structlog.processors.TimeStamper(fmt="%Y-%m-%d %H:%M:%S"),
 		structlog.stdlib.add_logger_name,
@@ -42,12 +44,11 @@ structlog.configure(
 )
 
 
-# - Define console logger
-formatter_stream = structlog.stdlib.ProcessorFormatter(
-	processor= structlog.dev.ConsoleRenderer()
-)
+# - Define console logger (json lines, see log_utils for console renderer)
+#   NB: Handlers are run in a background thread by the log dispatcher, never on the request thread
 handler_stream= logging.StreamHandler()
-handler_stream.setFormatter(formatter_stream)
+handler_stream.setFormatter(make_log_formatter('json'))
+log_dispatcher.add_handler(handler_stream)
 
 # - Define file json logger
 #formatter_file= structlog.stdlib.ProcessorFormatter(
@@ -63,7 +64,8 @@ handler_stream.setFormatter(formatter_stream)
 
 # - Define root logger and add handlers
 logger= structlog.getLogger(__name__)
-logger.addHandler(handler_stream)
+log_dispatcher.attach(logger)
+log_dispatcher.start()
 #logger.addHandler(handler_file)
 logger.setLevel("INFO")
 
@@ -10,9 +10,9 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import subprocess
 import datetime
+import threading
 
 try:
 	FileNotFoundError  # python3
@@ -36,6 +36,9 @@ from celery.exceptions import Ignore, SoftTimeLimitExceeded
 # Import Celery app
 from caesar_rest.app import celery as celery_app
 from caesar_rest import utils
+from caesar_rest import storage_usage
+from caesar_rest import accounting_history
+from caesar_rest import active_jobs
 #from caesar_rest.app import CustomTask
 
 # Import mongo
@@ -98,231 +101,154 @@ def accounter_task(self):
 		logger.error(errmsg, action="accounter")
 		return
 
-	# - Init DB data structure
-	logger.info("Creating data file object ...", action="accounter")
-	now= datetime.datetime.utcnow()
-	account_data= {}
-
-	# - Traverse job directory and get users info
-	users= []
-	try:
-		users= [name for name in os.listdir(JOB_DIR) if os.path.isdir(os.path.join(JOB_DIR,name))]
-	except:
-		errmsg= 'Cannot retrieve job directory ' + str(JOB_DIR) + " (please check if existing on storage)!"
-		logger.error(errmsg, action="accounter")
-		return
+	# - Trigger a storage scan if storage usage counters were never initialized
+	if storage_usage.get_all_storage_usage(client[DB_NAME])=={}:
+		logger.info("No storage usage counters found in DB, submitting storage reconciler task ...", action="accounter")
+		storage_reconciler_task.apply_async(expires=3600)
 
-	if users:
-		logger.info("Found these users under job dir %s " % JOB_DIR, action="accounter")
-		print(users)
+	# - Update accounting info from storage usage counters & job DB
+	if update_account_info(client[DB_NAME], JOB_DIR, DATA_DIR)<0:
+		logger.warn("Failed to update accounting info (see logs) ...", action="accounter")
 
-		for user in users:
-			userdir= os.path.join(JOB_DIR,user)
-			dirsize= utils.get_dir_size(userdir)
-			logger.info("User %s data dir size=%f" % (userdir,dirsize), action="accounter", user=user)
 
-			if user in account_data:
-				account_data[user]["jobsize"]= dirsize
-			else:	
-				account_data[user]= {}
-				account_data[user]["timestamp"]= now
-				account_data[user]["jobsize"]= dirsize
-
-	
-	# - Traverse data directory and get users info
-	users= []
-	try:
-		users= [name for name in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR,name))]
-	except:
-		errmsg= 'Cannot retrieve data directory ' + str(DATA_DIR) + " (please check if existing on storage)!"
-		logger.error(errmsg, action="accounter")
-		return
+@celery_app.task(bind=True)
+def storage_reconciler_task(self):
+	""" Storage usage reconciler task (rescan job & data directories and reset storage usage counters) """
 
-	if users:
-		logger.info("Found these users under data dir %s " % DATA_DIR, action="accounter")
-		print(users)
-
-		for user in users:
-			userdir= os.path.join(DATA_DIR,user)
-			dirsize= utils.get_dir_size(userdir)
-			logger.info("User %s job dir size=%f" % (userdir,dirsize), action="accounter", user=user)
-
-			if user in account_data:
-				account_data[user]["datasize"]= dirsize
-			else:	
-				account_data[user]= {}
-				account_data[user]["timestamp"]= now
-				account_data[user]["datasize"]= dirsize
-	
-	# - Query job DB and derive job information for all users
-	logger.info("Query job DB and compute job stats for all users ...", action="accounter")
+	logger.info("Executing storage reconciler task ...", action="accounter")
 
-	for username in account_data:
-		collection_name= username + '.jobs'
-		job_list= []
-
-		try:
-			job_collection= client[DB_NAME][collection_name]
-			job_cursor= job_collection.find({})
-			job_list = list(job_cursor)
+	# - Check first required env variables
+	DB_NAME= os.environ.get('CAESAR_REST_DBNAME')
+	DB_HOST= os.environ.get('CAESAR_REST_DBHOST')
+	DB_PORT= os.environ.get('CAESAR_REST_DBPORT')
+	JOB_DIR= os.environ.get('CAESAR_REST_JOBDIR')
+	DATA_DIR= os.environ.get('CAESAR_REST_DATADIR')
+	NTHREADS= int(os.environ.get('CAESAR_REST_RECONCILE_NTHREADS', storage_usage.RECONCILE_NTHREADS))
 
-		except Exception as e:
-			errmsg= 'Failed to get jobs from DB for user ' + username + ' (err=' + str(e) + ')'
-			logger.error(errmsg, action="accounter", user=username)
-			continue
-		
-		# - Compute some job stats
-		n_jobs= len(job_list)
-		n_jobs_pending= 0
-		n_jobs_completed= 0
-		n_jobs_failed= 0
-		n_jobs_aborted= 0
-		n_jobs_running= 0
-		n_jobs_unknown= 0
-		job_runtime= 0
-		job_completed_runtime= 0
-
-		for job in job_list:
-			#print("job")
-			#print(job)
-			job_state= 'UNKNOWN'
-			job_elapsed_time= 0.
-			job_completed_elapsed_time= 0.
-			if "state" in job:
-				job_state= job["state"]
-			if "elapsed_time" in job:
-				job_elapsed_time= 0
-				if job["elapsed_time"]!="":
-					dt= float(job["elapsed_time"])
-					if dt>=0:
-						job_elapsed_time= dt
-
-				if job_state=="SUCCESS":
-					job_completed_elapsed_time= 0
-					if job["elapsed_time"]!="":
-						dt= float(job["elapsed_time"])
-						if dt>=0:
-							job_completed_elapsed_time= dt
-
-			
-			job_runtime+= job_elapsed_time
-			job_completed_runtime+= job_completed_elapsed_time
-
-			if job_state=="SUCCESS":
-				n_jobs_completed+= 1
-			elif job_state=="FAILURE":
-				n_jobs_failed+= 1
-			elif job_state=="ABORTED":
-				n_jobs_aborted+= 1
-			elif job_state=="RUNNING" or job_state=="STARTED":
-				n_jobs_running+= 1
-			elif job_state=="PENDING":
-				n_jobs_pending+= 1
-			else:
-				n_jobs_unknown+= 1
+	if DB_NAME is None or DB_NAME=="" or DB_HOST is None or DB_HOST=="" or DB_PORT is None or DB_PORT=="":
+		logger.warn("Env vars CAESAR_REST_DBNAME/CAESAR_REST_DBHOST/CAESAR_REST_DBPORT not defined, please set them to backend DB options...", action="accounter")
+		return
+	if JOB_DIR is None or JOB_DIR=="" or DATA_DIR is None or DATA_DIR=="":
+		logger.warn("Env vars CAESAR_REST_JOBDIR/CAESAR_REST_DATADIR not defined, please set them to job & data top dir names ...", action="accounter")
+		return
 
-		# - Update account data with job stats
-		account_data[username]["job_runtime"]= job_runtime
-		account_data[username]["job_completed_runtime"]= job_completed_runtime
-		account_data[username]["njobs"]= n_jobs
-		account_data[username]["njobs_completed"]= n_jobs_completed
-		account_data[username]["njobs_failed"]= n_jobs_failed
-		account_data[username]["njobs_aborted"]= n_jobs_aborted
-		account_data[username]["njobs_pending"]= n_jobs_pending
-		account_data[username]["njobs_running"]= n_jobs_running
-		account_data[username]["njobs_unknown"]= n_jobs_unknown
-		
-	print("account_data")
-	print(account_data)
+	try:
+		client= MongoClient(DB_HOST, int(DB_PORT))
+	except Exception as e:
+		logger.error("Exception caught when connecting to DB server (err=%s)!" % str(e), action="accounter")
+		return
 
-	# - Compute app cumulative info from single accounts
-	app_data= {}
-	app_data["timestamp"]= now
-	app_data["nusers"]= len(account_data)
-	app_data["datasize"]= 0
-	app_data["jobsize"]= 0
-	app_data["totsize"]= 0
-	app_data["njobs"]= 0
-	app_data["njobs_completed"]= 0
-	app_data["njobs_failed"]= 0
-	app_data["njobs_aborted"]= 0
-	app_data["njobs_pending"]= 0
-	app_data["njobs_running"]= 0
-	app_data["njobs_unknown"]= 0
-	app_data["job_runtime"]= 0
-	app_data["job_completed_runtime"]= 0
-	app_data["avg_completed_job_runtime"]= 0
+	if storage_usage.reconcile_storage_usage(client[DB_NAME], JOB_DIR, DATA_DIR, NTHREADS)<0:
+		logger.warn("Failed to reconcile storage usage counters (see logs) ...", action="accounter")
 
-	for username in account_data:
-		data= account_data[username]
-		
-		if "datasize" in data:
-			app_data["datasize"]+= data["datasize"]
-			app_data["totsize"]+= data["datasize"]
 
-		if "jobsize" in data:
-			app_data["jobsize"]+= data["jobsize"]
-			app_data["totsize"]+= data["jobsize"]
+####################################
+##   JOB STATS
+####################################
+# - Aggregation pipeline computing number of jobs and total elapsed time per job state on DB server
+#   NB: Negative elapsed times are counted as 0. Non numeric values (e.g. '' or '0' set at submission) are ignored by $sum.
+JOB_STATS_PIPELINE= [
+	{'$group': {
+		'_id': {'$ifNull': ['$state', 'UNKNOWN']},
+		'njobs': {'$sum': 1},
+		'runtime': {'$sum': {'$cond': [{'$gt': ['$elapsed_time', 0]}, '$elapsed_time', 0]}}
+	}}
+]
+
+def get_job_stats(job_collection):
+	""" Return job counts and runtimes of a user job collection computed with an aggregation pipeline (a few documents returned per user) """
+
+	job_stats= {
+		"njobs": 0,
+		"njobs_completed": 0,
+		"njobs_failed": 0,
+		"njobs_aborted": 0,
+		"njobs_pending": 0,
+		"njobs_running": 0,
+		"njobs_unknown": 0,
+		"job_runtime": 0,
+		"job_completed_runtime": 0
+	}
+
+	for item in job_collection.aggregate(JOB_STATS_PIPELINE):
+		job_state= item['_id']
+		njobs= item['njobs']
+		runtime= item['runtime']
+
+		job_stats["njobs"]+= njobs
+		job_stats["job_runtime"]+= runtime
+
+		if job_state=="SUCCESS":
+			job_stats["njobs_completed"]+= njobs
+			job_stats["job_completed_runtime"]+= runtime
+		elif job_state=="FAILURE":
+			job_stats["njobs_failed"]+= njobs
+		elif job_state=="ABORTED":
+			job_stats["njobs_aborted"]+= njobs
+		elif job_state=="RUNNING" or job_state=="STARTED":
+			job_stats["njobs_running"]+= njobs
+		elif job_state=="PENDING":
+			job_stats["njobs_pending"]+= njobs
+		else:
+			job_stats["njobs_unknown"]+= njobs
 
-		if "njobs" in data:
-			app_data["njobs"]+= data["njobs"]
-		if "njobs_completed" in data:
-			app_data["njobs_completed"]+= data["njobs_completed"]
-		if "njobs_failed" in data:
-			app_data["njobs_failed"]+= data["njobs_failed"]
-		if "njobs_aborted" in data:
-			app_data["njobs_aborted"]+= data["njobs_aborted"]
-		if "njobs_pending" in data:
-			app_data["njobs_pending"]+= data["njobs_pending"]
-		if "njobs_running" in data:
-			app_data["njobs_running"]+= data["njobs_running"]
-		if "njobs_unknown" in data:
-			app_data["njobs_unknown"]+= data["njobs_unknown"]
+	return job_stats
 
-		if "job_runtime" in data:
-			app_data["job_runtime"]+= data["job_runtime"]
-		if "job_completed_runtime" in data:
-			app_data["job_completed_runtime"]+= data["job_completed_runtime"]
 
-	if app_data["njobs_completed"]>0:
-		app_data["avg_completed_job_runtime"]= app_data["job_completed_runtime"]/float(app_data["njobs_completed"])
+####################################
+##   EVENT-DRIVEN JOB STATS
+####################################
+class JobStatsRefresher(object):
+	""" Job event listener refreshing job stats in accounting info of users whose jobs changed state, without waiting for the next accounter cycle """
+
+	def __init__(self):
+
+		self.lock= threading.Lock()
+		self.job_states= {} # job_id -> last seen state (active jobs only)
+		self.usernames= set() # users whose job stats must be refreshed
+		self.event= threading.Event()
+
+	def __call__(self, event):
+		""" Mark job owner for refresh if job state changed (elapsed time updates are skipped) """
+
+		job_id= event['job_id']
+		state= event.get('state', None)
+		with self.lock:
+			if job_id in self.job_states and self.job_states[job_id]==state:
+				return
+			if active_jobs.is_active_state(state):
+				self.job_states[job_id]= state
+			else:
+				self.job_states.pop(job_id, None)
+			self.usernames.add(event['username'])
 
-	# - Dump accounting info to DB
-	logger.info("Dumping accounting info to DB ...", action="accounter")
-	for username in account_data:
-		data= account_data[username]
-		collection_name= username + '.accounting'
+		self.event.set()
 
-		try:
-			coll= client[DB_NAME][collection_name]
-			item= coll.find_one()
-			if item is None:
-				coll.insert_one(data)
-			else:
-				coll.update_one({'_id':item['_id']},{'$set':data},upsert=False)
-		except Exception as e:
-			errmsg= 'Exception caught when updating account data for user '+  username + ' in DB (err=' + str(e) + ')!'
-			logger.error(errmsg, action="accounter", user=username)
-			continue
+	def wait(self, timeout=None):
+		""" Wait until some user job stats must be refreshed or timeout expires. Return True if refresh is needed. """
+		return self.event.wait(timeout)
 
-	# - Dump app stats info to DB
-	logger.info("Dumping app stats into to DB ...", action="accounter")
-	collection_name= 'appstats'
-	try:
-		coll= client[DB_NAME][collection_name]
-		item= coll.find_one()
-		if item is None:
-			coll.insert_one(app_data)
-		else:
-			coll.update_one({'_id':item['_id']},{'$set':app_data},upsert=False)
-	except Exception as e:
-		errmsg= 'Exception caught when updating app stats info data in DB (err=' + str(e) + ')!'
-		logger.error(errmsg, action="accounter")
+	def flush(self, DB):
+		""" Refresh job stats of marked users in their accounting info. Return number of refreshed users. """
 
-	
+		with self.lock:
+			usernames= self.usernames
+			self.usernames= set()
+			self.event.clear()
 
+		now= datetime.datetime.utcnow()
+		for username in usernames:
+			try:
+				data= get_job_stats(DB[username + '.jobs'])
+				data["timestamp"]= now
+				DB[username + '.accounting'].update_one({}, {'$set': data}, upsert=True)
+			except Exception as e:
+				logger.warn("Failed to refresh job stats of user %s (err=%s)!" % (username, str(e)), action="accounter", user=username)
 
+		if usernames:
+			logger.info("Job stats of #%d users refreshed after job state changes ..." % len(usernames), action="accounter", event_type="accounter.refresh")
 
+		return len(usernames)
 
 
 ####################################
@@ -348,122 +274,55 @@ def update_account_info(DB, JOB_DIR, DATA_DIR):
 	now= datetime.datetime.utcnow()
 	account_data= {}
 
-	# - Traverse job directory and get users info
-	users= []
-	try:
-		users= [name for name in os.listdir(JOB_DIR) if os.path.isdir(os.path.join(JOB_DIR,name))]
-	except:
-		errmsg= 'Cannot retrieve job directory ' + str(JOB_DIR) + " (please check if existing on storage)!"
-		logger.error(errmsg, action="accounter")
-		return
-
-	if users:
-		logger.info("Found these users under job dir %s " % JOB_DIR, action="accounter")
-		print(users)
-
-		for user in users:
-			userdir= os.path.join(JOB_DIR,user)
-			dirsize= utils.get_dir_size(userdir)
-			logger.info("User %s data dir size=%f" % (userdir,dirsize), action="accounter", user=user)
-
-			if user in account_data:
-				account_data[user]["jobsize"]= dirsize
-			else:	
-				account_data[user]= {}
-				account_data[user]["timestamp"]= now
-				account_data[user]["jobsize"]= dirsize
-
-	
-	# - Traverse data directory and get users info
-	users= []
-	try:
-		users= [name for name in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR,name))]
-	except:
-		errmsg= 'Cannot retrieve data directory ' + str(DATA_DIR) + " (please check if existing on storage)!"
-		logger.error(errmsg, action="accounter")
-		return
+	# - Get users storage usage from counters (updated incrementally and reconciled periodically, see storage_usage module)
+	#   NB: Users are taken from counters and from job/data directory listing (no directory walk here)
+	counters= storage_usage.get_all_storage_usage(DB)
+	if counters is None:
+		logger.error("Failed to get storage usage counters from DB!", action="accounter")
+		return -1
 
-	if users:
-		logger.info("Found these users under data dir %s " % DATA_DIR, action="accounter")
-		print(users)
-
-		for user in users:
-			userdir= os.path.join(DATA_DIR,user)
-			dirsize= utils.get_dir_size(userdir)
-			logger.info("User %s job dir size=%f" % (userdir,dirsize), action="accounter", user=user)
-
-			if user in account_data:
-				account_data[user]["datasize"]= dirsize
-			else:	
-				account_data[user]= {}
-				account_data[user]["timestamp"]= now
-				account_data[user]["datasize"]= dirsize
+	users= set(counters.keys())
+	for top_dir in [JOB_DIR, DATA_DIR]:
+		try:
+			users.update([name for name in os.listdir(top_dir) if os.path.isdir(os.path.join(top_dir,name))])
+		except OSError:
+			errmsg= 'Cannot retrieve directory ' + str(top_dir) + " (please check if existing on storage)!"
+			logger.error(errmsg, action="accounter")
+			return -1
+
+	for user in users:
+		counter= counters.get(user, {})
+		account_data[user]= {}
+		account_data[user]["timestamp"]= now
+		account_data[user]["jobsize"]= counter.get("jobsize", 0)/1024. # in KB
+		account_data[user]["datasize"]= counter.get("datasize", 0)/1024. # in KB
+		logger.info("User %s job dir size=%f KB, data dir size=%f KB" % (user, account_data[user]["jobsize"], account_data[user]["datasize"]), action="accounter", user=user)
 	
 	# - Query job DB and derive job information for all users
 	logger.info("Query job DB and compute job stats for all users ...", action="accounter")
 
 	for username in account_data:
 		collection_name= username + '.jobs'
-		job_list= []
+		job_stats= None
 
 		try:
 			job_collection= DB[collection_name]
-			job_cursor= job_collection.find({})
-			job_list = list(job_cursor)
+			job_stats= get_job_stats(job_collection)
 
 		except Exception as e:
-			errmsg= 'Failed to get jobs from DB for user ' + username + ' (err=' + str(e) + ')'
+			errmsg= 'Failed to get job stats from DB for user ' + username + ' (err=' + str(e) + ')'
 			logger.error(errmsg, action="accounter", user=username)
 			continue
 		
-		# - Compute some job stats
-		n_jobs= len(job_list)
-		n_jobs_pending= 0
-		n_jobs_completed= 0
-		n_jobs_failed= 0
-		n_jobs_aborted= 0
-		n_jobs_running= 0
-		n_jobs_unknown= 0
-		job_runtime= 0
-		job_completed_runtime= 0
-
-		for job in job_list:
-			#print("job")
-			#print(job)
-			job_state= 'UNKNOWN'
-			job_elapsed_time= 0.
-			job_completed_elapsed_time= 0.
-			if "state" in job:
-				job_state= job["state"]
-			if "elapsed_time" in job:
-				job_elapsed_time= 0
-				if job["elapsed_time"]!="":
-					dt= float(job["elapsed_time"])
-					if dt>=0:
-						job_elapsed_time= dt
-
-				if job_state=="SUCCESS":
-					job_completed_elapsed_time= 0
-					if job["elapsed_time"]!="":
-						dt= float(job["elapsed_time"])
-						if dt>=0:
-							job_completed_elapsed_time= dt
-			
-			job_runtime+= job_elapsed_time
-			job_completed_runtime+= job_completed_elapsed_time
-
-			if job_state=="SUCCESS":
-				n_jobs_completed+= 1
-			elif job_state=="FAILURE":
-				n_jobs_failed+= 1
-			elif job_state=="ABORTED":
-				n_jobs_aborted+= 1
-			elif job_state=="RUNNING" or job_state=="STARTED":
-				n_jobs_running+= 1
-			elif job_state=="PENDING":
-				n_jobs_pending+= 1
-			else:
-				n_jobs_unknown+= 1
+		n_jobs= job_stats["njobs"]
+		n_jobs_pending= job_stats["njobs_pending"]
+		n_jobs_completed= job_stats["njobs_completed"]
+		n_jobs_failed= job_stats["njobs_failed"]
+		n_jobs_aborted= job_stats["njobs_aborted"]
+		n_jobs_running= job_stats["njobs_running"]
+		n_jobs_unknown= job_stats["njobs_unknown"]
+		job_runtime= job_stats["job_runtime"]
+		job_completed_runtime= job_stats["job_completed_runtime"]
 
 		# - Update account data with job stats
 		account_data[username]["job_runtime"]= job_runtime
@@ -476,8 +335,7 @@ def update_account_info(DB, JOB_DIR, DATA_DIR):
 		account_data[username]["njobs_running"]= n_jobs_running
 		account_data[username]["njobs_unknown"]= n_jobs_unknown
 		
-	print("account_data")
-	print(account_data)
+	logger.info("Accounting data computed for #%d users ..." % len(account_data), action="accounter")
 
 	# - Compute app cumulative info from single accounts
 	app_data= {}
@@ -563,8 +421,22 @@ def update_account_info(DB, JOB_DIR, DATA_DIR):
 		errmsg= 'Exception caught when updating app stats info data in DB (err=' + str(e) + ')!'
 		logger.error(errmsg, action="accounter")
 
-	return 0
+	# - Append user & app stats to accounting history (minute samples with hourly/daily rollups)
+	logger.info("Recording accounting history samples ...", action="accounter")
+	samples= {accounting_history.APP_OWNER: app_data}
+	for username in account_data:
+		data= dict(account_data[username])
+		data["totsize"]= data.get("datasize", 0) + data.get("jobsize", 0)
+		samples[username]= data
 
+	accounting_history.init_accounting_history(DB)
+	if accounting_history.record_usage_samples(DB, samples, now)<0:
+		logger.warn("Failed to record accounting history samples!", action="accounter")
 
+	return 0
 
 
+##############################
+#   DEFAULT INSTANCES
+##############################
+job_stats_refresher= JobStatsRefresher()
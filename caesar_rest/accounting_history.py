@@ -0,0 +1,218 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+
+# Import mongo
+import pymongo
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   ACCOUNTING HISTORY
+##############################
+# - Collection storing usage time series of users and app, with a bucketed schema:
+#     {'owner': <username or APP_OWNER>, 'resolution': 'minute'|'hour'|'day', 'bucket_start': <date>, 'expire_at': <date>,
+#      'samples': {'<index>': {'n': .., 'sum': {..}, 'max': {..}, 'last': {..}}}}
+#   NB: Minute samples are stored in hourly buckets, hourly rollups in daily buckets, daily rollups in monthly buckets.
+#       Rollups are updated at each sample with $inc/$max/$set, so no separate rollup job is needed.
+#       Expired buckets are removed by a TTL index on expire_at.
+ACCOUNTING_HISTORY_COLLECTION= 'accounting_history'
+
+# - Owner of app-level (all users) time series
+APP_OWNER= '__app__'
+
+# - Metrics recorded in time series
+HISTORY_FIELDS= [
+	'datasize', 'jobsize', 'totsize', 'nusers',
+	'njobs', 'njobs_completed', 'njobs_failed', 'njobs_aborted', 'njobs_pending', 'njobs_running', 'njobs_unknown',
+	'job_runtime', 'job_completed_runtime'
+]
+
+# - Time series resolutions, from finest to coarsest
+HISTORY_RESOLUTIONS= ['minute', 'hour', 'day']
+
+# - Sample period of each resolution
+HISTORY_PERIODS= {
+	'minute': datetime.timedelta(minutes=1),
+	'hour': datetime.timedelta(hours=1),
+	'day': datetime.timedelta(days=1)
+}
+
+# - Retention of each resolution
+HISTORY_RETENTIONS= {
+	'minute': datetime.timedelta(days=2),
+	'hour': datetime.timedelta(days=90),
+	'day': datetime.timedelta(days=3650)
+}
+
+# - Default max number of points returned by history queries (used to select resolution)
+HISTORY_MAX_POINTS= 500
+
+# - Flag set when the collection indexes have been created in this process
+_initialized= False
+
+
+def init_accounting_history(db):
+	""" Create indexes on accounting history collection """
+
+	global _initialized
+	if _initialized:
+		return 0
+
+	try:
+		collection= db[ACCOUNTING_HISTORY_COLLECTION]
+		collection.create_index([('owner', pymongo.ASCENDING), ('resolution', pymongo.ASCENDING), ('bucket_start', pymongo.ASCENDING)], unique=True)
+		collection.create_index([('expire_at', pymongo.ASCENDING)], expireAfterSeconds=0)
+	except Exception as e:
+		logger.warn("Failed to create accounting history indexes (err=%s)!" % str(e), action="accounter")
+		return -1
+
+	_initialized= True
+
+	return 0
+
+
+def get_bucket(date, resolution):
+	""" Return (bucket start, sample index key, bucket end) of given date for given resolution """
+
+	if resolution=='minute':
+		bucket_start= date.replace(minute=0, second=0, microsecond=0)
+		bucket_end= bucket_start + datetime.timedelta(hours=1)
+		key= '%02d' % date.minute
+	elif resolution=='hour':
+		bucket_start= date.replace(hour=0, minute=0, second=0, microsecond=0)
+		bucket_end= bucket_start + datetime.timedelta(days=1)
+		key= '%02d' % date.hour
+	else:
+		bucket_start= date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+		bucket_end= (bucket_start + datetime.timedelta(days=32)).replace(day=1)
+		key= '%02d' % date.day
+
+	return bucket_start, key, bucket_end
+
+
+def get_sample_date(bucket_start, key, resolution):
+	""" Return start date of sample with given index key in bucket """
+
+	index= int(key)
+	if resolution=='minute':
+		return bucket_start + datetime.timedelta(minutes=index)
+	elif resolution=='hour':
+		return bucket_start + datetime.timedelta(hours=index)
+	return bucket_start + datetime.timedelta(days=index-1)
+
+
+def make_sample_update(owner, values, date, resolution):
+	""" Return (filter, update) adding a sample to the bucket of given resolution """
+
+	bucket_start, key, bucket_end= get_bucket(date, resolution)
+	prefix= 'samples.' + key + '.'
+
+	inc= {prefix + 'n': 1}
+	maxs= {}
+	last= {}
+	for field, value in values.items():
+		inc[prefix + 'sum.' + field]= value
+		maxs[prefix + 'max.' + field]= value
+		last[prefix + 'last.' + field]= value
+	last['expire_at']= bucket_end + HISTORY_RETENTIONS[resolution]
+
+	update= {'$inc': inc, '$set': last}
+	if maxs:
+		update['$max']= maxs
+
+	return {'owner': owner, 'resolution': resolution, 'bucket_start': bucket_start}, update
+
+
+def record_usage_samples(db, samples, date=None):
+	""" Record usage samples (a dict of metric values indexed by owner) at given date (default=now) in all time series resolutions with one bulk write """
+
+	if db is None:
+		return -1
+	if not samples:
+		return 0
+	if date is None:
+		date= datetime.datetime.utcnow()
+
+	requests= []
+	for owner, data in samples.items():
+		values= dict((field, data[field]) for field in HISTORY_FIELDS if field in data)
+		if not values:
+			continue
+		for resolution in HISTORY_RESOLUTIONS:
+			filt, update= make_sample_update(owner, values, date, resolution)
+			requests.append(pymongo.UpdateOne(filt, update, upsert=True))
+
+	try:
+		db[ACCOUNTING_HISTORY_COLLECTION].bulk_write(requests, ordered=False)
+	except Exception as e:
+		logger.warn("Failed to record %d accounting history samples (err=%s)!" % (len(samples), str(e)), action="accounter")
+		return -1
+
+	return 0
+
+
+def select_resolution(start, end, max_points=HISTORY_MAX_POINTS, now=None):
+	""" Return the finest resolution still retaining data at start date and giving at most max_points points in range """
+
+	if now is None:
+		now= datetime.datetime.utcnow()
+
+	for resolution in HISTORY_RESOLUTIONS:
+		if start < now - HISTORY_RETENTIONS[resolution]:
+			continue
+		period= HISTORY_PERIODS[resolution]
+		npoints= (end-start).total_seconds()/period.total_seconds()
+		if npoints<=max_points:
+			return resolution
+
+	return HISTORY_RESOLUTIONS[-1]
+
+
+def get_usage_history(db, owner, start, end, resolution=None, max_points=HISTORY_MAX_POINTS):
+	""" Return (resolution, points) of owner usage time series samples overlapping [start, end], reading from given resolution or from the best-fitting one if None """
+
+	if resolution is None:
+		resolution= select_resolution(start, end, max_points)
+
+	# - Get buckets overlapping range
+	bucket_start_min= get_bucket(start, resolution)[0]
+	query= {
+		'owner': owner,
+		'resolution': resolution,
+		'bucket_start': {'$gte': bucket_start_min, '$lte': end}
+	}
+	cursor= db[ACCOUNTING_HISTORY_COLLECTION].find(query, projection={'_id': 0, 'bucket_start': 1, 'samples': 1}).sort('bucket_start', pymongo.ASCENDING)
+
+	# - Flatten samples whose period overlaps range
+	points= []
+	period= HISTORY_PERIODS[resolution]
+	for bucket in cursor:
+		samples= bucket.get('samples', {})
+		for key in sorted(samples.keys()):
+			sample_date= get_sample_date(bucket['bucket_start'], key, resolution)
+			if sample_date+period<=start or sample_date>end:
+				continue
+			sample= samples[key]
+			n= sample.get('n', 0)
+			if n<=0:
+				continue
+			points.append({
+				'timestamp': sample_date.isoformat(),
+				'nsamples': n,
+				'avg': dict((field, value/float(n)) for field, value in sample.get('sum', {}).items()),
+				'max': sample.get('max', {}),
+				'last': sample.get('last', {})
+			})
+
+	return resolution, points
+
@@ -9,7 +9,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 
 try:
 	FileNotFoundError  # python3
@@ -37,7 +36,9 @@ from caesar_rest.workers import background_task
 from caesar_rest import oidc
 from caesar_rest import utils
 from caesar_rest.decorators import custom_require_login
+from caesar_rest.identity import get_identity
 from caesar_rest import mongo
+from caesar_rest import accounting_history
 
 # Get logger
 #logger = logging.getLogger(__name__)
@@ -58,16 +59,13 @@ def get_accounting_info():
 	""" Retrieve accounting info for this user """
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Get accounting info from DB
 	res= {}	
-	collection_name= username + '.accounting'
 	try:
-		coll= mongo.db[collection_name]
+		coll= identity.accounting_collection
 		cursor= coll.find_one({},projection={"_id":0})
 		if res is None:
 			errmsg= 'Accounting info retrieved from DB for user ' + username + ' is None!)'
@@ -85,6 +83,89 @@ def get_accounting_info():
 
 
 
+#=================================
+#===      ACCOUNTING HISTORY 
+#=================================
+def parse_date(s):
+	""" Parse a date given as unix time or ISO string (UTC). Return None if invalid. """
+
+	try:
+		return datetime.datetime.utcfromtimestamp(float(s))
+	except (ValueError, OverflowError, OSError):
+		pass
+
+	for fmt in ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d']:
+		try:
+			return datetime.datetime.strptime(s, fmt)
+		except ValueError:
+			continue
+
+	return None
+
+
+@accounting_bp.route('/accounting/history', methods=['GET'])
+@custom_require_login
+def get_accounting_history():
+	""" Retrieve accounting time series for this user (or app if scope=app) in given time range, read from the best-fitting rollup """
+
+	# - Get aai info
+	identity= get_identity()
+	username= identity.username
+
+	res= {}
+
+	# - Parse range options (default: last day)
+	now= datetime.datetime.utcnow()
+	end= now
+	start= None
+	if 'end' in request.args:
+		end= parse_date(request.args['end'])
+	if 'start' in request.args:
+		start= parse_date(request.args['start'])
+	elif end is not None:
+		start= end - datetime.timedelta(days=1)
+
+	if start is None or end is None:
+		res['status']= 'Invalid start/end date given (use ISO format or unix time)!'
+		return make_response(jsonify(res),400)
+	if start>end:
+		res['status']= 'Start date given is after end date!'
+		return make_response(jsonify(res),400)
+
+	resolution= request.args.get('resolution', 'auto')
+	if resolution=='auto':
+		resolution= None
+	elif resolution not in accounting_history.HISTORY_RESOLUTIONS:
+		res['status']= 'Invalid resolution given (valid values: auto,' + ','.join(accounting_history.HISTORY_RESOLUTIONS) + ')!'
+		return make_response(jsonify(res),400)
+
+	scope= request.args.get('scope', 'user')
+	if scope=='user':
+		owner= username
+	elif scope=='app':
+		owner= accounting_history.APP_OWNER
+	else:
+		res['status']= 'Invalid scope given (valid values: user,app)!'
+		return make_response(jsonify(res),400)
+
+	# - Get history from DB
+	try:
+		resolution, points= accounting_history.get_usage_history(mongo.db, owner, start, end, resolution)
+	except Exception as e:
+		errmsg= 'Failed to get accounting history for user ' + username + ' from DB (err=' + str(e) + ')'
+		res['status']= errmsg
+		return make_response(jsonify(res),500)
+
+	res['scope']= scope
+	res['start']= start.isoformat()
+	res['end']= end.isoformat()
+	res['resolution']= resolution
+	res['points']= points
+
+	return make_response(jsonify(res),200)
+
+
+
 #=================================
 #===      APP STATS INFO 
 #=================================
@@ -94,10 +175,8 @@ def get_appstats_info():
 	""" Retrieve app basic stats info cumulated over all users """
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Get app stats info from DB
 	res= {}	
@@ -0,0 +1,212 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+
+# Import mongo
+import pymongo
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   ACTIVE JOBS INDEX
+##############################
+# - Global collection holding one entry per unfinished job of all users
+#   NB: Entries are removed as soon as jobs reach a terminal state,
+#       so that job monitors can get all active jobs with a single indexed query
+ACTIVE_JOBS_COLLECTION= 'active_jobs'
+
+# - Collection storing index build info (index is built from user job collections if missing)
+ACTIVE_JOBS_INFO_COLLECTION= 'active_jobs_info'
+
+# - Job states kept in the index (all other states are terminal)
+ACTIVE_JOB_STATES= ['PENDING', 'STARTED', 'RUNNING']
+
+# - Job fields copied in index entries (needed by job monitors)
+ACTIVE_JOB_FIELDS= ['job_id', 'scheduler', 'state', 'status', 'pid', 'job_top_dir', 'elapsed_time', 'exit_code', 'submit_date', 'jobdir_sync_time']
+
+# - Flag set when the index has been initialized in this process
+_initialized= False
+
+
+def is_active_state(state):
+	""" Check if given job state is an active (non terminal) state """
+	return state in ACTIVE_JOB_STATES
+
+
+def make_active_job_entry(username, job_obj):
+	""" Create an index entry from a job object """
+
+	entry= {'username': username}
+	for field in ACTIVE_JOB_FIELDS:
+		if field in job_obj:
+			entry[field]= job_obj[field]
+	entry['update_date']= datetime.datetime.utcnow()
+
+	return entry
+
+
+def register_active_job(db, username, job_obj, job_collection=None):
+	""" Add a newly submitted job to the active jobs index. If the user job collection is given, the entry is removed again if the job already reached a terminal state (returning 1). """
+
+	if db is None:
+		return -1
+
+	job_id= job_obj['job_id']
+	try:
+		entry= make_active_job_entry(username, job_obj)
+		db[ACTIVE_JOBS_COLLECTION].replace_one({'job_id': job_id}, entry, upsert=True)
+
+		# - Check job state after registering it
+		#   NB: workers write the job state before removing the index entry, so a job finished before the
+		#       upsert above is seen here, otherwise its entry is removed by the worker afterwards
+		if job_collection is not None:
+			job_doc= job_collection.find_one({'job_id': job_id}, projection={'_id': 0, 'state': 1})
+			if job_doc is not None and not is_active_state(job_doc.get('state', None)):
+				logger.info("Job %s already in terminal state %s, removing it from active jobs index ..." % (job_id, job_doc.get('state')))
+				db[ACTIVE_JOBS_COLLECTION].delete_one({'job_id': job_id})
+				return 1
+
+	except Exception as e:
+		logger.warn("Failed to register job %s in active jobs index (err=%s)!" % (job_id, str(e)))
+		return -1
+
+	return 0
+
+
+def update_active_job(db, username, job_id, fields):
+	""" Update job entry in active jobs index, removing it if the job reached a terminal state """
+
+	if db is None:
+		return -1
+
+	try:
+		collection= db[ACTIVE_JOBS_COLLECTION]
+		state= fields.get('state', None)
+		if state is not None and not is_active_state(state):
+			collection.delete_one({'job_id': job_id})
+		else:
+			entry_fields= dict((k, v) for k, v in fields.items() if k in ACTIVE_JOB_FIELDS)
+			entry_fields['username']= username
+			entry_fields['update_date']= datetime.datetime.utcnow()
+			collection.update_one({'job_id': job_id}, {'$set': entry_fields}, upsert=False)
+	except Exception as e:
+		logger.warn("Failed to update job %s in active jobs index (err=%s)!" % (job_id, str(e)))
+		return -1
+
+	return 0
+
+
+def update_active_jobs(db, username, job_updates):
+	""" Update entries of given user jobs, given as a list of (job_id, fields), in active jobs index with one bulk write """
+
+	if db is None:
+		return -1
+	if not job_updates:
+		return 0
+
+	requests= []
+	now= datetime.datetime.utcnow()
+	for job_id, fields in job_updates:
+		state= fields.get('state', None)
+		if state is not None and not is_active_state(state):
+			requests.append(pymongo.DeleteOne({'job_id': job_id}))
+		else:
+			entry_fields= dict((k, v) for k, v in fields.items() if k in ACTIVE_JOB_FIELDS)
+			entry_fields['username']= username
+			entry_fields['update_date']= now
+			requests.append(pymongo.UpdateOne({'job_id': job_id}, {'$set': entry_fields}, upsert=False))
+
+	try:
+		db[ACTIVE_JOBS_COLLECTION].bulk_write(requests, ordered=False)
+	except Exception as e:
+		logger.warn("Failed to update %d jobs in active jobs index (err=%s)!" % (len(requests), str(e)))
+		return -1
+
+	return 0
+
+
+def get_active_jobs_query(schedulers=None, username=None):
+	""" Return query of active job entries (optionally only for given schedulers and user) """
+
+	query= {}
+	if schedulers:
+		query['scheduler']= {'$in': list(schedulers)}
+	if username is not None:
+		query['username']= username
+
+	return query
+
+
+def get_active_jobs(db, schedulers=None, username=None):
+	""" Return all active job entries (optionally only for given schedulers and user) with a single query """
+
+	query= get_active_jobs_query(schedulers, username)
+	return list(db[ACTIVE_JOBS_COLLECTION].find(query, projection={'_id': 0}))
+
+
+def count_active_jobs(db, username):
+	""" Return number of active jobs of given user (uses username index) """
+
+	return db[ACTIVE_JOBS_COLLECTION].count_documents({'username': username})
+
+
+def create_active_jobs_indexes(db):
+	""" Create indexes on active jobs collection """
+
+	collection= db[ACTIVE_JOBS_COLLECTION]
+	collection.create_index([('job_id', pymongo.ASCENDING)], unique=True)
+	collection.create_index([('scheduler', pymongo.ASCENDING), ('username', pymongo.ASCENDING)])
+	collection.create_index([('username', pymongo.ASCENDING)])
+
+
+def rebuild_active_jobs(db):
+	""" Rebuild active jobs index scanning all user job collections """
+
+	logger.info("Rebuilding active jobs index from user job collections ...", action="jobmonitor")
+
+	collection_names= db.list_collection_names(filter={"name":{"$regex": r"\.jobs$"}})
+	njobs= 0
+	for collection_name in collection_names:
+		username= collection_name.rsplit('.jobs', 1)[0]
+		job_cursor= db[collection_name].find({'state': {'$in': ACTIVE_JOB_STATES}})
+		for job_obj in job_cursor:
+			if register_active_job(db, username, job_obj, db[collection_name])==0:
+				njobs+= 1
+
+	logger.info("#%d active jobs registered in index from %d user job collections ..." % (njobs, len(collection_names)), action="jobmonitor")
+
+	return njobs
+
+
+def init_active_jobs(db):
+	""" Initialize active jobs index, building it from user job collections the first time """
+
+	global _initialized
+	if _initialized:
+		return 0
+
+	try:
+		create_active_jobs_indexes(db)
+		if db[ACTIVE_JOBS_INFO_COLLECTION].find_one({'_id': ACTIVE_JOBS_COLLECTION}) is None:
+			njobs= rebuild_active_jobs(db)
+			db[ACTIVE_JOBS_INFO_COLLECTION].replace_one(
+				{'_id': ACTIVE_JOBS_COLLECTION},
+				{'_id': ACTIVE_JOBS_COLLECTION, 'build_date': datetime.datetime.utcnow(), 'njobs': njobs},
+				upsert=True
+			)
+	except Exception as e:
+		logger.warn("Failed to initialize active jobs index (err=%s)!" % str(e), action="jobmonitor")
+		return -1
+
+	_initialized= True
+
+	return 0
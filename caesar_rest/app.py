@@ -9,7 +9,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 
 try:
 	FileNotFoundError  # python3
@@ -88,14 +87,17 @@ def create_app(cfg,jc):
 	from caesar_rest.download_route import download_id_bp
 	from caesar_rest.download_route import fileids_bp
 	from caesar_rest.download_route import delete_id_bp
+	from caesar_rest.download_route import filestats_bp
 	from caesar_rest.job_route import job_bp, job_status_bp, job_output_bp, job_cancel_bp
-	from caesar_rest.job_route import job_catalog_bp, job_catalog_file_bp, job_component_catalog_bp, job_component_catalog_file_bp, job_preview_bp, job_preview_file_bp
+	from caesar_rest.job_route import job_catalog_bp, job_catalog_file_bp, job_component_catalog_bp, job_component_catalog_file_bp, job_preview_bp, job_preview_file_bp, job_events_bp
 	from caesar_rest.app_route import app_names_bp, app_describe_bp
 	from caesar_rest.accounting_route import accounting_bp, appstats_bp
+	from caesar_rest.catalog_route import catalog_query_bp
 	app.register_blueprint(index_bp)
 	app.register_blueprint(upload_bp)
 	app.register_blueprint(download_id_bp)
 	app.register_blueprint(fileids_bp)
+	app.register_blueprint(filestats_bp)
 	app.register_blueprint(delete_id_bp)
 	app.register_blueprint(job_bp)
 	app.register_blueprint(job_status_bp)
@@ -107,10 +109,12 @@ def create_app(cfg,jc):
 	app.register_blueprint(job_preview_bp)
 	app.register_blueprint(job_preview_file_bp)
 	app.register_blueprint(job_cancel_bp)
+	app.register_blueprint(job_events_bp)
 	app.register_blueprint(app_names_bp)
 	app.register_blueprint(app_describe_bp)
 	app.register_blueprint(accounting_bp)
 	app.register_blueprint(appstats_bp)
+	app.register_blueprint(catalog_query_bp)
 
 	return app
 
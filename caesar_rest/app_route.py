@@ -9,7 +9,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 
 try:
 	FileNotFoundError  # python3
@@ -55,10 +54,10 @@ def get_app_description(app_name):
 
 	res= {}
 	res['status']= ''
-	app_description= current_app.config['jobcfg'].get_app_description(app_name)
+	app_description= current_app.config['jobcfg'].get_app_description_json(app_name)
 	if app_description is None:
 		res['status']= 'Unknown app ' + app_name + '!'
 		return make_response(jsonify(res),400)
 
-	return make_response(jsonify(app_description),200)
+	return make_response(app_description, 200, {'Content-Type': 'application/json'})
 
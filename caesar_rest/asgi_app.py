@@ -0,0 +1,534 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+import asyncio
+import contextlib
+from functools import wraps
+
+# Import ASGI modules (optional, needed only by the ASGI front-end)
+try:
+	from starlette.applications import Starlette
+	from starlette.routing import Route, Mount
+	from starlette.responses import JSONResponse, Response, StreamingResponse, FileResponse
+	from starlette.concurrency import run_in_threadpool
+except ImportError:
+	Starlette= None
+
+try:
+	from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+	AsyncIOMotorClient= None
+
+try:
+	import httpx
+except ImportError:
+	httpx= None
+
+try:
+	from a2wsgi import WSGIMiddleware
+except ImportError:
+	try:
+		from starlette.middleware.wsgi import WSGIMiddleware
+	except ImportError:
+		WSGIMiddleware= None
+
+# Import werkzeug modules
+from werkzeug.http import http_date
+
+# Import caesar_rest modules
+from caesar_rest import route_common
+from caesar_rest import job_events
+from caesar_rest import active_jobs
+from caesar_rest.job_events import job_event_bus
+from caesar_rest.identity import UserIdentity
+from caesar_rest.decorators import has_required_scopes
+from caesar_rest.token_cache import token_cache, jwks_verifier
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   ASGI OPTIONS
+##############################
+# - Prefix of API routes
+API_PREFIX= '/caesar/api/v1.0'
+
+# - Timeout (in seconds) of requests to identity provider
+HTTP_CLIENT_TIMEOUT= 10
+
+
+##############################
+#   RESPONSES
+##############################
+def json_default(obj):
+	""" Serialize objects not supported by json module as Flask jsonify does """
+
+	if isinstance(obj, datetime.date):
+		return http_date(obj)
+	return str(obj)
+
+
+class FlaskJSONResponse(JSONResponse):
+	""" JSON response rendered as Flask jsonify (sorted keys, dates as HTTP dates), so that both front-ends return the same replies """
+
+	def render(self, content):
+		return (json.dumps(content, default=json_default, sort_keys=True) + '\n').encode('utf-8')
+
+
+##############################
+#   JOB EVENT SUBSCRIPTION
+##############################
+class AsyncJobEventSubscription(object):
+	""" A job event subscription delivering events (published from the event watcher thread) to an asyncio event loop """
+
+	def __init__(self, topics, loop, maxsize=100):
+		self.topics= list(topics)
+		self.loop= loop
+		self.events= asyncio.Queue(maxsize=maxsize)
+
+	def put(self, event):
+		""" Schedule event delivery in the event loop (thread-safe) """
+		try:
+			self.loop.call_soon_threadsafe(self.put_nowait, event)
+		except RuntimeError:
+			pass # loop closed
+
+	def put_nowait(self, event):
+		""" Add event to queue, dropping the oldest one if full (slow consumer) """
+		if self.events.full():
+			self.events.get_nowait()
+		self.events.put_nowait(event)
+
+	async def get(self, timeout=None):
+		""" Return next event or None if no event arrives within timeout """
+		try:
+			return await asyncio.wait_for(self.events.get(), timeout)
+		except asyncio.TimeoutError:
+			return None
+
+
+##############################
+#   AUTHENTICATION
+##############################
+def get_request_token(request):
+	""" Return access token from request Authorization header (or from access_token query field if no header is given) """
+
+	auth= request.headers.get('Authorization', '')
+	if auth.startswith('Bearer '):
+		return auth.split(None,1)[1].strip()
+	return request.query_params.get('access_token')
+
+
+def load_client_secrets(filename):
+	""" Load OIDC client credentials from file (same file used by Flask OIDC). Return empty dict on failure. """
+
+	try:
+		with open(filename) as f:
+			secrets= json.load(f)
+	except Exception as e:
+		logger.warn("Failed to load client secrets from file %s (err=%s)!" % (filename, str(e)))
+		return {}
+
+	return secrets.get('web', secrets)
+
+
+async def introspect_token(state, token):
+	""" Validate token with identity provider introspection endpoint using the async HTTP client. Return token info or None on failure. """
+
+	secrets= state.client_secrets
+	uri= secrets.get('token_introspection_uri', '')
+	if uri=='':
+		logger.warn("No token introspection uri given in client secrets, cannot validate token!")
+		return None
+
+	data= {'token': token}
+	hint= state.config.get('OIDC_TOKEN_TYPE_HINT', 'access_token')
+	if hint!='none':
+		data['token_type_hint']= hint
+
+	# - Authenticate client as Flask OIDC does
+	headers= {}
+	auth= None
+	auth_method= state.config.get('OIDC_INTROSPECTION_AUTH_METHOD', 'client_secret_post')
+	if auth_method=='client_secret_basic':
+		auth= (secrets.get('client_id', ''), secrets.get('client_secret', ''))
+	elif auth_method=='bearer':
+		headers['Authorization']= 'Bearer ' + token
+	else:
+		data['client_id']= secrets.get('client_id', '')
+		if secrets.get('client_secret') is not None:
+			data['client_secret']= secrets['client_secret']
+
+	try:
+		r= await state.http_client.post(uri, data=data, headers=headers, auth=auth)
+		r.raise_for_status()
+		return r.json()
+	except Exception as e:
+		logger.warn("Token introspection request to %s failed (err=%s)!" % (uri, str(e)))
+		return None
+
+
+async def validate_token(state, token, scopes_required=None):
+	""" Validate token using the token cache, then local JWKS verification or async introspection. Return (True, token info) or (error string, None). """
+
+	if not token:
+		return 'Token required but invalid', None
+
+	token_info= token_cache.get(token)
+	if token_info is None:
+		if state.config.get('OIDC_TOKEN_VALIDATION', 'introspection')=='jwks':
+			# - Key refresh uses a blocking request (at most once per refresh period), so run it in thread pool
+			token_info= await run_in_threadpool(jwks_verifier.verify, token)
+		else:
+			token_info= await introspect_token(state, token)
+
+		if not token_info or not token_info.get('active', False):
+			return 'Token required but invalid', None
+		token_cache.put(token, token_info)
+
+	if not has_required_scopes(token_info, scopes_required):
+		return 'Token does not have required scopes', None
+
+	return True, token_info
+
+
+def async_require_login(handler):
+	""" Decorator to require login only if AAI is enabled and set request user identity (async version of custom_require_login) """
+	@wraps(handler)
+	async def decorated(request):
+		state= request.app.state
+		if not state.config.get('USE_AAI', False):
+			request.state.identity= UserIdentity()
+			return await handler(request)
+
+		validity, token_info= await validate_token(state, get_request_token(request))
+		if validity is not True:
+			response_body= {'error': 'invalid_token', 'error_description': validity}
+			return Response(json.dumps(response_body), 401, headers={'WWW-Authenticate': 'Bearer'})
+
+		request.state.identity= UserIdentity.from_token_info(token_info)
+		return await handler(request)
+
+	return decorated
+
+
+##############################
+#   APP ROUTES
+##############################
+@async_require_login
+async def get_app_names(request):
+	""" Get supported apps """
+
+	app_names= request.app.state.jobcfg.get_app_names()
+	return FlaskJSONResponse(app_names, 200)
+
+
+@async_require_login
+async def get_app_description(request):
+	""" Get description of given app """
+
+	app_name= request.path_params['app_name']
+	app_description= request.app.state.jobcfg.get_app_description_json(app_name)
+	if app_description is None:
+		return FlaskJSONResponse({'status': 'Unknown app ' + app_name + '!'}, 400)
+
+	return Response(app_description, 200, media_type='application/json')
+
+
+##############################
+#   DATA ROUTES
+##############################
+@async_require_login
+async def get_registered_file_ids(request):
+	""" Returns all file ids registered in the system """
+
+	identity= request.state.identity
+	username= identity.username
+	db= request.app.state.db
+
+	try:
+		cursor= db[identity.files_collection_name].find({}, projection=route_common.FILE_LIST_PROJECTION)
+		res= await cursor.to_list(length=None)
+	except Exception as e:
+		errmsg= 'Exception caught when getting file ids from DB (err=' + str(e) + ')!'
+		logger.error(errmsg, action="fileids", user=username)
+		return FlaskJSONResponse({'status': errmsg}, 404)
+
+	return FlaskJSONResponse(res, 200)
+
+
+@async_require_login
+async def download_by_uuid(request):
+	""" Download data by uuid (file is streamed without blocking the event loop) """
+
+	identity= request.state.identity
+	username= identity.username
+	db= request.app.state.db
+	file_uuid= request.path_params['file_uuid']
+
+	try:
+		item= await db[identity.files_collection_name].find_one(route_common.get_file_query(file_uuid))
+	except Exception as e:
+		errmsg= 'Exception caught when searching file in DB (err=' + str(e) + ')!'
+		logger.error(errmsg, action="download", user=username)
+		return FlaskJSONResponse({'status': errmsg}, 404)
+
+	file_path, res, status_code= route_common.get_download_filepath(file_uuid, item, username)
+	if status_code!=200:
+		return FlaskJSONResponse(res, status_code)
+
+	if not os.path.isfile(file_path):
+		res, status_code= route_common.make_file_not_found_reply(file_uuid, username)
+		return FlaskJSONResponse(res, status_code)
+
+	logger.info("Returning file %s to client ..." % file_path, action="download", user=username)
+	return FileResponse(file_path, filename=os.path.basename(file_path))
+
+
+##############################
+#   JOB ROUTES
+##############################
+@async_require_login
+async def get_job_ids(request):
+	""" Retrieve all job ids per user """
+
+	identity= request.state.identity
+	db= request.app.state.db
+
+	try:
+		cursor= db[identity.jobs_collection_name].find({}, projection=route_common.JOB_LIST_PROJECTION)
+		res= await cursor.to_list(length=None)
+	except Exception as e:
+		errmsg= 'Failed to get file ids from DB (err=' + str(e) + ')'
+		return FlaskJSONResponse({'status': errmsg}, 404)
+
+	return FlaskJSONResponse(res, 200)
+
+
+@async_require_login
+async def get_job_status(request):
+	""" Get job status """
+
+	identity= request.state.identity
+	username= identity.username
+	db= request.app.state.db
+	task_id= request.path_params['task_id']
+
+	try:
+		job= await db[identity.jobs_collection_name].find_one(route_common.get_job_query(task_id))
+	except Exception as e:
+		errmsg= 'Exception catched when searching job id in DB (err=' + str(e) + ')!'
+		logger.error(errmsg, action="jobstatus", user=username)
+		res= route_common.init_job_status_reply(task_id)
+		res['status']= errmsg
+		return FlaskJSONResponse(res, 404)
+
+	res, status_code= route_common.make_job_status_reply(task_id, job, username)
+	return FlaskJSONResponse(res, status_code)
+
+
+##############################
+#   JOB EVENT ROUTES (SSE)
+##############################
+def get_sse_response(stream):
+	""" Return SSE streaming response """
+	return StreamingResponse(stream, media_type='text/event-stream', headers=job_events.SSE_HEADERS)
+
+
+def subscribe_async(topics):
+	""" Subscribe current event loop to given job event topics """
+	return job_event_bus.add_subscription(AsyncJobEventSubscription(topics, asyncio.get_event_loop()))
+
+
+@async_require_login
+async def get_job_events(request):
+	""" Stream job state/elapsed time updates as Server-Sent Events """
+
+	identity= request.state.identity
+	username= identity.username
+	config= request.app.state.config
+	job_collection= request.app.state.db[identity.jobs_collection_name]
+	task_id= request.path_params['task_id']
+
+	res= {'job_id': task_id, 'status': ''}
+	try:
+		job= await job_collection.find_one(route_common.get_job_query(task_id), projection={'_id': 0})
+	except Exception as e:
+		errmsg= 'Exception catched when searching job id in DB (err=' + str(e) + ')!'
+		logger.error(errmsg, action="jobevents", user=username)
+		res['status']= errmsg
+		return FlaskJSONResponse(res, 404)
+
+	if not job or job is None:
+		errmsg= 'Job ' + task_id + ' not found for user ' + username + '!'
+		logger.warn(errmsg, action="jobevents", user=username)
+		res['status']= errmsg
+		return FlaskJSONResponse(res, 404)
+
+	keepalive_period= config['JOB_EVENTS_KEEPALIVE_PERIOD']
+	recheck_period= config['JOB_EVENTS_RECHECK_PERIOD']
+	max_stream_time= config['JOB_EVENTS_MAX_STREAM_TIME']
+
+	async def stream():
+		# - Subscribe to job events when the stream starts (released in finally, also if the client disconnects before),
+		#   then read current state again so that no transition is lost
+		sub= subscribe_async([job_events.get_job_topic(task_id)])
+		try:
+			job_obj= None
+			try:
+				job_obj= await job_collection.find_one(route_common.get_job_query(task_id), projection={'_id': 0})
+			except Exception as e:
+				logger.warn("Failed to read job %s state from DB (err=%s), sending previous one ..." % (task_id, str(e)), action="jobevents", user=username)
+
+			# - Send current state
+			event_stream= job_events.JobEventStream(single_job=True)
+			if not job_obj:
+				job_obj= job
+			yield event_stream.process(job_events.make_job_event(username, job_obj), force=True)
+			if event_stream.completed:
+				return
+
+			start= time.time()
+			last_check= start
+			while time.time()-start<max_stream_time:
+				event= await sub.get(timeout=keepalive_period)
+
+				# - Re-check state in DB from time to time in case an event was missed
+				if event is None and time.time()-last_check>=recheck_period:
+					last_check= time.time()
+					job_obj= await job_collection.find_one(route_common.get_job_query(task_id), projection={'_id': 0})
+					if job_obj:
+						event= job_events.make_job_event(username, job_obj)
+
+				if event is None:
+					yield job_events.SSE_KEEPALIVE
+					continue
+
+				# - Send only if state fields changed
+				msg= event_stream.process(event)
+				if msg is not None:
+					yield msg
+					if event_stream.completed:
+						return
+
+		finally:
+			job_event_bus.unsubscribe(sub)
+
+	logger.info("Streaming events for job %s ..." % task_id, action="jobevents", user=username, event_type="jobevents.stream")
+	return get_sse_response(stream())
+
+
+@async_require_login
+async def get_jobs_events(request):
+	""" Stream state/elapsed time updates of all user jobs as Server-Sent Events """
+
+	identity= request.state.identity
+	username= identity.username
+	config= request.app.state.config
+	db= request.app.state.db
+
+	keepalive_period= config['JOB_EVENTS_KEEPALIVE_PERIOD']
+	max_stream_time= config['JOB_EVENTS_MAX_STREAM_TIME']
+
+	async def stream():
+		# - Subscribe to user job events when the stream starts (released in finally, also if the client disconnects before),
+		#   then read current states so that no transition is lost
+		sub= subscribe_async([job_events.get_user_topic(username)])
+		try:
+			# - Get current state of active user jobs
+			job_list= []
+			try:
+				cursor= db[active_jobs.ACTIVE_JOBS_COLLECTION].find(active_jobs.get_active_jobs_query(username=username), projection={'_id': 0})
+				job_list= await cursor.to_list(length=None)
+			except Exception as e:
+				logger.warn("Failed to get active jobs from DB (err=%s)!" % str(e), action="jobevents", user=username)
+
+			event_stream= job_events.JobEventStream()
+			for job_obj in job_list:
+				yield event_stream.process(job_events.make_job_event(username, job_obj), force=True)
+
+			start= time.time()
+			while time.time()-start<max_stream_time:
+				event= await sub.get(timeout=keepalive_period)
+				if event is None:
+					yield job_events.SSE_KEEPALIVE
+					continue
+
+				# - Send only if state fields changed
+				msg= event_stream.process(event)
+				if msg is not None:
+					yield msg
+
+		finally:
+			job_event_bus.unsubscribe(sub)
+
+	logger.info("Streaming events for all jobs ...", action="jobevents", user=username, event_type="jobevents.stream")
+	return get_sse_response(stream())
+
+
+##############################
+#   ASGI APP CREATION
+##############################
+def create_asgi_app(cfg, jc, wsgi_app=None):
+	""" Create ASGI app serving read-mostly endpoints (status, job/file lists, SSE streams, downloads) with async handlers. All other requests are forwarded to the given Flask (WSGI) app, if any. """
+
+	if Starlette is None:
+		raise ImportError("starlette module not found, cannot create ASGI app (hint: install starlette)")
+	if AsyncIOMotorClient is None:
+		raise ImportError("motor module not found, cannot create ASGI app (hint: install motor)")
+	if httpx is None:
+		raise ImportError("httpx module not found, cannot create ASGI app (hint: install httpx)")
+
+	# - Get config options from class
+	config= dict((key, getattr(cfg, key)) for key in dir(cfg) if key.isupper())
+
+	@contextlib.asynccontextmanager
+	async def lifespan(app):
+		# - Create connection-holding objects in the event loop
+		logger.info("Initializing async MongoDB and HTTP clients (pid=%d) ..." % os.getpid())
+		mongo_client= AsyncIOMotorClient(config['MONGO_URI'])
+		app.state.db= mongo_client[config['MONGO_DBNAME']]
+		app.state.http_client= httpx.AsyncClient(timeout=HTTP_CLIENT_TIMEOUT)
+		try:
+			yield
+		finally:
+			await app.state.http_client.aclose()
+			mongo_client.close()
+
+	routes= [
+		Route(API_PREFIX + '/apps', get_app_names, methods=['GET']),
+		Route(API_PREFIX + '/app/{app_name}/describe', get_app_description, methods=['GET']),
+		Route(API_PREFIX + '/fileids', get_registered_file_ids, methods=['GET']),
+		Route(API_PREFIX + '/download/{file_uuid}', download_by_uuid, methods=['GET']),
+		Route(API_PREFIX + '/jobs', get_job_ids, methods=['GET']),
+		Route(API_PREFIX + '/job/{task_id}/status', get_job_status, methods=['GET']),
+		Route(API_PREFIX + '/job/{task_id}/events', get_job_events, methods=['GET']),
+		Route(API_PREFIX + '/jobs/events', get_jobs_events, methods=['GET'])
+	]
+
+	# - Forward other requests (uploads, job submission, outputs, ...) to Flask app, run in a thread pool
+	if wsgi_app is not None:
+		if WSGIMiddleware is None:
+			logger.warn("No WSGI middleware found, only async endpoints will be served (hint: install a2wsgi)")
+		else:
+			routes.append(Mount('/', app=WSGIMiddleware(wsgi_app)))
+
+	app= Starlette(routes=routes, lifespan=lifespan)
+	app.state.config= config
+	app.state.jobcfg= jc
+	app.state.client_secrets= {}
+	if config.get('USE_AAI', False):
+		app.state.client_secrets= load_client_secrets(config['OIDC_CLIENT_SECRETS'])
+		if not jwks_verifier.issuer:
+			jwks_verifier.issuer= app.state.client_secrets.get('issuer', '')
+
+	return app
+
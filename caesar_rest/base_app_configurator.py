@@ -8,11 +8,11 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import subprocess
 import json
 import ast
 import yaml
+import copy
 
 # Import flask modules
 from flask import current_app, g
@@ -150,6 +150,19 @@ class AppConfigurator(object):
 			"nproc": 1
 		}
 
+	def clone(self):
+		""" Return a configurator for a new job, sharing the (read-only) option schema and transformers with this one """
+
+		configurator= copy.copy(self)
+		configurator.job_inputs= ''
+		configurator.data_inputs= ''
+		configurator.cmd_args= list(self.cmd_args)
+		configurator.validation_status= ''
+		configurator.options= []
+		configurator.run_options= dict(self.run_options)
+
+		return configurator
+
 	def describe_dict(self):
 		""" Return a dictionary describing valid options """
 			
@@ -190,7 +203,12 @@ class AppConfigurator(object):
 			return opt_value
 		if not opt_name in self.option_value_transformer:
 			return opt_value
-		return self.option_value_transformer[opt_name](opt_value)
+
+		# - Call transformer on this configurator (transformers are bound to the configurator the schema was built with)
+		transformer= self.option_value_transformer[opt_name]
+		if getattr(transformer, '__self__', None) is not None and transformer.__self__ is not self:
+			transformer= getattr(self, transformer.__name__)
+		return transformer(opt_value)
 
 
 	def set_data_input_option_value(self):
@@ -242,8 +260,6 @@ class AppConfigurator(object):
 
 		# - Validate options 
 		valid= self.validate_options()
-		print("--> %s args" % self.cmd)
-		print(self.cmd_args)
 
 		# - Set input data option
 		self.set_data_input_option_value()
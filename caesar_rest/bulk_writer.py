@@ -0,0 +1,259 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+import threading
+
+# Import mongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Import caesar_rest modules
+from caesar_rest import active_jobs
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   WRITER OPTIONS
+##############################
+# - Default max number of queued job updates triggering a flush
+JOB_UPDATE_BATCH_SIZE= 100
+
+# - Default max time (in seconds) deferred job updates are kept before being flushed
+JOB_UPDATE_FLUSH_PERIOD= 10
+
+# - Default period (in seconds) of writer metrics logs (0=never)
+JOB_UPDATE_METRICS_PERIOD= 300
+
+
+##############################
+#   JOB UPDATE WRITER
+##############################
+class JobUpdateWriter(object):
+	""" Collect job field updates and write them to user job collections (and active jobs index) with unordered bulk writes """
+
+	def __init__(self, max_size=JOB_UPDATE_BATCH_SIZE, flush_period=JOB_UPDATE_FLUSH_PERIOD, metrics_period=JOB_UPDATE_METRICS_PERIOD, name='job_update_writer'):
+
+		self.name= name
+		self.max_size= max_size
+		self.flush_period= flush_period # if <=0 updates are written only on explicit flush
+		self.metrics_period= metrics_period
+		self.last_metrics_time= time.time()
+		self.lock= threading.Lock()
+		self.flush_lock= threading.Lock()
+		self.collections= {} # collection full name -> collection
+		self.pending= {} # collection full name -> {job_id: fields}
+		self.npending= 0
+		self.first_pending_time= None # time of the oldest pending update
+		self.thread= None
+		self.thread_pid= None
+
+		# - Metrics
+		self.metrics= {
+			'nflushes': 0,
+			'nbulk_writes': 0,
+			'nupdates': 0,
+			'ncoalesced': 0,
+			'nfallback_writes': 0,
+			'nerrors': 0,
+			'batch_size_last': 0,
+			'batch_size_max': 0,
+			'latency_last': 0., # in ms
+			'latency_max': 0., # in ms
+			'latency_sum': 0. # in ms
+		}
+
+	def initialize(self, max_size=JOB_UPDATE_BATCH_SIZE, flush_period=JOB_UPDATE_FLUSH_PERIOD, metrics_period=JOB_UPDATE_METRICS_PERIOD):
+		""" Set writer options """
+
+		if max_size<=0:
+			logger.warn("Invalid job update batch size (%d) given, using default (%d) ..." % (max_size, JOB_UPDATE_BATCH_SIZE))
+			max_size= JOB_UPDATE_BATCH_SIZE
+
+		self.max_size= max_size
+		self.flush_period= flush_period
+		self.metrics_period= metrics_period
+
+		return 0
+
+	def initialize_from_env(self):
+		""" Set writer options from env vars CAESAR_REST_JOB_UPDATE_BATCH_SIZE, CAESAR_REST_JOB_UPDATE_FLUSH_PERIOD, CAESAR_REST_JOB_UPDATE_METRICS_PERIOD (e.g. in Celery workers) """
+
+		try:
+			max_size= int(os.environ.get('CAESAR_REST_JOB_UPDATE_BATCH_SIZE', self.max_size))
+			flush_period= float(os.environ.get('CAESAR_REST_JOB_UPDATE_FLUSH_PERIOD', self.flush_period))
+			metrics_period= float(os.environ.get('CAESAR_REST_JOB_UPDATE_METRICS_PERIOD', self.metrics_period))
+		except ValueError as e:
+			logger.warn("Invalid job update writer option given in env (err=%s), using defaults ..." % str(e))
+			return -1
+
+		return self.initialize(max_size, flush_period, metrics_period)
+
+	def add(self, job_collection, job_id, fields, flush=False):
+		""" Queue an update of job fields (merged with pending updates of the same job). Pending updates are flushed if flush is True or batch is full. Return the list of job ids that failed to be written. """
+
+		key= job_collection.full_name
+		with self.lock:
+			self.collections[key]= job_collection
+			job_updates= self.pending.setdefault(key, {})
+			if job_id in job_updates:
+				job_updates[job_id].update(fields)
+				self.metrics['ncoalesced']+= 1
+			else:
+				job_updates[job_id]= dict(fields)
+				if self.npending==0:
+					self.first_pending_time= time.time()
+				self.npending+= 1
+			full= self.npending>=self.max_size
+
+		if flush or full:
+			return self.flush()
+
+		self.start_flusher()
+
+		return []
+
+	def get_npending(self):
+		""" Return number of pending job updates """
+		with self.lock:
+			return self.npending
+
+	def get_metrics(self):
+		""" Return writer metrics (latencies in ms) """
+
+		with self.lock:
+			metrics= dict(self.metrics)
+			metrics['npending']= self.npending
+
+		nbulk_writes= metrics['nbulk_writes']
+		metrics['latency_mean']= metrics['latency_sum']/nbulk_writes if nbulk_writes>0 else 0.
+		metrics['batch_size_mean']= float(metrics['nupdates'])/nbulk_writes if nbulk_writes>0 else 0.
+		del metrics['latency_sum']
+
+		return metrics
+
+	def flush(self):
+		""" Write all pending updates. Return the list of job ids that failed to be written. """
+
+		failed_job_ids= []
+
+		with self.flush_lock:
+			with self.lock:
+				pending= self.pending
+				collections= self.collections
+				self.pending= {}
+				self.collections= {}
+				self.npending= 0
+				self.first_pending_time= None
+				self.metrics['nflushes']+= 1
+
+			for key, job_updates in pending.items():
+				if not job_updates:
+					continue
+				failed_job_ids.extend(self.write(collections[key], list(job_updates.items())))
+
+		self.report_metrics()
+
+		return failed_job_ids
+
+	def report_metrics(self, force=False):
+		""" Log writer metrics if metrics period expired since last report """
+
+		now= time.time()
+		if not force and (self.metrics_period<=0 or now-self.last_metrics_time<self.metrics_period):
+			return
+		self.last_metrics_time= now
+
+		metrics= self.get_metrics()
+		logger.info("%s metrics (pid=%d): #%d updates in #%d bulk writes (batch size mean=%.1f, max=%d), #%d coalesced, #%d fallback writes, #%d errors, write latency mean=%.1f ms, max=%.1f ms, #%d pending ..." % (self.name, os.getpid(), metrics['nupdates'], metrics['nbulk_writes'], metrics['batch_size_mean'], metrics['batch_size_max'], metrics['ncoalesced'], metrics['nfallback_writes'], metrics['nerrors'], metrics['latency_mean'], metrics['latency_max'], metrics['npending']), event_type="bulkwriter.metrics")
+
+	def write(self, job_collection, job_updates):
+		""" Write job updates to collection with one unordered bulk write, falling back to per-document writes on errors. Return failed job ids. """
+
+		requests= [UpdateOne({'job_id': job_id}, {'$set': fields}, upsert=False) for job_id, fields in job_updates]
+		retry_indexes= []
+
+		t0= time.time()
+		try:
+			job_collection.bulk_write(requests, ordered=False)
+		except BulkWriteError as e:
+			retry_indexes= [item['index'] for item in e.details.get('writeErrors', [])]
+			logger.warn("%d/%d job updates failed in bulk write to collection %s, retrying them one by one ..." % (len(retry_indexes), len(requests), job_collection.name))
+		except Exception as e:
+			retry_indexes= list(range(len(requests)))
+			logger.warn("Bulk write of %d job updates to collection %s failed (err=%s), retrying them one by one ..." % (len(requests), job_collection.name, str(e)))
+		latency= (time.time()-t0)*1000.
+
+		# - Per-document fallback
+		failed_job_ids= []
+		for index in retry_indexes:
+			job_id, fields= job_updates[index]
+			try:
+				job_collection.update_one({'job_id': job_id}, {'$set': fields}, upsert=False)
+			except Exception as e:
+				logger.error("Exception caught when updating job %s in DB (err=%s)!" % (job_id, str(e)))
+				failed_job_ids.append(job_id)
+
+		# - Update metrics
+		with self.lock:
+			self.metrics['nbulk_writes']+= 1
+			self.metrics['nupdates']+= len(requests)
+			self.metrics['nfallback_writes']+= len(retry_indexes)
+			self.metrics['nerrors']+= len(failed_job_ids)
+			self.metrics['batch_size_last']= len(requests)
+			self.metrics['batch_size_max']= max(self.metrics['batch_size_max'], len(requests))
+			self.metrics['latency_last']= latency
+			self.metrics['latency_max']= max(self.metrics['latency_max'], latency)
+			self.metrics['latency_sum']+= latency
+
+		logger.debug("Wrote %d job updates to collection %s in %.1f ms (#%d fallback writes, #%d failed) ..." % (len(requests), job_collection.name, latency, len(retry_indexes), len(failed_job_ids)))
+
+		# - Update active jobs index
+		username= job_collection.name.rsplit('.jobs', 1)[0]
+		active_jobs.update_active_jobs(
+			job_collection.database,
+			username,
+			[(job_id, fields) for job_id, fields in job_updates if job_id not in failed_job_ids]
+		)
+
+		return failed_job_ids
+
+	def start_flusher(self):
+		""" Start thread flushing deferred updates every flush period (if not running in this process) """
+
+		if self.flush_period<=0:
+			return
+
+		with self.lock:
+			if self.thread is not None and self.thread.is_alive() and self.thread_pid==os.getpid():
+				return
+			self.thread_pid= os.getpid()
+			self.thread= threading.Thread(target=self.run_flusher, name='JobUpdateWriter')
+			self.thread.daemon= True
+			self.thread.start()
+
+	def run_flusher(self):
+		""" Flusher thread main loop """
+
+		while True:
+			time.sleep(max(0.1, self.flush_period/10.))
+			first_pending_time= self.first_pending_time
+			if first_pending_time is not None and time.time()-first_pending_time>=self.flush_period:
+				try:
+					self.flush()
+				except Exception as e:
+					logger.warn("Failed to flush pending job updates (err=%s)!" % str(e))
+
+
+##############################
+#   DEFAULT INSTANCES
+##############################
+job_update_writer= JobUpdateWriter()
@@ -8,7 +8,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import subprocess
 import json
 import ast
@@ -21,6 +20,7 @@ from flask import current_app, g
 from caesar_rest import oidc
 from caesar_rest import mongo
 from caesar_rest import utils
+from caesar_rest.identity import get_identity
 from caesar_rest.base_app_configurator import AppConfigurator
 from caesar_rest.base_app_configurator import Option, ValueOption, EnumValueOption
 
@@ -1807,18 +1807,14 @@ class CaesarAppConfigurator(AppConfigurator):
 		""" Transform input file from uuid to actual path """		
 	
 		# - Get aai info
-		username= 'anonymous'
-		if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-			email= g.oidc_token_info['email']
-			username= utils.sanitize_username(email)
+		identity= get_identity()
 
 		# - Inspect inputfile (expect it is a uuid, so convert to filename)
 		logger.info("Finding inputfile uuid %s ..." % file_uuid, action="submitjob")
-		collection_name= username + '.files'
 
 		file_path= ''
 		try:
-			data_collection= mongo.db[collection_name]
+			data_collection= identity.files_collection
 			item= data_collection.find_one({'fileid': str(file_uuid)})
 			if item and item is not None:
 				file_path= item['filepath']
@@ -0,0 +1,106 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+
+# Import flask modules
+from flask import current_app, Blueprint, render_template, request, redirect, url_for, g
+from flask import make_response, jsonify
+from caesar_rest import oidc
+from caesar_rest import utils
+from caesar_rest.decorators import custom_require_login
+from caesar_rest.identity import get_identity
+from caesar_rest import mongo
+from caesar_rest import catalog_store
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   CREATE BLUEPRINTS
+##############################
+catalog_query_bp = Blueprint('catalog_query', __name__,url_prefix='/caesar/api/v1.0')
+
+
+#=================================
+#===      CATALOG QUERY
+#=================================
+def get_float_arg(name):
+	""" Return float request arg or None if not given """
+
+	value= request.args.get(name)
+	if value is None or value=='':
+		return None
+	return float(value)
+
+
+@catalog_query_bp.route('/catalogs/query', methods=['GET'])
+@custom_require_login
+def query_catalogs():
+	""" Query sources across all ingested job catalogs of this user """
+
+	# - Init response
+	res= {}
+	res['status']= ''
+
+	# - Get aai info
+	identity= get_identity()
+	username= identity.username
+
+	# - Parse query options
+	max_njobs= current_app.config['CATALOG_QUERY_MAX_JOBS']
+	max_rows= current_app.config['CATALOG_QUERY_MAX_ROWS']
+	try:
+		ra= get_float_arg('ra')
+		dec= get_float_arg('dec')
+		radius= get_float_arg('radius')
+		flux_min= get_float_arg('flux_min')
+		flux_max= get_float_arg('flux_max')
+		last_njobs= int(request.args.get('last_njobs', max_njobs))
+		nrows= int(request.args.get('max_rows', max_rows))
+	except ValueError as e:
+		errmsg= 'Invalid query parameters given (err=' + str(e) + ')!'
+		logger.warn(errmsg, action="catalogquery", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),400)
+
+	cone_pars= [ra, dec, radius]
+	if any(item is not None for item in cone_pars) and not all(item is not None for item in cone_pars):
+		errmsg= 'Cone search requires ra, dec and radius parameters (in degrees)!'
+		logger.warn(errmsg, action="catalogquery", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),400)
+
+	job_ids= None
+	if 'job_ids' in request.args:
+		job_ids= [item for item in request.args['job_ids'].split(',') if item!='']
+
+	last_njobs= max(1, min(last_njobs, max_njobs))
+	nrows= max(1, min(nrows, max_rows))
+
+	# - Run query
+	logger.info("Querying catalogs (ra=%s, dec=%s, radius=%s, flux=[%s,%s], last_njobs=%d) ..." % (ra, dec, radius, flux_min, flux_max, last_njobs), action="catalogquery", user=username)
+	try:
+		res= catalog_store.query_catalogs(
+			mongo.db, username,
+			ra=ra, dec=dec, radius=radius,
+			flux_min=flux_min, flux_max=flux_max,
+			job_ids=job_ids,
+			last_njobs=last_njobs,
+			max_rows=nrows
+		)
+	except Exception as e:
+		errmsg= 'Exception caught when querying catalogs (err=' + str(e) + ')!'
+		logger.error(errmsg, action="catalogquery", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),500)
+
+	res['status']= ''
+	return make_response(jsonify(res),200)
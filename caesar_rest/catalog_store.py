@@ -0,0 +1,400 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+import numpy as np
+import glob
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   CATALOG TABLE SCHEMA
+##############################
+# - Columns stored in the columnar catalog store
+#   NB: Only the core columns shared by all source finders are stored,
+#       full source info is still available in the per-job catalog files
+CATALOG_DTYPE= np.dtype([
+	('job_id', 'U32'),
+	('index', 'i8'),
+	('name', 'U64'),
+	('x', 'f8'),
+	('y', 'f8'),
+	('ra', 'f8'),
+	('dec', 'f8'),
+	('flux', 'f8'),
+	('hpix', 'i8')
+])
+
+# - Candidate field names in json catalogs (first found is taken)
+CATALOG_SOURCE_KEYS= ['sources', 'islands', 'components']
+CATALOG_NAME_KEYS= ['name', 'Name', 'source_name']
+CATALOG_X_KEYS= ['x0', 'X0', 'x', 'pos_x']
+CATALOG_Y_KEYS= ['y0', 'Y0', 'y', 'pos_y']
+CATALOG_RA_KEYS= ['x0_wcs', 'X0_wcs', 'ra', 'RA', 'pos_x_wcs']
+CATALOG_DEC_KEYS= ['y0_wcs', 'Y0_wcs', 'dec', 'DEC', 'pos_y_wcs']
+CATALOG_FLUX_KEYS= ['S', 'flux', 'Stot', 'int_flux', 'fluxDensity']
+
+# - Default HEALPix resolution of the per-user sky index (nside=64 -> ~0.92 deg pixels)
+CATALOG_HPIX_NSIDE= 64
+
+
+##############################
+#   HEALPIX SKY INDEX
+##############################
+def ang2pix_nest(nside, ra, dec):
+	""" Return HEALPix NESTED pixel ids for given ra/dec arrays (in degrees) """
+
+	# - Convert to HEALPix angles
+	ra= np.asarray(ra, dtype=np.float64)
+	dec= np.asarray(dec, dtype=np.float64)
+	z= np.sin(np.radians(dec))
+	za= np.abs(z)
+	tt= np.mod(np.radians(ra), 2*np.pi) * 2./np.pi # in [0,4)
+
+	face= np.zeros(z.shape, dtype=np.int64)
+	ix= np.zeros(z.shape, dtype=np.int64)
+	iy= np.zeros(z.shape, dtype=np.int64)
+
+	# - Equatorial region
+	eq= (za<=2./3.)
+	if np.any(eq):
+		temp1= nside*(0.5 + tt[eq])
+		temp2= nside*z[eq]*0.75
+		jp= (temp1-temp2).astype(np.int64)
+		jm= (temp1+temp2).astype(np.int64)
+		ifp= jp//nside
+		ifm= jm//nside
+		face[eq]= np.where(ifp==ifm, ifp | 4, np.where(ifp<ifm, ifp, ifm+8))
+		ix[eq]= jm & (nside-1)
+		iy[eq]= nside - (jp & (nside-1)) - 1
+
+	# - Polar caps
+	pol= ~eq
+	if np.any(pol):
+		ntt= np.minimum(3, tt[pol].astype(np.int64))
+		tp= tt[pol] - ntt
+		tmp= nside*np.sqrt(3*(1-za[pol]))
+		jp= np.minimum(nside-1, (tp*tmp).astype(np.int64))
+		jm= np.minimum(nside-1, ((1.-tp)*tmp).astype(np.int64))
+		north= (z[pol]>=0)
+		face[pol]= np.where(north, ntt, ntt+8)
+		ix[pol]= np.where(north, nside-jm-1, jp)
+		iy[pol]= np.where(north, nside-jp-1, jm)
+
+	# - Interleave ix/iy bits to get the nested index within the face
+	ipf= np.zeros(z.shape, dtype=np.int64)
+	order= int(np.log2(nside))
+	for bit in range(order):
+		ipf|= ((ix>>bit) & 1) << (2*bit)
+		ipf|= ((iy>>bit) & 1) << (2*bit+1)
+
+	return face*nside*nside + ipf
+
+
+def angular_distance(ra0, dec0, ra, dec):
+	""" Return angular distance in degrees between (ra0,dec0) and arrays (ra,dec) """
+
+	ra0_rad= np.radians(ra0)
+	dec0_rad= np.radians(dec0)
+	ra_rad= np.radians(ra)
+	dec_rad= np.radians(dec)
+
+	# - Haversine formula (numerically stable at small distances)
+	sdlat= np.sin(0.5*(dec_rad-dec0_rad))
+	sdlon= np.sin(0.5*(ra_rad-ra0_rad))
+	a= sdlat**2 + np.cos(dec0_rad)*np.cos(dec_rad)*sdlon**2
+
+	return np.degrees(2*np.arcsin(np.sqrt(np.clip(a, 0., 1.))))
+
+
+def get_disc_pixels(nside, ra0, dec0, radius):
+	""" Return a superset of HEALPix NESTED pixels overlapping the given cone (in degrees) """
+
+	# - Sample the cone enlarged by a pixel margin on a grid finer than the pixel size.
+	#   Every pixel touching the cone lies entirely within the enlarged cone,
+	#   so it contains at least one grid point.
+	pixres= np.degrees(np.sqrt(4*np.pi/(12.*nside*nside)))
+	step= pixres/3.
+	rmax= min(radius + 2*pixres, 180.)
+
+	dec_grid= np.arange(max(dec0-rmax, -90.), min(dec0+rmax, 90.)+step, step)
+	dec_grid= np.clip(dec_grid, -90., 90.)
+	ra_list= []
+	dec_list= []
+	for dec in dec_grid:
+		cosdec= max(np.cos(np.radians(dec)), 1.e-6)
+		ra_halfwidth= min(rmax/cosdec, 180.)
+		ra_grid= np.arange(ra0-ra_halfwidth, ra0+ra_halfwidth+step/cosdec, step/cosdec)
+		ra_list.append(ra_grid)
+		dec_list.append(np.full(ra_grid.shape, dec))
+
+	ra_pts= np.concatenate(ra_list)
+	dec_pts= np.concatenate(dec_list)
+	sel= angular_distance(ra0, dec0, ra_pts, dec_pts)<=rmax
+
+	return np.unique(ang2pix_nest(nside, ra_pts[sel], dec_pts[sel]))
+
+
+##############################
+#   CATALOG CONVERSION
+##############################
+def get_field_value(d, keys, default=np.nan):
+	""" Return the value of the first key found in dictionary """
+
+	for key in keys:
+		if key in d:
+			return d[key]
+	return default
+
+
+def read_catalog_json(filename):
+	""" Read a json catalog and return the list of source dictionaries """
+
+	try:
+		with open(filename) as f:
+			data= json.load(f)
+	except Exception as e:
+		logger.warn("Failed to read json catalog %s (err=%s)!" % (filename, str(e)), action="catalogingest")
+		return None
+
+	if isinstance(data, list):
+		return data
+
+	if isinstance(data, dict):
+		for key in CATALOG_SOURCE_KEYS:
+			if key in data and isinstance(data[key], list):
+				return data[key]
+
+	logger.warn("Unrecognized json catalog format in file %s!" % filename, action="catalogingest")
+	return None
+
+
+def make_catalog_table(sources, job_id, nside=CATALOG_HPIX_NSIDE):
+	""" Convert a list of source dictionaries to a columnar numpy record array """
+
+	nsources= len(sources)
+	table= np.zeros(nsources, dtype=CATALOG_DTYPE)
+	if nsources<=0:
+		return table
+
+	table['job_id']= job_id
+	table['index']= np.arange(nsources)
+	table['name']= [str(get_field_value(s, CATALOG_NAME_KEYS, '')) for s in sources]
+
+	for colname, keys in [('x',CATALOG_X_KEYS), ('y',CATALOG_Y_KEYS), ('ra',CATALOG_RA_KEYS), ('dec',CATALOG_DEC_KEYS), ('flux',CATALOG_FLUX_KEYS)]:
+		values= []
+		for s in sources:
+			try:
+				values.append(float(get_field_value(s, keys)))
+			except (TypeError, ValueError):
+				values.append(np.nan)
+		table[colname]= values
+
+	# - Compute sky index (-1 for sources without valid sky coordinates)
+	has_coords= np.isfinite(table['ra']) & np.isfinite(table['dec'])
+	table['hpix']= -1
+	if np.any(has_coords):
+		table['hpix'][has_coords]= ang2pix_nest(nside, table['ra'][has_coords], table['dec'][has_coords])
+
+	return table
+
+
+def get_column_range(table, colname):
+	""" Return min/max of finite column values (None if not available) """
+
+	values= table[colname]
+	values= values[np.isfinite(values)]
+	if values.size<=0:
+		return (None, None)
+	return (float(values.min()), float(values.max()))
+
+
+##############################
+#   CATALOG INGESTION
+##############################
+def ingest_job_catalog(db, username, job_id, job_dir, catalog_dir, nside=CATALOG_HPIX_NSIDE):
+	""" Convert job source catalog to columnar format and register it in the user sky index """
+
+	# - Check inputs
+	if db is None:
+		logger.warn("None DB instance given, cannot ingest catalog!", action="catalogingest", user=username)
+		return -1
+	if catalog_dir is None or catalog_dir=="":
+		logger.debug("No catalog dir given, catalog ingestion disabled ...", action="catalogingest", user=username)
+		return 0
+
+	# - Search for island catalog in job directory
+	filenames= glob.glob(os.path.join(job_dir, 'catalog-*.json'))
+	if not filenames:
+		logger.info("No json catalog found in job dir %s, nothing to be ingested ..." % job_dir, action="catalogingest", user=username)
+		return 0
+	filename= filenames[0]
+
+	# - Read catalog and convert it to table
+	sources= read_catalog_json(filename)
+	if sources is None:
+		return -1
+
+	t0= time.time()
+	table= make_catalog_table(sources, job_id, nside)
+
+	# - Save table
+	user_catalog_dir= os.path.join(catalog_dir, username)
+	try:
+		os.makedirs(user_catalog_dir)
+	except OSError:
+		if not os.path.isdir(user_catalog_dir):
+			logger.warn("Failed to create catalog dir %s!" % user_catalog_dir, action="catalogingest", user=username)
+			return -1
+
+	outfile= os.path.join(user_catalog_dir, 'catalog_job_' + job_id + '.npy')
+	try:
+		np.save(outfile, table)
+	except Exception as e:
+		logger.warn("Failed to save catalog table %s (err=%s)!" % (outfile, str(e)), action="catalogingest", user=username)
+		return -1
+
+	# - Register partition in sky index, storing column stats for predicate pushdown
+	ra_range= get_column_range(table, 'ra')
+	dec_range= get_column_range(table, 'dec')
+	flux_range= get_column_range(table, 'flux')
+	hpix= np.unique(table['hpix'][table['hpix']>=0])
+
+	catalog_obj= {
+		"job_id": job_id,
+		"filepath": outfile,
+		"nsources": int(table.size),
+		"nside": nside,
+		"hpix": [int(item) for item in hpix],
+		"ra_min": ra_range[0],
+		"ra_max": ra_range[1],
+		"dec_min": dec_range[0],
+		"dec_max": dec_range[1],
+		"flux_min": flux_range[0],
+		"flux_max": flux_range[1],
+		"ingest_date": datetime.datetime.utcnow()
+	}
+
+	collection_name= username + '.catalogs'
+	try:
+		coll= db[collection_name]
+		coll.create_index("job_id", unique=True)
+		coll.create_index([("hpix",1),("ingest_date",-1)])
+		coll.replace_one({'job_id': job_id}, catalog_obj, upsert=True)
+	except Exception as e:
+		logger.warn("Failed to register catalog of job %s in DB (err=%s)!" % (job_id, str(e)), action="catalogingest", user=username)
+		return -1
+
+	dt= time.time()-t0
+	logger.info("Ingested %d sources from job %s catalog in %f s ..." % (table.size, job_id, dt), action="catalogingest", user=username)
+
+	return 0
+
+
+##############################
+#   CATALOG QUERY
+##############################
+def query_catalogs(db, username, ra=None, dec=None, radius=None, flux_min=None, flux_max=None, job_ids=None, last_njobs=500, max_rows=10000):
+	""" Query sources across user job catalogs """
+
+	# - Init response
+	res= {
+		'sources': [],
+		'nsources': 0,
+		'njobs_scanned': 0,
+		'njobs_pruned': 0,
+		'truncated': False
+	}
+
+	# - Build partition filter (pushed down to the sky index)
+	cone= (ra is not None and dec is not None and radius is not None)
+	query= {}
+	if job_ids:
+		query['job_id']= {'$in': job_ids}
+	if flux_min is not None:
+		query['flux_max']= {'$gte': flux_min}
+	if flux_max is not None:
+		query['flux_min']= {'$lte': flux_max}
+	if cone:
+		query['dec_max']= {'$gte': dec-radius}
+		query['dec_min']= {'$lte': dec+radius}
+
+	# - Retrieve partitions
+	collection_name= username + '.catalogs'
+	coll= db[collection_name]
+	cursor= coll.find(query, projection={'_id':0, 'hpix':0}).sort('ingest_date', -1).limit(last_njobs)
+	partitions= list(cursor)
+
+	# - Prune partitions by sky index
+	disc_pixels= None
+	if cone:
+		nsides= set([p['nside'] for p in partitions])
+		disc_pixels= {}
+		for nside in nsides:
+			disc_pixels[nside]= get_disc_pixels(nside, ra, dec, radius)
+
+		selected_ids= set()
+		for nside in nsides:
+			pix_query= {'job_id': {'$in': [p['job_id'] for p in partitions if p['nside']==nside]}, 'hpix': {'$in': [int(item) for item in disc_pixels[nside]]}}
+			for item in coll.find(pix_query, projection={'_id':0, 'job_id':1}):
+				selected_ids.add(item['job_id'])
+
+		res['njobs_pruned']= len(partitions) - len(selected_ids)
+		partitions= [p for p in partitions if p['job_id'] in selected_ids]
+
+	# - Scan selected partitions with vectorized filters
+	tables= []
+	nrows= 0
+	for p in partitions:
+		try:
+			table= np.load(p['filepath'], mmap_mode='r')
+		except Exception as e:
+			logger.warn("Failed to load catalog table %s (err=%s), skip it ..." % (p['filepath'], str(e)), action="catalogquery", user=username)
+			continue
+
+		res['njobs_scanned']+= 1
+		mask= np.ones(table.size, dtype=bool)
+		if flux_min is not None:
+			mask&= (table['flux']>=flux_min)
+		if flux_max is not None:
+			mask&= (table['flux']<=flux_max)
+		if cone:
+			mask&= np.isin(table['hpix'], disc_pixels[p['nside']])
+			mask[mask]= angular_distance(ra, dec, table['ra'][mask], table['dec'][mask])<=radius
+
+		selected= np.asarray(table[mask])
+		if selected.size<=0:
+			continue
+		tables.append(selected)
+		nrows+= selected.size
+		if nrows>=max_rows:
+			res['truncated']= True
+			break
+
+	if not tables:
+		return res
+
+	# - Convert to records
+	table= np.concatenate(tables)[:max_rows]
+	colnames= [name for name in CATALOG_DTYPE.names if name!='hpix']
+	columns= [table[name].tolist() for name in colnames]
+	sources= []
+	for row in zip(*columns):
+		d= dict(zip(colnames, row))
+		for key in ['x','y','ra','dec','flux']:
+			if d[key]!=d[key]: # NaN is not valid json
+				d[key]= None
+		sources.append(d)
+
+	res['sources']= sources
+	res['nsources']= len(sources)
+
+	return res
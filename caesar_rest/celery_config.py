@@ -17,13 +17,27 @@ beat_schedule = {
   	'task': 'caesar_rest.accounter.accounter_task',
   	'schedule': 120.0,
 	},
+	'storage_reconciler_beat': {
+  	'task': 'caesar_rest.accounter.storage_reconciler_task',
+  	'schedule': 21600.0, # full storage scan, counters are updated incrementally in between
+  	'options': {'expires': 3600.0},
+	},
 	'job_monitoring_beat': {
   	'task': 'caesar_rest.job_monitor.jobmonitor_task',
   	'schedule': 30.0,
+  	'options': {'expires': 25.0}, # drop beats not started before the next one
 	},
 }
 
 
+# - TASK ROUTING OPTIONS
+#   Job post-processing (archives, previews, catalog ingestion) of Celery jobs and archives of Kube/Slurm jobs run on a dedicated queue
+#   so that it can be served by workers with their own concurrency
+task_routes = {
+	'caesar_rest.workers.postprocess_task': {'queue': 'postprocess'},
+	'caesar_rest.job_monitor.archive_task': {'queue': 'postprocess'},
+}
+
 # - OTHER TASK OPTIONS
 imports = ('caesar_rest.workers','caesar_rest.accounter','caesar_rest.job_monitor')
 accept_content = ['json', 'application/text']
@@ -35,6 +35,27 @@ class Config(object):
 
 	JOB_SCHEDULER= 'celery' # Options are: {'celery','kubernetes','slurm'}
 
+	# - JOB UPDATE WRITER options (job state updates are written with batched DB bulk writes)
+	JOB_UPDATE_BATCH_SIZE= 100 # Max number of job updates written with a single bulk write
+	JOB_UPDATE_FLUSH_PERIOD= 10 # Max time (in seconds) deferred job updates (e.g. running job elapsed time) are kept before being written
+	JOB_UPDATE_METRICS_PERIOD= 300 # Period (in seconds) of DB write metrics logs (0=never)
+
+	# - CATALOG STORE options
+	CATALOG_DIR= '' # Directory where to store columnar source catalogs (empty=ingestion disabled)
+	CATALOG_QUERY_MAX_JOBS= 500
+	CATALOG_QUERY_MAX_ROWS= 10000
+
+	# - POST-PROCESSING options
+	PREVIEW_RENDERER= 'fast' # Renderer of image+regions plots made after caesar jobs {fast,matplotlib}
+
+	# - JOB EVENTS options
+	JOB_EVENTS_USE_CHANGE_STREAMS= True # If False (or not supported by DB server) poll active jobs index
+	JOB_EVENTS_POLL_PERIOD= 2 # in seconds
+	JOB_EVENTS_KEEPALIVE_PERIOD= 15 # Period (in seconds) of SSE keep-alive comments sent when no events occur
+	JOB_EVENTS_RECHECK_PERIOD= 30 # Period (in seconds) of job state re-check in DB for single-job event streams
+	JOB_EVENTS_MAX_STREAM_TIME= 3600 # Max duration (in seconds) of an event stream connection (clients reconnect)
+	JOB_EVENTS_MAX_WSGI_STREAMS= 1 # Max number of event streams served concurrently by each WSGI (Flask) process (0=no limit). Each one holds a uWSGI worker thread, serve SSE with the ASGI front-end (run_app_asgi.py) for more clients.
+
 	# - VOLUME MOUNTS options
 	MOUNT_RCLONE_VOLUME= False
 	MOUNT_VOLUME_PATH= '/mnt/storage'
@@ -63,12 +84,23 @@ class Config(object):
 	SLURM_AEGEAN_JOB_IMAGE= '/opt/containers/aegean/aegean-job_latest.sif'
 	SLURM_CUTEX_JOB_IMAGE= '/opt/containers/cutex/cutex-job_latest.sif'	
 	SLURM_MAX_CORE_PER_JOB= 4 # Maximum number of cores reserved for a job
+	SLURM_POOL_MAXSIZE= 16 # Max number of keep-alive connections to Slurm rest service
+	SLURM_MAX_RETRIES= 3 # Max number of retries of failed Slurm rest requests (with exponential backoff)
 	
+	# - Quota options (0=disabled)
+	QUOTA_MAX_STORAGE= 0 # Max storage (data+jobs) per user in GB
+	QUOTA_MAX_ACTIVE_JOBS= 0 # Max number of concurrent (pending/running) jobs per user
+	QUOTA_MAX_CPU_HOURS= 0 # Max job runtime per user in hours
+	QUOTA_CACHE_TTL= 10 # Time in seconds user usage counters are cached before being read again from DB
+
 	# - AAI options
 	USE_AAI = False
 	OIDC_CLIENT_SECRETS = 'config/client_secrets.json'
 	OIDC_OPENID_REALM = 'neanias-development'
 	OIDC_SCOPES = ['openid', 'email', 'profile']
+	OIDC_TOKEN_VALIDATION= 'introspection' # Token validation method {introspection,jwks}
+	OIDC_JWKS_URI= '' # JWKS url used in jwks validation (if empty discovered from issuer)
+	OIDC_TOKEN_CACHE_SIZE= 1024 # Max number of validated tokens cached per process
 
 	# - MONG DB options
 	USE_MONGO = False
@@ -95,6 +127,9 @@ class Config(object):
 	LOG_DIR= '/opt/caesar-rest/logs'
 	LOG_FILE= 'app_logs.json'
 	LOG_LEVEL= 'INFO'
+	LOG_FORMAT= 'json' # Console log format {json,console}
+	LOG_RATE_BURST= 10 # Max number of repetitive log events of the same type emitted per period (0=no limit)
+	LOG_RATE_PERIOD= 60 # Rate limit period (in seconds) of repetitive log events
 
 #	LOGGING = {
 #		"version": 1,
@@ -10,7 +10,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import uuid
 
 from threading import RLock
@@ -75,7 +74,6 @@ class DataManager(object):
 			if file_uuid not in self.data_dict:
 				self.data_dict[file_uuid]= filename
 				logger.info("Added file %s to dictionary with uuid=%s ..." % (filename,file_uuid))
-				logger.info("curr data dict=%s" % str(self.data_dict))
 
 		return 0
 
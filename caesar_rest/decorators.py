@@ -4,6 +4,8 @@
 from functools import wraps
 from flask import current_app, request, g
 from caesar_rest import oidc
+from caesar_rest.token_cache import token_cache, jwks_verifier
+from caesar_rest.identity import set_identity
 import json
 
 # Get logger
@@ -12,22 +14,74 @@ import json
 
 from caesar_rest import logger
 
+def get_request_token():
+	""" Return access token from request Authorization header (or from access_token form/query field if no header is given) """
+
+	token = None
+	if 'Authorization' in request.headers and request.headers['Authorization'].startswith('Bearer '):
+		token = request.headers['Authorization'].split(None,1)[1].strip()
+	elif request.mimetype in ('application/x-www-form-urlencoded', 'multipart/form-data') and 'access_token' in request.form:
+		token = request.form['access_token']
+	elif 'access_token' in request.args:
+		token = request.args['access_token']
+	return token
+
+
+def has_required_scopes(token_info, scopes_required):
+	""" Check if token info grants the required scopes """
+
+	if not scopes_required:
+		return True
+	token_scopes= set(token_info.get('scope', '').split(' '))
+	return set(scopes_required).issubset(token_scopes)
+
+
+def validate_token(token, scopes_required=None):
+	""" Validate token using the token cache, then local JWKS verification or remote introspection. Set g.oidc_token_info if valid. Return True or an error string. """
+
+	if not token:
+		return 'Token required but invalid'
+
+	# - Look for token in cache
+	token_info= token_cache.get(token)
+	if token_info is not None:
+		if not has_required_scopes(token_info, scopes_required):
+			return 'Token does not have required scopes'
+		g.oidc_token_info= token_info
+		return True
+
+	# - Validate token locally against JWKS keys
+	if current_app.config.get('OIDC_TOKEN_VALIDATION', 'introspection')=='jwks':
+		token_info= jwks_verifier.verify(token)
+		if token_info is None:
+			return 'Token required but invalid'
+		token_cache.put(token, token_info)
+		if not has_required_scopes(token_info, scopes_required):
+			return 'Token does not have required scopes'
+		g.oidc_token_info= token_info
+		return True
+
+	# - Validate token with identity provider introspection
+	validity = oidc.validate_token(token, scopes_required)
+	if validity is True:
+		token_cache.put(token, g.oidc_token_info)
+	return validity
+
+
 def custom_require_login(view_func, scopes_required=None, render_errors=True):
-	""" Decorator to require login only if AAI is enabled """
+	""" Decorator to require login only if AAI is enabled and set request user identity """
 	@wraps(view_func)
 	def decorated(*args, **kwargs):
 		aai_enabled= current_app.config['USE_AAI']
 		has_oidc= (oidc is not None)
-		token = None
-		if 'Authorization' in request.headers and request.headers['Authorization'].startswith('Bearer '):
-			token = request.headers['Authorization'].split(None,1)[1].strip()
-		if 'access_token' in request.form:
-			token = request.form['access_token']
-		elif 'access_token' in request.args:
-			token = request.args['access_token']
-
-		validity = oidc.validate_token(token, scopes_required) # no scopes required
-		if (validity is True) or (not aai_enabled or not has_oidc):
+		if not aai_enabled or not has_oidc:
+			set_identity(None)
+			return view_func(*args, **kwargs)
+
+		token= get_request_token()
+		validity = validate_token(token, scopes_required) # no scopes required
+		if validity is True:
+			set_identity(g.oidc_token_info) # resolved once per request, see get_identity()
 			return view_func(*args, **kwargs)
 		else:
 			response_body = {'error': 'invalid_token',
@@ -8,7 +8,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 
 try:
 	FileNotFoundError  # python3
@@ -27,7 +26,11 @@ from werkzeug.utils import secure_filename
 from caesar_rest import oidc
 from caesar_rest import utils
 from caesar_rest.decorators import custom_require_login
+from caesar_rest.identity import get_identity
 from caesar_rest import mongo
+from caesar_rest import img_stats
+from caesar_rest import storage_usage
+from caesar_rest import route_common
 from caesar_rest import logger
 from caesar_rest.config import Config
 from bson.objectid import ObjectId
@@ -42,6 +45,7 @@ from caesar_rest import logger
 download_id_bp = Blueprint('download_id', __name__,url_prefix='/caesar/api/v1.0')
 fileids_bp = Blueprint('fileids', __name__, url_prefix='/caesar/api/v1.0')
 delete_id_bp= Blueprint('delete_id', __name__,url_prefix='/caesar/api/v1.0')
+filestats_bp= Blueprint('filestats', __name__,url_prefix='/caesar/api/v1.0')
 
 
 # - Returns all file ids registered in the system
@@ -51,17 +55,14 @@ def get_registered_file_ids():
 	""" Returns all file ids registered in the system """
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info): 
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Get all file uuids
 	res= {}
-	collection_name= username + '.files'
 	try:
-		data_collection= mongo.db[collection_name]
-		file_cursor= data_collection.find({},projection={"_id":0, "filepath":0})
+		data_collection= identity.files_collection
+		file_cursor= data_collection.find({},projection=route_common.FILE_LIST_PROJECTION)
 		res = list(file_cursor)
 	except Exception as e:
 		errmsg= 'Exception caught when getting file ids from DB (err=' + str(e) + ')!'
@@ -80,10 +81,8 @@ def download_id():
 	""" Download data by uuid """
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info): 
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Get args
 	if request.method == 'POST':
@@ -106,18 +105,15 @@ def download_by_uuid(file_uuid):
 	}
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Search file uuid
-	collection_name= username + '.files'
 	item= None
 	try:
-		data_collection= mongo.db[collection_name]
+		data_collection= identity.files_collection
 		##item= data_collection.find_one({'_id': ObjectId(file_uuid)})
-		item= data_collection.find_one({'fileid': str(file_uuid)})
+		item= data_collection.find_one(route_common.get_file_query(file_uuid))
 
 	except Exception as e:
 		errmsg= 'Exception caught when searching file in DB (err=' + str(e) + ')!'
@@ -125,18 +121,9 @@ def download_by_uuid(file_uuid):
 		res['status']= errmsg
 		return make_response(jsonify(res),404)
 		
-	if item and item is not None:
-		file_path= item['filepath']
-		logger.info("File with uuid=%s found at path=%s ..." % (file_uuid, file_path), action="download", user=username)
-	else:
-		logger.warn("File with uuid=%s not found in DB!" % file_uuid, action="download", user=username)
-		file_path= ''
-	
-	if not file_path or file_path=='':
-		errmsg= 'File with uuid ' + file_uuid + ' not found on the system!'
-		logger.warn(errmsg, action="download", user=username)
-		res['status']= errmsg
-		return make_response(jsonify(res),404)
+	file_path, res, status_code= route_common.get_download_filepath(file_uuid, item, username)
+	if status_code!=200:
+		return make_response(jsonify(res),status_code)
 		
 	# - Return file to client	
 	logger.info("Returning file %s to client ..." % file_path, action="download", user=username)
@@ -146,12 +133,56 @@ def download_by_uuid(file_uuid):
 			as_attachment=True
 		)
 	except FileNotFoundError:
+		res, status_code= route_common.make_file_not_found_reply(file_uuid, username)
+		return make_response(jsonify(res),status_code)
+
+
+
+
+# - Returns image stats of file by uuid
+@filestats_bp.route('/filestats/<string:file_uuid>', methods=['GET'])
+@custom_require_login
+def get_file_stats(file_uuid):
+	""" Returns cached image stats (computed on first use if missing) """
+
+	# - Init response
+	res= {
+		'status': ''
+	}
+
+	# - Get aai info
+	identity= get_identity()
+	username= identity.username
+
+	# - Search file uuid
+	item= None
+	try:
+		data_collection= identity.files_collection
+		item= data_collection.find_one({'fileid': str(file_uuid)})
+	except Exception as e:
+		errmsg= 'Exception caught when searching file in DB (err=' + str(e) + ')!'
+		logger.error(errmsg, action="filestats", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),404)
+
+	if not item or item is None:
 		errmsg= 'File with uuid ' + file_uuid + ' not found on the system!'
-		logger.warn(errmsg, action="download", user=username)
+		logger.warn(errmsg, action="filestats", user=username)
 		res['status']= errmsg
 		return make_response(jsonify(res),404)
 
+	# - Get stats
+	recompute= request.args.get('recompute', 'false').lower() in ('yes', 'true', 't', 'y', '1')
+	stats= img_stats.get_file_stats(data_collection, item, recompute)
+	if stats is None:
+		errmsg= 'Stats not available for file with uuid ' + file_uuid + ' (unsupported format or failed computation)!'
+		logger.warn(errmsg, action="filestats", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),422)
 
+	res['fileid']= file_uuid
+	res['stats']= stats
+	return make_response(jsonify(res),200)
 
 
 @delete_id_bp.route('/delete/<string:file_uuid>', methods=['GET', 'POST'])
@@ -165,16 +196,13 @@ def delete_by_uuid(file_uuid):
 	}
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Search file uuid
-	collection_name= username + '.files'
 	item= None
 	try:
-		data_collection= mongo.db[collection_name]
+		data_collection= identity.files_collection
 		item= data_collection.find_one({'fileid': str(file_uuid)})
 
 	except Exception as e:
@@ -200,6 +228,7 @@ def delete_by_uuid(file_uuid):
 		
 	# - Remove file from filesystem
 	try:
+		file_bytes= os.path.getsize(file_path)
 		os.remove(file_path)
 	except Exception as e:
 		errmsg= 'File with uuid ' + file_uuid + ' failed to be deleted (err=' + str(e) + ')!'
@@ -207,9 +236,12 @@ def delete_by_uuid(file_uuid):
 		res['status']= errmsg
 		return make_response(jsonify(res),404)
 
+	# - Update user storage usage counters
+	storage_usage.add_storage_usage(mongo.db, username, datasize=-file_bytes)
+
 	# - Remove file from DB
 	try:
-		data_collection= mongo.db[collection_name]
+		data_collection= identity.files_collection
 		result= data_collection.delete_one({'fileid': str(file_uuid)})
 		if result.deleted_count<=0:
 			errmsg= "DB returned <=0 number of files deleted"
@@ -0,0 +1,94 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import logging
+
+# Import Flask modules
+from flask import g, has_app_context
+
+# Import caesar_rest modules
+from caesar_rest import mongo
+from caesar_rest import utils
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   USER IDENTITY
+##############################
+# - Username set when AAI is disabled or token has no email claim
+ANONYMOUS_USER= 'anonymous'
+
+class UserIdentity(object):
+	""" Identity of the user issuing the request, with per-user collection names and lazily created collection handles """
+
+	def __init__(self, username=ANONYMOUS_USER, email='', token_info=None):
+
+		self.username= username
+		self.email= email
+		self.token_info= token_info
+
+		# - Per-user collection names
+		self.files_collection_name= username + '.files'
+		self.jobs_collection_name= username + '.jobs'
+		self.accounting_collection_name= username + '.accounting'
+
+		# - Collection handles (created on first use)
+		self._files_collection= None
+		self._jobs_collection= None
+		self._accounting_collection= None
+
+	@classmethod
+	def from_token_info(cls, token_info):
+		""" Create identity from validated token info (anonymous if missing or without email) """
+
+		if token_info is None or 'email' not in token_info:
+			return cls()
+		email= token_info['email']
+		return cls(utils.sanitize_username(email), email, token_info)
+
+	@property
+	def files_collection(self):
+		""" Return user data file collection """
+		if self._files_collection is None:
+			self._files_collection= mongo.db[self.files_collection_name]
+		return self._files_collection
+
+	@property
+	def jobs_collection(self):
+		""" Return user job collection """
+		if self._jobs_collection is None:
+			self._jobs_collection= mongo.db[self.jobs_collection_name]
+		return self._jobs_collection
+
+	@property
+	def accounting_collection(self):
+		""" Return user accounting collection """
+		if self._accounting_collection is None:
+			self._accounting_collection= mongo.db[self.accounting_collection_name]
+		return self._accounting_collection
+
+
+def set_identity(token_info=None):
+	""" Resolve identity of current request from token info and store it in request context """
+
+	g.identity= UserIdentity.from_token_info(token_info)
+	return g.identity
+
+
+def get_identity():
+	""" Return identity of current request, as resolved by auth decorator (resolved from token info if not set, anonymous outside of app context) """
+
+	if not has_app_context():
+		return UserIdentity()
+	identity= g.get('identity', None)
+	if identity is None:
+		identity= UserIdentity.from_token_info(g.get('oidc_token_info', None))
+	return identity
+
@@ -0,0 +1,203 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+import numpy as np
+
+# NB: astro modules are imported on first use (they take seconds to load)
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   STATS OPTIONS
+##############################
+# - Version of stats document (increase when stats content changes to force recomputation)
+IMG_STATS_VERSION= 1
+
+# - Default sampling & histogram options
+IMG_STATS_NSAMPLES= 250000
+IMG_STATS_MAX_SAMPLE_ROWS= 500
+IMG_STATS_NBINS= 100
+IMG_STATS_ZSCALE_CONTRAST= 0.3
+IMG_STATS_ZSCALE_NSAMPLES= 1000 # NB: ZScale fit cost grows fast with samples and degenerates to min/max for large samples
+
+# - File formats for which stats are computed
+IMG_STATS_FILE_FORMATS= ['fits']
+
+# - MAD to gaussian sigma conversion factor
+MAD_TO_SIGMA= 1.4826
+
+
+##############################
+#   STATS COMPUTATION
+##############################
+def read_img_sample(imgfile, nsamples=IMG_STATS_NSAMPLES, max_rows=IMG_STATS_MAX_SAMPLE_ROWS):
+	""" Read a regular pixel sample from a FITS image (only sampled rows are read from disk). Return sample and total number of pixels. """
+
+	from astropy.io import fits
+
+	hdu= fits.open(imgfile, memmap=True)
+	data= hdu[0].data
+
+	# - Remove 3 and 4 channels
+	nchan= len(data.shape)
+	if nchan==4:
+		data= data[0,0,:,:]
+	elif nchan==3:
+		data= data[0,:,:]
+	elif nchan!=2:
+		hdu.close()
+		raise ValueError("Invalid/unrecognized number of channels (%d)!" % nchan)
+
+	# - Sample evenly spaced rows, then evenly spaced pixels within each row
+	ny, nx= data.shape
+	nrows= min(ny, max_rows)
+	row_indices= np.unique(np.linspace(0, ny-1, nrows).astype(np.int64))
+	col_stride= max(1, int(nx*len(row_indices)//nsamples))
+	sample= np.asarray(data[row_indices, ::col_stride], dtype=np.float64).ravel()
+	hdu.close()
+
+	return sample, nx*ny
+
+
+def compute_img_stats(imgfile, nsamples=IMG_STATS_NSAMPLES, nbins=IMG_STATS_NBINS, contrast=IMG_STATS_ZSCALE_CONTRAST):
+	""" Compute image stats (ZScale limits, robust mean/median/MAD, NaN fraction, histogram) on a pixel sample. Return None on failure. """
+
+	from astropy.visualization import ZScaleInterval
+
+	t0= time.time()
+
+	# - Read pixel sample
+	try:
+		sample, npixels= read_img_sample(imgfile, nsamples)
+	except Exception as e:
+		logger.warn("Failed to read pixel sample from image %s (err=%s)!" % (imgfile, str(e)))
+		return None
+
+	stats= {
+		'version': IMG_STATS_VERSION,
+		'npixels': int(npixels),
+		'nsamples': int(sample.size),
+		'nan_fraction': None,
+		'min': None,
+		'max': None,
+		'mean': None,
+		'robust_mean': None,
+		'median': None,
+		'mad': None,
+		'stddev': None,
+		'zscale_min': None,
+		'zscale_max': None,
+		'zscale_contrast': contrast,
+		'hist': {'bins': [], 'counts': []},
+		'date': datetime.datetime.now().isoformat()
+	}
+	if sample.size==0:
+		return stats
+
+	finite= np.isfinite(sample)
+	stats['nan_fraction']= float(1. - np.count_nonzero(finite)/float(sample.size))
+	sample= sample[finite]
+	if sample.size==0:
+		return stats
+
+	# - Compute moments & robust estimators
+	median= np.median(sample)
+	mad= np.median(np.abs(sample-median))
+	stddev= MAD_TO_SIGMA*mad
+
+	clipped= sample
+	if stddev>0:
+		clipped= sample[np.abs(sample-median)<=3*stddev]
+
+	stats['min']= float(sample.min())
+	stats['max']= float(sample.max())
+	stats['mean']= float(sample.mean())
+	stats['robust_mean']= float(clipped.mean()) if clipped.size>0 else float(median)
+	stats['median']= float(median)
+	stats['mad']= float(mad)
+	stats['stddev']= float(stddev)
+
+	# - Compute ZScale limits
+	try:
+		zscale_sample= sample[::max(1, sample.size//IMG_STATS_ZSCALE_NSAMPLES)]
+		zmin, zmax= ZScaleInterval(n_samples=zscale_sample.size, contrast=contrast).get_limits(zscale_sample)
+		stats['zscale_min']= float(zmin)
+		stats['zscale_max']= float(zmax)
+	except Exception as e:
+		logger.warn("Failed to compute ZScale limits for image %s (err=%s)!" % (imgfile, str(e)))
+
+	# - Compute histogram over central range (0.5-99.5 percentiles) to avoid outliers
+	hmin, hmax= np.percentile(sample, [0.5, 99.5])
+	if hmax<=hmin:
+		hmin= stats['min']
+		hmax= stats['max'] if stats['max']>stats['min'] else stats['min']+1.
+	counts, bins= np.histogram(sample, bins=nbins, range=(hmin, hmax))
+	stats['hist']['bins']= bins.tolist()
+	stats['hist']['counts']= counts.tolist()
+
+	logger.info("Computed stats for image %s on %d/%d pixels in %.3f s" % (imgfile, sample.size, npixels, time.time()-t0))
+
+	return stats
+
+
+##############################
+#   STATS CACHE
+##############################
+def has_valid_stats(item):
+	""" Check if file document has up-to-date stats """
+
+	if not item or 'stats' not in item or not item['stats']:
+		return False
+	return item['stats'].get('version', 0)==IMG_STATS_VERSION
+
+
+def get_file_stats(data_collection, item, recompute=False):
+	""" Return stats stored in file document, computing and storing them on first use. Return None on failure. """
+
+	if item is None:
+		return None
+	if has_valid_stats(item) and not recompute:
+		return item['stats']
+
+	# - Compute stats only for supported formats
+	if item.get('fileext', '').lower() not in IMG_STATS_FILE_FORMATS:
+		return None
+
+	filepath= item['filepath']
+	stats= compute_img_stats(filepath)
+	if stats is None:
+		return None
+
+	# - Store stats in file document
+	try:
+		data_collection.update_one({'fileid': item['fileid']}, {'$set': {'stats': stats}}, upsert=False)
+	except Exception as e:
+		logger.warn("Failed to store stats of file %s in DB (err=%s)!" % (filepath, str(e)))
+
+	return stats
+
+
+def get_file_stats_by_path(db, username, filepath):
+	""" Return cached stats of a user file given its path. Return None if file is not registered or stats cannot be computed. """
+
+	if db is None:
+		return None
+
+	collection_name= username + '.files'
+	try:
+		data_collection= db[collection_name]
+		item= data_collection.find_one({'filepath': filepath})
+	except Exception as e:
+		logger.warn("Failed to search file %s in DB (err=%s)!" % (filepath, str(e)))
+		return None
+
+	return get_file_stats(data_collection, item)
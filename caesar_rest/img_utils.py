@@ -0,0 +1,377 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+import struct
+import zlib
+import numpy as np
+
+# NB: astro (astropy, regions) and graphics (matplotlib) modules are imported on first use
+#     as they take seconds to load and are only needed by job post-processing
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+# - Renderers of image+regions plots {fast=numpy rasterizer, matplotlib=publication quality but slow}
+PREVIEW_RENDERERS= ['fast', 'matplotlib']
+
+def read_region_file(regionfile):
+	""" Read DS9 region file and return the list of regions (Regions.read in regions>=0.6, read_ds9 in older versions) """
+
+	import regions
+	if hasattr(regions, 'Regions'):
+		return list(regions.Regions.read(regionfile, format='ds9'))
+	return regions.read_ds9(regionfile)
+
+
+def plot_img_and_regions(imgfile, regionfiles=[], zmin=0, zmax=0, cmap="afmhot", contrast=0.3, save=False, outfile="plot.png"):
+	""" Plot input FITS and regions with matplotlib (publication quality, slow on large images) """
+
+	from astropy.io import fits
+	from astropy.visualization import LinearStretch, ImageNormalize
+	import matplotlib as mpl
+	from matplotlib import pyplot as plt
+	mpl.rcParams['xtick.direction'] = 'in'
+	mpl.rcParams['ytick.direction'] = 'in'
+
+	#===========================
+	#==   READ REGION
+	#===========================
+	regs= []
+	for regionfile in regionfiles:
+		logger.info("Reading region file %s ..." % regionfile)
+		region_list= read_region_file(regionfile)
+		regs.extend(region_list)
+
+	#===========================
+	#==   READ IMAGE
+	#===========================
+	# - Read fits
+	try:
+		hdu= fits.open(imgfile)
+		data= hdu[0].data
+		header= hdu[0].header
+	except:
+		logger.error("Failed to open input img %s!" % imgfile)
+		return -1
+
+	# - Remove 3 and 4 channels
+	nchan= len(data.shape)
+	logger.info("Input image has %d channels..." % nchan)
+	if nchan==4:
+		data= data[0,0,:,:]
+	elif nchan==3:
+		data= data[0,:,:]
+	else:
+		if nchan!=2:	
+			logger.error("Invalid/unrecognized number of channels (%d)!" % nchan)
+			return -1
+		
+	# - Get image units	
+	bunit= 'z'
+	if 'BUNIT' in header:
+		bunit= header['BUNIT']
+
+	# - Set stretch (ZScale limits computed on a pixel sample if not given)
+	stretch= LinearStretch()
+	if zmin>=zmax:
+		zmin, zmax= get_zscale_limits(data, contrast=contrast)
+	norm = ImageNormalize(vmin=zmin, vmax=zmax, stretch=stretch)
+	
+	#===========================
+	#==   PLOT IMAGE
+	#===========================
+	# - Plot image	
+	fig = plt.figure(figsize=(10,10))
+	ax = fig.add_subplot(1, 1, 1)
+	im= ax.imshow(data, origin='lower', cmap=cmap, norm=norm)
+	
+	# - Set axis titles
+	ax.set_xlabel('x',size=18, labelpad=0.7)
+	ax.set_ylabel('y',size=18)
+
+	# - Draw color bar
+	color_bar_label= 'Brightness (' + bunit + ')'
+	cb= fig.colorbar(im, orientation="vertical", pad=0.01, fraction=0.047)
+	cb.set_label(color_bar_label, y=1.0, ha='right',size=12)
+	cb.ax.tick_params(labelsize=12) 
+
+	# - Set ticks
+	plt.tick_params(axis='x', labelsize=14)
+	plt.tick_params(axis='y', labelsize=14)
+
+	# - Superimpose regions
+	region_color= "lime"
+	region_style= "dashed"
+	#region_style= "solid"
+
+	if regs:
+		logger.debug("Superimposing region ...")
+		for r in regs:
+			r.plot(ax=ax, color=region_color, linestyle=region_style)
+	
+	# - Save or display
+	if save:
+		plt.savefig(outfile, bbox_inches='tight')
+	else:
+		plt.show()
+
+	return 0
+
+
+#=====================================
+#==   FAST IMAGE+REGION RENDERER
+#=====================================
+def read_fits_2d(imgfile):
+	""" Read FITS image (memory-mapped) and return 2D data and header """
+
+	from astropy.io import fits
+
+	hdu= fits.open(imgfile, memmap=True)
+	data= hdu[0].data
+	header= hdu[0].header
+
+	# - Remove 3 and 4 channels
+	nchan= len(data.shape)
+	if nchan==4:
+		data= data[0,0,:,:]
+	elif nchan==3:
+		data= data[0,:,:]
+	elif nchan!=2:
+		raise ValueError("Invalid/unrecognized number of channels (%d)!" % nchan)
+
+	return data, header
+
+
+def downsample_image(data, factor):
+	""" Block-downsample 2D image by given integer factor, averaging finite pixels in each block """
+
+	if factor<=1:
+		return np.asarray(data, dtype=np.float32)
+
+	ny, nx= data.shape
+	ny_c= (ny//factor)*factor
+	nx_c= (nx//factor)*factor
+	ny_ds= ny_c//factor
+	nx_ds= nx_c//factor
+
+	# - Average block rows one at a time to keep memory bounded on large mem-mapped images
+	data_ds= np.full((ny_ds, nx_ds), np.nan, dtype=np.float32)
+	for i in range(ny_ds):
+		block= np.asarray(data[i*factor:(i+1)*factor, :nx_c], dtype=np.float32).reshape(factor, nx_ds, factor)
+		finite= np.isfinite(block)
+		npix= finite.sum(axis=(0,2))
+		bsum= np.where(finite, block, 0).sum(axis=(0,2))
+		has_pix= npix>0
+		data_ds[i, has_pix]= bsum[has_pix]/npix[has_pix]
+
+	return data_ds
+
+
+def get_zscale_limits(data, contrast=0.3, nsamples=1000):
+	""" Compute ZScale limits on a regular sample of finite image pixels """
+
+	from astropy.visualization import ZScaleInterval
+
+	ny, nx= data.shape
+	row_stride= max(1, int(np.sqrt(float(ny)*nx/nsamples)))
+	col_stride= max(1, int(float(nx)*(ny//row_stride)/nsamples))
+	sample= np.asarray(data[::row_stride, ::col_stride], dtype=np.float64).ravel()
+	sample= sample[np.isfinite(sample)]
+	if sample.size==0:
+		return 0., 1.
+
+	zmin, zmax= ZScaleInterval(n_samples=sample.size, contrast=contrast).get_limits(sample)
+	if zmax<=zmin:
+		zmin= np.min(sample)
+		zmax= np.max(sample)
+		if zmax<=zmin:
+			zmax= zmin+1.
+	return zmin, zmax
+
+
+def get_colormap_lut(cmap, nlevels=256):
+	""" Return colormap look-up table as (nlevels,4) uint8 RGBA array """
+
+	import matplotlib as mpl
+
+	if hasattr(mpl, 'colormaps'):
+		cm= mpl.colormaps[cmap]
+	else:
+		cm= mpl.cm.get_cmap(cmap)
+	return cm(np.linspace(0., 1., nlevels), bytes=True)
+
+
+def get_region_outlines(regs, wcs=None, npoints=64):
+	""" Return list of region outline vertices (x,y arrays in pixel coordinates, closed) """
+
+	outlines= []
+	for r in regs:
+
+		# - Convert sky regions to pixel regions
+		if not hasattr(r, 'center') and not hasattr(r, 'vertices'):
+			continue
+		if hasattr(r, 'to_pixel') and type(r).__name__.endswith('SkyRegion'):
+			if wcs is None:
+				continue
+			try:
+				r= r.to_pixel(wcs)
+			except Exception:
+				continue
+
+		shape= type(r).__name__
+		t= np.linspace(0., 2*np.pi, npoints)
+
+		if shape=='PolygonPixelRegion':
+			x= np.append(r.vertices.x, r.vertices.x[0])
+			y= np.append(r.vertices.y, r.vertices.y[0])
+		elif shape=='CirclePixelRegion':
+			x= r.center.x + r.radius*np.cos(t)
+			y= r.center.y + r.radius*np.sin(t)
+		elif shape=='EllipsePixelRegion' or shape=='RectanglePixelRegion':
+			theta= np.radians(r.angle.to('deg').value) if hasattr(r.angle, 'to') else np.radians(r.angle)
+			if shape=='EllipsePixelRegion':
+				u= 0.5*r.width*np.cos(t)
+				v= 0.5*r.height*np.sin(t)
+			else:
+				u= 0.5*r.width*np.array([-1, 1, 1, -1, -1])
+				v= 0.5*r.height*np.array([-1, -1, 1, 1, -1])
+			x= r.center.x + u*np.cos(theta) - v*np.sin(theta)
+			y= r.center.y + u*np.sin(theta) + v*np.cos(theta)
+		elif shape=='PointPixelRegion':
+			x= r.center.x + np.array([-2, 2, 0, 0, 0])
+			y= r.center.y + np.array([0, 0, 0, -2, 2])
+		else:
+			continue
+
+		outlines.append((np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)))
+
+	return outlines
+
+
+def draw_outlines(rgba, outlines, color=(0,255,0,255), scale=1., dashed=True):
+	""" Rasterize region outlines (given in full-resolution pixel coords) into RGBA buffer (row 0=bottom) """
+
+	if not outlines:
+		return
+
+	ny, nx= rgba.shape[:2]
+	xs= []
+	ys= []
+	for x, y in outlines:
+		# - Map pixel centers to downsampled grid
+		x= (x+0.5)/scale - 0.5
+		y= (y+0.5)/scale - 0.5
+
+		# - Sample each segment with ~1 point per output pixel
+		seglen= np.hypot(np.diff(x), np.diff(y))
+		nsteps= np.maximum(np.ceil(seglen).astype(np.int64), 1)
+		seg_index= np.repeat(np.arange(seglen.size), nsteps)
+		offsets= np.arange(nsteps.sum()) - np.repeat(np.cumsum(nsteps)-nsteps, nsteps)
+		frac= offsets/np.repeat(nsteps, nsteps).astype(np.float64)
+		px= x[seg_index] + frac*(x[seg_index+1]-x[seg_index])
+		py= y[seg_index] + frac*(y[seg_index+1]-y[seg_index])
+		if dashed:
+			keep= (offsets//4)%2==0
+			px= px[keep]
+			py= py[keep]
+		xs.append(px)
+		ys.append(py)
+
+	ix= np.rint(np.concatenate(xs)).astype(np.int64)
+	iy= np.rint(np.concatenate(ys)).astype(np.int64)
+	inside= (ix>=0) & (ix<nx) & (iy>=0) & (iy<ny)
+	rgba[iy[inside], ix[inside]]= color
+
+
+def write_png(outfile, rgba, compress_level=3):
+	""" Write RGBA uint8 buffer (row 0=top) to PNG file without any imaging library """
+
+	ny, nx= rgba.shape[:2]
+	raw= np.empty((ny, nx*4+1), dtype=np.uint8)
+	raw[:,0]= 0 # no filter
+	raw[:,1:]= rgba.reshape(ny, nx*4)
+
+	def make_chunk(tag, data):
+		chunk= tag + data
+		return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+	with open(outfile, 'wb') as f:
+		f.write(b'\x89PNG\r\n\x1a\n')
+		f.write(make_chunk(b'IHDR', struct.pack('>IIBBBBB', nx, ny, 8, 6, 0, 0, 0)))
+		f.write(make_chunk(b'IDAT', zlib.compress(raw.tobytes(), compress_level)))
+		f.write(make_chunk(b'IEND', b''))
+
+
+def render_img_and_regions(imgfile, regionfiles=[], zmin=0, zmax=0, cmap="afmhot", contrast=0.3, outfile="plot.png", max_size=1024, region_color=(0,255,0,255)):
+	""" Render input FITS and regions to PNG without matplotlib figures (fast preview) """
+
+	t0= time.time()
+
+	#===========================
+	#==   READ IMAGE
+	#===========================
+	try:
+		data, header= read_fits_2d(imgfile)
+	except Exception as e:
+		logger.error("Failed to open input img %s (err=%s)!" % (imgfile, str(e)))
+		return -1
+
+	# - Downsample image to max output size
+	ny, nx= data.shape
+	factor= max(1, int(np.ceil(float(max(nx, ny))/max_size)))
+	data_ds= downsample_image(data, factor)
+	logger.info("Image %s (%dx%d) downsampled by factor %d ..." % (imgfile, nx, ny, factor))
+
+	#===========================
+	#==   COLOR MAP
+	#===========================
+	if zmin>=zmax:
+		zmin, zmax= get_zscale_limits(data_ds, contrast=contrast)
+
+	lut= get_colormap_lut(cmap)
+	nlevels= lut.shape[0]
+	norm= (data_ds-zmin)/(zmax-zmin)
+	levels= np.clip(np.nan_to_num(norm)*(nlevels-1), 0, nlevels-1).astype(np.uint8 if nlevels<=256 else np.int64)
+	rgba= lut[levels]
+	rgba[~np.isfinite(data_ds)]= (255,255,255,0)
+
+	#===========================
+	#==   DRAW REGIONS
+	#===========================
+	regs= []
+	for regionfile in regionfiles:
+		logger.info("Reading region file %s ..." % regionfile)
+		try:
+			regs.extend(read_region_file(regionfile))
+		except Exception as e:
+			logger.warn("Failed to read region file %s (err=%s), skip it ..." % (regionfile, str(e)))
+
+	if regs:
+		from astropy.wcs import WCS
+		wcs= None
+		try:
+			wcs= WCS(header).celestial
+		except Exception:
+			wcs= None
+		draw_outlines(rgba, get_region_outlines(regs, wcs), color=region_color, scale=float(factor))
+
+	#===========================
+	#==   SAVE
+	#===========================
+	try:
+		write_png(outfile, rgba[::-1]) # image origin is bottom-left
+	except Exception as e:
+		logger.error("Failed to write output image %s (err=%s)!" % (outfile, str(e)))
+		return -1
+
+	logger.info("Rendered img+regions to %s in %.2f s" % (outfile, time.time()-t0))
+
+	return 0
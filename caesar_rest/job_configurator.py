@@ -8,7 +8,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import subprocess
 import json
 import ast
@@ -45,7 +44,38 @@ class JobConfigurator(object):
 			'aegean': AegeanAppConfigurator,
 			'cutex': CutexAppConfigurator
 		}
-		
+
+		# - App configurators holding option schemas, built once and cloned for each job
+		#   NB: When preloaded in uWSGI master they are shared copy-on-write by all workers
+		self.app_configurator_templates= {}
+
+		# - Pre-serialized app descriptions (json strings)
+		self.app_descriptions= {}
+		self.app_descriptions_json= {}
+
+
+	def preload(self):
+		""" Build option schemas and descriptions of all apps (requires app context) """
+
+		for app_name in self.app_configurators:
+			self.get_app_description_json(app_name)
+
+		logger.info("#%d app configurators preloaded ..." % len(self.app_configurator_templates))
+
+
+	def get_app_configurator_template(self, app_name):
+		""" Return the app configurator holding option schema of given app (None if app is not supported) """
+
+		if app_name not in self.app_configurators:
+			return None
+
+		configurator= self.app_configurator_templates.get(app_name)
+		if configurator is None:
+			configurator= self.app_configurators[app_name]()
+			self.app_configurator_templates[app_name]= configurator
+
+		return configurator
+
 		
 	def validate(self, app_name, job_inputs, data_inputs):
 		""" Validate job inputs """
@@ -57,8 +87,8 @@ class JobConfigurator(object):
 			logger.warn(msg, action="submitjob")
 			return (None,None,msg,None)
 
-		# - Create an instance of app configurator
-		configurator= self.app_configurators[app_name]()
+		# - Create an app configurator for this job
+		configurator= self.get_app_configurator_template(app_name).clone()
 		
 		status= configurator.validate(job_inputs, data_inputs)
 		if not status:
@@ -85,14 +115,27 @@ class JobConfigurator(object):
 			logger.warn(msg, action="submitjob")
 			return None
 
-		# - Create an instance of app configurator
-		configurator= self.app_configurators[app_name]()
-
-		# - Get description
-		d= configurator.describe_dict()	
+		# - Get cached description
+		d= self.app_descriptions.get(app_name)
+		if d is None:
+			d= self.get_app_configurator_template(app_name).describe_dict()
+			self.app_descriptions[app_name]= d
 
 		return d
 
+	def get_app_description_json(self,app_name):
+		""" Return a json string describing given app (serialized once) """
+
+		json_str= self.app_descriptions_json.get(app_name)
+		if json_str is None:
+			d= self.get_app_description(app_name)
+			if d is None:
+				return None
+			json_str= json.dumps(d, sort_keys=True) + '\n'
+			self.app_descriptions_json[app_name]= json_str
+
+		return json_str
+
 	def get_app_names(self):
 		""" Return app names """
 		
@@ -115,11 +158,8 @@ class JobConfigurator(object):
 			logger.warn(msg, action="submitjob")
 			return None
 
-		# - Create an instance of app configurator
-		configurator= self.app_configurators[app_name]()
-
 		# - Get flag
-		flag= configurator.batch_processing_support
+		flag= self.get_app_configurator_template(app_name).batch_processing_support
 
 		return flag
 
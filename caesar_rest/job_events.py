@@ -0,0 +1,460 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+import threading
+
+try:
+	import queue # python3
+except ImportError:
+	import Queue as queue # python2
+
+# Import mongo
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Import caesar_rest modules
+from caesar_rest import active_jobs
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   EVENT OPTIONS
+##############################
+# - Job fields propagated in job events
+JOB_EVENT_FIELDS= ['state', 'status', 'elapsed_time', 'exit_code', 'postproc_state', 'postproc_status']
+
+# - Mongo error codes returned when change streams are not supported (standalone server)
+CHANGE_STREAM_UNSUPPORTED_CODES= [40573, 40324]
+
+# - Max time (in seconds) finished jobs are polled waiting for their post-processing to complete (polling mode)
+POSTPROC_POLL_MAX_TIME= 86400
+
+
+def get_job_topic(job_id):
+	""" Return pub/sub topic name for given job """
+	return 'job:' + str(job_id)
+
+
+def get_user_topic(username):
+	""" Return pub/sub topic name for all jobs of given user """
+	return 'user:' + str(username)
+
+
+def make_job_event(username, job_obj):
+	""" Create a job event from a job document """
+
+	event= {
+		'job_id': job_obj['job_id'],
+		'username': username,
+		'timestamp': datetime.datetime.utcnow().isoformat()
+	}
+	for field in JOB_EVENT_FIELDS:
+		if field in job_obj:
+			event[field]= job_obj[field]
+
+	return event
+
+
+def has_job_event_changed(event, last_event):
+	""" Check if any job state field changed with respect to last event """
+	return any(event.get(field)!=last_event.get(field) for field in JOB_EVENT_FIELDS)
+
+
+def is_job_stream_completed(event):
+	""" Check if single-job event stream can be closed (job and post-processing completed) """
+
+	state= event.get('state', '')
+	postproc_state= event.get('postproc_state', '')
+	return not active_jobs.is_active_state(state) and postproc_state!='PENDING' and postproc_state!='STARTED'
+
+
+##############################
+#   SERVER-SENT EVENTS
+##############################
+# - Headers of SSE responses
+SSE_HEADERS= {
+	'Cache-Control': 'no-cache',
+	'X-Accel-Buffering': 'no' # disable nginx buffering
+}
+
+# - Comment message sent when no event arrives within keepalive period
+SSE_KEEPALIVE= ': keepalive\n\n'
+
+
+def format_sse_event(event):
+	""" Format job event as Server-Sent Event message """
+
+	data= dict((k, v) for k, v in event.items() if k!='username')
+	return 'event: job\ndata: ' + json.dumps(data) + '\n\n'
+
+
+class JobEventStream(object):
+	""" State of an SSE stream of job events: only events changing job state fields are sent. Shared by WSGI and ASGI front-ends. """
+
+	def __init__(self, single_job=False):
+		self.single_job= single_job
+		self.last_events= {} # job_id -> last sent event
+		self.completed= False # set when single-job stream can be closed
+
+	def process(self, event, force=False):
+		""" Return SSE message for event (None if not to be sent) """
+
+		job_id= event['job_id']
+		last_event= self.last_events.get(job_id, {})
+		if not force and not has_job_event_changed(event, last_event):
+			return None
+
+		if is_job_stream_completed(event):
+			self.last_events.pop(job_id, None)
+			self.completed= self.single_job
+		else:
+			self.last_events[job_id]= event
+
+		return format_sse_event(event)
+
+
+class StreamSlots(object):
+	""" Count event streams served concurrently by this process, refusing new ones above a given max """
+
+	def __init__(self):
+		self.lock= threading.Lock()
+		self.nstreams= 0
+
+	def acquire(self, max_streams=0):
+		""" Take a stream slot. Return False if max number of streams (0=no limit) is reached. """
+
+		with self.lock:
+			if max_streams>0 and self.nstreams>=max_streams:
+				return False
+			self.nstreams+= 1
+			return True
+
+	def release(self):
+		""" Release a stream slot """
+
+		with self.lock:
+			self.nstreams= max(0, self.nstreams-1)
+
+
+##############################
+#   PUB/SUB
+##############################
+class JobEventSubscription(object):
+	""" A subscription to one or more job event topics """
+
+	def __init__(self, topics, maxsize=100):
+		self.topics= list(topics)
+		self.events= queue.Queue(maxsize=maxsize)
+
+	def put(self, event):
+		""" Add event to subscription queue, dropping the oldest one if full (slow consumer) """
+		try:
+			self.events.put_nowait(event)
+		except queue.Full:
+			try:
+				self.events.get_nowait()
+			except queue.Empty:
+				pass
+			try:
+				self.events.put_nowait(event)
+			except queue.Full:
+				pass
+
+	def get(self, timeout=None):
+		""" Return next event or None if no event arrives within timeout """
+		try:
+			return self.events.get(timeout=timeout)
+		except queue.Empty:
+			return None
+
+
+class JobEventBus(object):
+	""" In-process pub/sub of job state transitions """
+
+	def __init__(self):
+
+		self.lock= threading.Lock()
+		self.subscriptions= {} # topic -> list of subscriptions
+		self.listeners= [] # (callback, topics)
+		self.on_first_subscribe= None
+
+	def subscribe(self, topics, maxsize=100):
+		""" Subscribe to given topics, return a subscription to be released with unsubscribe() """
+
+		return self.add_subscription(JobEventSubscription(topics, maxsize))
+
+	def add_subscription(self, sub):
+		""" Register a subscription object (any object with topics attribute and put() method, e.g. an asyncio subscription) """
+
+		with self.lock:
+			for topic in sub.topics:
+				self.subscriptions.setdefault(topic, []).append(sub)
+
+		# - Start event source lazily (e.g. in forked server processes)
+		if self.on_first_subscribe is not None:
+			self.on_first_subscribe()
+
+		return sub
+
+	def unsubscribe(self, sub):
+		""" Release subscription """
+
+		with self.lock:
+			for topic in sub.topics:
+				subs= self.subscriptions.get(topic, [])
+				if sub in subs:
+					subs.remove(sub)
+				if not subs and topic in self.subscriptions:
+					del self.subscriptions[topic]
+
+	def add_listener(self, callback, topics=None):
+		""" Register a callback invoked (in the event source thread) for each event on given topics (all if None) """
+
+		with self.lock:
+			self.listeners.append((callback, topics))
+
+	def remove_listener(self, callback):
+		""" Unregister callback """
+
+		with self.lock:
+			self.listeners= [item for item in self.listeners if item[0]!=callback]
+
+	def get_nsubscribers(self, topic=None):
+		""" Return number of subscriptions (for given topic or in total) """
+
+		with self.lock:
+			if topic is not None:
+				return len(self.subscriptions.get(topic, []))
+			return sum(len(subs) for subs in self.subscriptions.values())
+
+	def publish(self, event):
+		""" Publish job event to job and user topics """
+
+		topics= [get_job_topic(event['job_id']), get_user_topic(event['username'])]
+
+		with self.lock:
+			subs= []
+			for topic in topics:
+				subs.extend(self.subscriptions.get(topic, []))
+			listeners= [item for item in self.listeners if item[1] is None or any(t in item[1] for t in topics)]
+
+		for sub in subs:
+			sub.put(event)
+
+		for callback, _ in listeners:
+			try:
+				callback(event)
+			except Exception as e:
+				logger.warn("Job event listener failed on event for job %s (err=%s)!" % (event['job_id'], str(e)))
+
+
+##############################
+#   EVENT SOURCE
+##############################
+class JobEventWatcher(object):
+	""" Watch user job collections and publish job state transitions to event bus (change streams or polling fallback) """
+
+	def __init__(self, event_bus):
+
+		self.event_bus= event_bus
+		self.db= None
+		self.poll_period= 2 # in seconds
+		self.use_change_streams= True
+		self.mode= ''
+		self.thread= None
+		self.lock= threading.Lock()
+		self.stop_event= threading.Event()
+		self.resume_token= None
+		self.last_events= {} # job_id -> last published event
+
+	def initialize(self, db, poll_period=2, use_change_streams=True):
+		""" Set DB and options. Watcher thread is started on first subscription or by calling start() """
+
+		self.db= db
+		self.poll_period= poll_period
+		self.use_change_streams= use_change_streams
+		self.event_bus.on_first_subscribe= self.start
+
+		return 0
+
+	def start(self):
+		""" Start watcher thread if not running """
+
+		if self.db is None:
+			return -1
+
+		with self.lock:
+			if self.thread is not None and self.thread.is_alive():
+				return 0
+			self.stop_event.clear()
+			self.thread= threading.Thread(target=self.run, name='JobEventWatcher')
+			self.thread.daemon= True
+			self.thread.start()
+
+		logger.info("Job event watcher started (pid=%d) ..." % os.getpid())
+		return 0
+
+	def stop(self):
+		""" Stop watcher thread """
+		self.stop_event.set()
+
+	def get_last_event(self, job_id):
+		""" Return last published event for given job (None if not seen yet) """
+		return self.last_events.get(job_id, None)
+
+	def publish(self, username, job_obj):
+		""" Publish event if job fields changed since last published event """
+
+		event= make_job_event(username, job_obj)
+		job_id= event['job_id']
+		last_event= self.last_events.get(job_id, None)
+		if last_event is not None and not has_job_event_changed(event, last_event):
+			return
+
+		if is_job_stream_completed(event):
+			self.last_events.pop(job_id, None)
+		else:
+			self.last_events[job_id]= event
+
+		self.event_bus.publish(event)
+
+	def run(self):
+		""" Thread main loop """
+
+		if self.use_change_streams:
+			self.mode= 'changestream'
+			try:
+				self.watch_change_stream()
+			except OperationFailure as e:
+				if e.code in CHANGE_STREAM_UNSUPPORTED_CODES or 'replica set' in str(e):
+					logger.info("Change streams not supported by DB server, switching to polling of active jobs (period=%s s) ..." % str(self.poll_period))
+				else:
+					logger.warn("Change stream failed (err=%s), switching to polling of active jobs ..." % str(e))
+			except Exception as e:
+				logger.warn("Change stream failed (err=%s), switching to polling of active jobs ..." % str(e))
+
+		if not self.stop_event.is_set():
+			self.mode= 'polling'
+			self.poll_active_jobs()
+
+	def watch_change_stream(self):
+		""" Watch job collections with a Mongo change stream (requires replica set) """
+
+		pipeline= [
+			{'$match': {
+				'ns.coll': {'$regex': r'\.jobs$'},
+				'operationType': {'$in': ['insert', 'update', 'replace']}
+			}}
+		]
+		nfailures= 0
+
+		while not self.stop_event.is_set():
+			try:
+				with self.db.watch(pipeline, full_document='updateLookup', resume_after=self.resume_token, max_await_time_ms=1000) as stream:
+					nfailures= 0
+					while not self.stop_event.is_set() and stream.alive:
+						change= stream.try_next()
+						if change is None:
+							continue
+						self.resume_token= change['_id']
+						self.process_change(change)
+
+			except OperationFailure:
+				if self.resume_token is None:
+					raise
+				# - Resume token may be expired, restart from now
+				logger.warn("Failed to resume job change stream, restarting from current time ...")
+				self.resume_token= None
+
+			except PyMongoError as e:
+				nfailures+= 1
+				delay= min(60, 2**nfailures)
+				logger.warn("Job change stream interrupted (err=%s), retrying in %d s ..." % (str(e), delay))
+				self.stop_event.wait(delay)
+
+	def process_change(self, change):
+		""" Publish event for a job collection change """
+
+		# - Skip updates not touching job state fields
+		if change['operationType']=='update':
+			updated_fields= change.get('updateDescription', {}).get('updatedFields', {})
+			if not any(field in updated_fields for field in JOB_EVENT_FIELDS):
+				return
+
+		job_obj= change.get('fullDocument', None)
+		if not job_obj or 'job_id' not in job_obj:
+			return
+
+		username= change['ns']['coll'].rsplit('.jobs', 1)[0]
+		self.publish(username, job_obj)
+
+	def poll_active_jobs(self):
+		""" Poll active jobs index and publish changes (stand-in for change streams on standalone DB servers) """
+
+		known_jobs= {} # job_id -> username
+		finished_jobs= {} # job_id -> (username, time of removal from index), polled until post-processing completes
+
+		while not self.stop_event.is_set():
+			try:
+				entries= active_jobs.get_active_jobs(self.db)
+
+				# - Publish new/changed active jobs
+				current_jobs= {}
+				for entry in entries:
+					current_jobs[entry['job_id']]= entry['username']
+					self.publish(entry['username'], entry)
+
+				# - Jobs removed from index reached a terminal state: poll them in user collections until post-processing is completed
+				now= time.time()
+				for job_id, username in known_jobs.items():
+					if job_id not in current_jobs:
+						finished_jobs[job_id]= (username, now)
+				known_jobs= current_jobs
+
+				self.poll_finished_jobs(finished_jobs, now)
+
+			except Exception as e:
+				logger.warn("Failed to poll active jobs (err=%s)!" % str(e), event_type="jobevents.poll")
+
+			self.stop_event.wait(self.poll_period)
+
+
+	def poll_finished_jobs(self, finished_jobs, now):
+		""" Publish state of given finished jobs (one query per user), removing from dict those with completed post-processing """
+
+		user_jobs= {}
+		for job_id, (username, removal_time) in finished_jobs.items():
+			user_jobs.setdefault(username, []).append(job_id)
+
+		for username, job_ids in user_jobs.items():
+			job_objs= self.db[username + '.jobs'].find({'job_id': {'$in': job_ids}}, projection={'_id': 0})
+			found_job_ids= set()
+			for job_obj in job_objs:
+				job_id= job_obj['job_id']
+				found_job_ids.add(job_id)
+				self.publish(username, job_obj)
+				if is_job_stream_completed(make_job_event(username, job_obj)) or now-finished_jobs[job_id][1]>POSTPROC_POLL_MAX_TIME:
+					del finished_jobs[job_id]
+					self.last_events.pop(job_id, None)
+
+			# - Forget deleted jobs
+			for job_id in job_ids:
+				if job_id not in found_job_ids:
+					del finished_jobs[job_id]
+					self.last_events.pop(job_id, None)
+
+
+##############################
+#   DEFAULT INSTANCES
+##############################
+job_event_bus= JobEventBus()
+wsgi_stream_slots= StreamSlots() # SSE streams served by Flask routes (each one holds a WSGI worker thread)
+job_event_watcher= JobEventWatcher(job_event_bus)
@@ -10,9 +10,14 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import subprocess
 import datetime
+import socket
+
+try:
+	from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+	ThreadPoolExecutor= None # python2 without futures backport: run serially
 
 try:
 	FileNotFoundError  # python3
@@ -36,11 +41,17 @@ from celery.exceptions import Ignore, SoftTimeLimitExceeded
 # Import Celery app
 from caesar_rest.app import celery as celery_app
 from caesar_rest import utils
+from caesar_rest import catalog_store
+from caesar_rest import active_jobs
+from caesar_rest import storage_usage
+from caesar_rest.bulk_writer import JobUpdateWriter
 from caesar_rest import jobmgr_kube
 from caesar_rest import jobmgr_slurm
 
 # Import mongo
+import pymongo
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 
 
 # Get logger
@@ -60,6 +71,8 @@ def jobmonitor_task(self):
 	DB_NAME= os.environ.get('CAESAR_REST_DBNAME')
 	DB_HOST= os.environ.get('CAESAR_REST_DBHOST')
 	DB_PORT= os.environ.get('CAESAR_REST_DBPORT')
+	CATALOG_DIR= os.environ.get('CAESAR_REST_CATALOGDIR', '')
+	JOB_UPDATE_BATCH_SIZE= os.environ.get('CAESAR_REST_JOB_UPDATE_BATCH_SIZE', '')
 	
 	if DB_NAME is None or DB_NAME=="":
 		logger.warn("Env var CAESAR_REST_DBNAME not defined, please set it to backend DB name...", action="jobmonitor")
@@ -89,298 +102,455 @@ def jobmonitor_task(self):
 		logger.error(errmsg, action="jobmonitor")
 		return
 
-	# - Get all job collections from DB
-	logger.info("Getting all job collection names from DB ...", action="jobmonitor")
-	collection_names= []
+	# - Set DB write batch size (monitor writer is flushed at the end of each cycle)
+	if JOB_UPDATE_BATCH_SIZE!="":
+		try:
+			job_monitor_writer.initialize(max_size=int(JOB_UPDATE_BATCH_SIZE), flush_period=0)
+		except ValueError:
+			logger.warn("Invalid env var CAESAR_REST_JOB_UPDATE_BATCH_SIZE (%s) given, using default batch size ..." % JOB_UPDATE_BATCH_SIZE, action="jobmonitor")
+
+	# - Monitor jobs (archives of completed jobs are created by tasks on the post-processing queue)
+	if monitor_jobs(client[DB_NAME], CATALOG_DIR, db_host=DB_HOST, db_port=DB_PORT)<0:
+		logger.warn("Failed to monitor jobs (see logs) ...", action="jobmonitor")
+
+
+@celery_app.task(bind=True, acks_late=True)
+def archive_task(self, job_obj, state, username, db_host='localhost', db_port='27017', db_name='caesardb', catalog_dir=''):
+	""" Create output archive of a completed job, ingest its catalog and update job post-processing state in DB """
+
+	job_id= job_obj['job_id']
+
+	# - Connect to mongoDB	
+	client= None
 	try:
-		collection_names= client[DB_NAME].list_collection_names(filter={"name":{"$regex": ".jobs"}})
+		client= MongoClient(db_host, int(db_port))
 	except Exception as e:
-		logger.warn("Failed to get job collection names from DB (err=%s)!" % str(e), action="jobmonitor")
-		return
+		logger.error("Exception caught when connecting to DB server (err=%s), cannot archive job %s output!" % (str(e), job_id), action="jobmonitor")
+		return -1
+
+	job_collection= client[db_name][username + '.jobs']
+	t0= time.time()
+
+	postproc_state= 'SUCCESS'
+	postproc_status= 'Job output archive created'
+	if archive_job(job_obj)<0:
+		postproc_state= 'FAILURE'
+		postproc_status= 'Failed to create job output archive'
+
+	job_dir= get_job_dir(job_obj)
+	if state=='SUCCESS':
+		ingest_job_catalog(job_obj, job_collection, job_dir, catalog_dir)
 
-	print("--> collection_names")
-	print(collection_names)
+	# - Account job output (including archive) in user storage usage counters
+	if job_dir!="" and os.path.isdir(job_dir):
+		storage_usage.add_storage_usage(client[db_name], username, jobsize=storage_usage.get_dir_size(job_dir))
 
-	# - Loop over collection names and get all PENDING/STARTED/RUNNING jobs	
-	for collection_name in collection_names:
+	elapsed= time.time()-t0
+	try:
+		job_collection.update_one(
+			{'job_id': job_id},
+			{'$set': {'postproc_state': postproc_state, 'postproc_status': postproc_status, 'postproc_elapsed_time': elapsed}},
+			upsert=False
+		)
+	except Exception as e:
+		logger.warn("Failed to update post-processing state of job %s in DB (err=%s)!" % (job_id, str(e)), action="jobmonitor", user=username)
+		return -1
 
-		job_list= []
-		job_collection= None
+	logger.info("Job %s output archived in %.2f s (state=%s) ..." % (job_id, elapsed, postproc_state), action="jobmonitor", user=username)
+
+	return 0
+
+
+def submit_archive_task(job_obj, state, job_collection, db_host='localhost', db_port='27017', catalog_dir=''):
+	""" Submit output archive creation of a completed job to post-processing queue. Return 0 on success, -1 otherwise. """
+
+	job_id= job_obj['job_id']
+	username= job_obj['username']
+	archive_job_obj= dict((field, job_obj[field]) for field in ['job_id', 'scheduler', 'job_top_dir'] if field in job_obj)
 
+	# - Submit task (routed to post-processing queue, see celery config)
+	try:
+		archive_task.apply_async(
+			[archive_job_obj, state, username, db_host, str(db_port), job_collection.database.name, catalog_dir]
+		)
+	except Exception as e:
+		errmsg= 'Exception caught when submitting archive task for job ' + job_id + ' (err=' + str(e) + ')!'
+		logger.error(errmsg, action="jobmonitor", user=username)
 		try:
-			job_collection= client[DB_NAME][collection_name]
-			job_cursor= job_collection.find({})
-			job_cursor= job_collection.find(
-				{"$or": [
-					{"state":"PENDING"},{"state":"STARTED"},{"state":"RUNNING"}
-				]
-				}
+			job_collection.update_one(
+				{'job_id': job_id},
+				{'$set': {'postproc_state': 'FAILURE', 'postproc_status': errmsg}},
+				upsert=False
 			)
+		except Exception as e:
+			logger.warn("Failed to update post-processing state of job %s in DB (err=%s)!" % (job_id, str(e)), action="jobmonitor", user=username)
+		return -1
 
-			if job_cursor is not None:
-				job_list = list(job_cursor)
+	return 0
 
-		except Exception as e:
-			errmsg= 'Failed to get jobs from DB for collection ' + collection_name + ' (err=' + str(e) + ')'
-			logger.error(errmsg, action="jobmonitor")
-			continue
 
-		if not job_list:
-			logger.info("No unfinished jobs to be monitored for collection %s ..." % collection_name, action="jobmonitor")
-			continue
-			
-		# - Process list and get job statuses from scheduler
-		for job_obj in job_list:
-			job_id= job_obj['job_id']
+####################################
+##   MONITOR OPTIONS
+####################################
+# - Number of threads used to query job status (per scheduler)
+MONITOR_NTHREADS= 8
 
-			# - Check job scheduler field
-			if 'scheduler' not in job_obj:
-				continue
-			job_scheduler= job_obj['scheduler']
+# - Collection holding the monitor lock (prevents overlapping monitoring cycles)
+MONITOR_LOCK_COLLECTION= 'jobmonitor_lock'
+MONITOR_LOCK_ID= 'jobmonitor'
+MONITOR_LOCK_TTL= 600 # in seconds, lock held longer than this is considered stale
 
-			# - Skip celery scheduler because these jobs are monitored by celery tasks
-			if job_scheduler=='celery':
-				continue
+# - Job fields updated from scheduler status
+KUBE_JOB_STATUS_FIELDS= ['state', 'status', 'elapsed_time']
+SLURM_JOB_STATUS_FIELDS= ['state', 'status', 'elapsed_time', 'exit_code']
 
-			# - Update Kubernetes job status
-			job_moni_status= -1
-			if job_scheduler=='kubernetes':
-				job_moni_status= monitor_kubernetes_job(job_obj, job_collection)
-			elif job_scheduler=='slurm':
-				job_moni_status= monitor_slurm_job(job_obj, job_collection)	
-			else:
-				logger.warn("Invalid/unknown job scheduler (%s), skip job moni..." % job_scheduler, action="jobmonitor")
-				continue
 
-			if job_moni_status<0:
-				logger.warn("Failed to monitor %s job %s, skip to next..." % (job_scheduler, job_id), action="jobmonitor")
-				continue
+####################################
+##   MONITOR LOCK
+####################################
+def acquire_monitor_lock(db, owner, ttl=MONITOR_LOCK_TTL):
+	""" Acquire job monitor lock. Return True if acquired, False if held by another monitoring cycle. """
+
+	now= datetime.datetime.utcnow()
+	try:
+		db[MONITOR_LOCK_COLLECTION].find_one_and_update(
+			{'_id': MONITOR_LOCK_ID, 'expire_date': {'$lt': now}},
+			{'$set': {'owner': owner, 'acquire_date': now, 'expire_date': now + datetime.timedelta(seconds=ttl)}},
+			upsert=True
+		)
+	except DuplicateKeyError:
+		return False
+
+	return True
+
+
+def release_monitor_lock(db, owner):
+	""" Release job monitor lock if held by given owner """
+
+	try:
+		db[MONITOR_LOCK_COLLECTION].delete_one({'_id': MONITOR_LOCK_ID, 'owner': owner})
+	except Exception as e:
+		logger.warn("Failed to release job monitor lock (err=%s)!" % str(e), action="jobmonitor")
+
+
+####################################
+##   JOB ARCHIVE
+####################################
+def get_job_dir(job_obj):
+	""" Return job output directory (empty if job top dir is not known) """
+
+	if 'job_top_dir' not in job_obj:
+		return ''
+	return os.path.join(job_obj['job_top_dir'], 'job_' + job_obj['job_id'])
+
+
+def archive_job(job_obj):
+	""" Create a tar file with job output. Return 0 on success (or if tar already exists), -1 otherwise """
+
+	job_id= job_obj['job_id']
+	job_dir= get_job_dir(job_obj)
+	if job_dir=="" or not os.path.isdir(job_dir):
+		logger.warn("Won't create output data tar file for job %s as job output directory %s not found ..." % (job_id, job_dir), action="jobmonitor")
+		return -1
+
+	tar_file= os.path.join(job_dir, 'job_' + job_id + '.tar.gz')
+	if os.path.isfile(tar_file):
+		logger.info("Job %s output tar file %s already existing, won't create it again ..." % (job_id, tar_file), action="jobmonitor")
+		return 0
+
+	# - Write to a temporary file moved in place when complete (an existing tar is always complete, e.g. when archive is re-queued)
+	logger.info("Creating a tar file %s with job output data ..." % tar_file, action="jobmonitor")
+	tar_file_tmp= os.path.join(os.path.dirname(job_dir), '.job_' + job_id + '.tar.gz.tmp' + str(os.getpid()))
+	try:
+		utils.make_tar(tar_file_tmp, job_dir)
+		os.rename(tar_file_tmp, tar_file)
+	except Exception as e:
+		logger.warn("Failed to create tar file %s (err=%s)!" % (tar_file, str(e)), action="jobmonitor")
+		if os.path.isfile(tar_file_tmp):
+			os.remove(tar_file_tmp)
+		return -1
+
+	return 0
+
 
 ####################################
 ##   MONITOR JOBS
 ####################################
-def monitor_jobs(db):
-	""" Monitor jobs stored in DB """
+def monitor_jobs(db, catalog_dir='', nthreads=MONITOR_NTHREADS, db_host='localhost', db_port='27017'):
+	""" Monitor jobs stored in DB (DB host and port are passed to archive tasks of completed jobs) """
 
 	# - Check DB instance
 	if db is None:
 		logger.error("None DB instance given!", action="jobmonitor")
 		return -1
 
-	# - Get all job collections from DB
-	logger.info("Getting all job collection names from DB ...", action="jobmonitor")
-	collection_names= []
+	# - Initialize active jobs index (built from user job collections the first time)
+	if active_jobs.init_active_jobs(db)<0:
+		logger.warn("Failed to initialize active jobs index!", action="jobmonitor")
+		return -1
+
+	# - Skip this cycle if previous one is still running (e.g. beats overlapping)
+	lock_owner= '%s:%d:%s' % (socket.gethostname(), os.getpid(), utils.get_uuid())
 	try:
-		collection_names= db.list_collection_names(filter={"name":{"$regex": ".jobs"}})
+		if not acquire_monitor_lock(db, lock_owner):
+			logger.info("Previous job monitoring cycle still running, skip this one ...", action="jobmonitor", event_type="jobmonitor.skip")
+			return 0
 	except Exception as e:
-		logger.warn("Failed to get job collection names from DB (err=%s)!" % str(e), action="jobmonitor")
+		logger.warn("Failed to acquire job monitor lock (err=%s)!" % str(e), action="jobmonitor")
 		return -1
 
-	print("--> collection_names")
-	print(collection_names)
+	try:
+		status= monitor_active_jobs(db, catalog_dir, nthreads, db_host, db_port)
+	finally:
+		release_monitor_lock(db, lock_owner)
 
-	# - Loop over collection names and get all PENDING/STARTED/RUNNING jobs	
-	for collection_name in collection_names:
+	return status
 
-		job_list= []
-		job_collection= None
 
-		try:
-			job_collection= db[collection_name]
-			job_cursor= job_collection.find({})
-			job_cursor= job_collection.find(
-				{"$or": [
-					{"state":"PENDING"},{"state":"STARTED"},{"state":"RUNNING"}
-				]
-				}
-			)
+def monitor_active_jobs(db, catalog_dir='', nthreads=MONITOR_NTHREADS, db_host='localhost', db_port='27017'):
+	""" Collect status of all active jobs and update those changed in DB """
 
-			if job_cursor is not None:
-				job_list = list(job_cursor)
+	t0= time.time()
 
-		except Exception as e:
-			errmsg= 'Failed to get jobs from DB for collection ' + collection_name + ' (err=' + str(e) + ')'
-			logger.error(errmsg, action="jobmonitor")
-			continue
+	# - Get all PENDING/STARTED/RUNNING jobs of all users with a single query
+	#   NB: Celery jobs are skipped as they are monitored by celery tasks
+	logger.debug("Getting all active jobs from DB ...", action="jobmonitor")
+	job_list= []
+	try:
+		job_list= active_jobs.get_active_jobs(db, schedulers=['kubernetes','slurm'])
+	except Exception as e:
+		logger.warn("Failed to get active jobs from DB (err=%s)!" % str(e), action="jobmonitor", event_type="jobmonitor.failure")
+		return -1
 
-		if not job_list:
-			logger.info("No unfinished jobs to be check for collection %s ..." % collection_name, action="jobmonitor")
-			continue
-			
-		# - Process list and get job statuses from scheduler
-		kube_jobs= []
-		slurm_jobs= []
-		
-		for job_obj in job_list:
+	if not job_list:
+		logger.info("No unfinished jobs to be checked ...", action="jobmonitor", event_type="jobmonitor.idle")
+		return 0
 
-			# - Check job obj
-			if not job_obj or job_obj is None:
-				logger.warn("Skip current job obj as None or empty ...", action="jobmonitor")	
+	# - Group jobs by scheduler and user
+	kube_jobs= []
+	slurm_jobs= {}
+	
+	for job_obj in job_list:
+		username= job_obj['username']
+		job_scheduler= job_obj['scheduler']
+		if job_scheduler=='kubernetes':
+			kube_jobs.append(job_obj)
+		elif job_scheduler=='slurm':
+			slurm_jobs.setdefault(username, []).append(job_obj)
+
+	logger.info("#%d active jobs to be monitored (kube=%d jobs, slurm=%d users) ..." % (len(job_list), len(kube_jobs), len(slurm_jobs)), action="jobmonitor", event_type="jobmonitor.cycle")
+
+	# - Collect job status concurrently (bounded pool for Kube jobs, one incremental query for Slurm jobs)
+	resdict= {} # job_id -> status dict
+	if kube_jobs:
+		resdict.update(get_kubernetes_job_statuses(kube_jobs, nthreads))
+	if slurm_jobs:
+		resdict.update(get_slurm_job_statuses(slurm_jobs))
+
+	# - Compute job updates and group them by user
+	updates= {} # username -> list of (job_id, fields)
+	for job_obj in job_list:
+		job_id= job_obj['job_id']
+		if job_id not in resdict:
+			continue
+		fields= make_job_update(job_obj, resdict[job_id])
+		if fields:
+			updates.setdefault(job_obj['username'], []).append((job_obj, fields))
+
+	# - Update DB (one unordered bulk write per user collection) and submit completed job archives
+	#   NB: Archive tasks are submitted after the terminal state is written, so that it never overwrites the post-processing state set by the task
+	failed_job_ids= []
+	for username, job_updates in updates.items():
+		job_collection= db[username + '.jobs']
+		for job_obj, fields in job_updates:
+			failed_job_ids.extend(job_monitor_writer.add(job_collection, job_obj['job_id'], fields))
+	failed_job_ids.extend(job_monitor_writer.flush())
+	if failed_job_ids:
+		logger.warn("Failed to update %d jobs in DB, will retry at next cycle ..." % len(failed_job_ids), action="jobmonitor")
+
+	nupdates= 0
+	narchives= 0
+	for username, job_updates in updates.items():
+		job_collection= db[username + '.jobs']
+		for job_obj, fields in job_updates:
+			if job_obj['job_id'] in failed_job_ids:
 				continue
+			nupdates+= 1
+			if 'postproc_state' in fields:
+				finalize_job(job_obj, resdict[job_obj['job_id']], job_collection, catalog_dir, db_host, db_port)
+				narchives+= 1
 
-			job_id= job_obj['job_id']
+	write_metrics= job_monitor_writer.get_metrics()
+	logger.info("#%d/%d active jobs updated in %.2f s (DB write latency=%.1f ms, #%d archive tasks submitted) ..." % (nupdates, len(job_list), time.time()-t0, write_metrics['latency_last'], narchives), action="jobmonitor", event_type="jobmonitor.summary")
 
-			# - Check job scheduler field
-			if 'scheduler' not in job_obj:
-				continue
-			job_scheduler= job_obj['scheduler']
+	return 0
+	
 
-			# - Skip celery scheduler because these jobs are monitored by celery tasks
-			if job_scheduler=='celery':
-				continue
+def is_job_status_changed(job_obj, res, fields):
+	""" Check if job status returned by scheduler differs from status stored in DB """
 
-			# - Fill kube jobs to be monitored
-			if job_scheduler=='kubernetes':
-				kube_jobs.append(job_obj)
-			elif job_scheduler=='slurm':
-				slurm_jobs.append(job_obj)
-			else:
-				logger.warn("Invalid/unknown job scheduler (%s), skip job moni..." % job_scheduler, action="jobmonitor")
-				continue
-	
-			# - Update Kubernetes job status
-			#job_moni_status= -1
-			#if job_scheduler=='kubernetes':
-			#	job_moni_status= monitor_kubernetes_job(job_obj, job_collection)
-			#elif job_scheduler=='slurm':
-			#	job_moni_status= monitor_slurm_job(job_obj, job_collection)	
-			#else:
-			#	logger.warn("Invalid/unknown job scheduler (%s), skip job moni..." % job_scheduler, action="jobmonitor")
-			#	continue
-
-			#if job_moni_status<0:
-			#	logger.warn("Failed to monitor %s job %s, skip to next..." % (job_scheduler, job_id), action="jobmonitor")
-			#	continue
-	
-		# - Update Kubernetes job status	
-		for job_obj in kube_jobs:
-			job_id= job_obj['job_id']
-			if monitor_kubernetes_job(job_obj, job_collection)<0:
-				logger.warn("Failed to monitor Kube job %s, skip to next..." % (job_id), action="jobmonitor")
-				continue
+	for field in fields:
+		if field in res and job_obj.get(field, None)!=res[field]:
+			return True
+	return False
 
-		# - Update slurm jobs status
-		if slurm_jobs:
-			if monitor_slurm_jobs(slurm_jobs, job_collection)<0:
-				logger.warn("Failed to monitor Slurm jobs ...", action="jobmonitor")
-				
 
+def make_job_update(job_obj, res):
+	""" Return job fields to be updated in DB given the scheduler status (empty if status did not change) """
 
-	return 0
-	
+	if not res:
+		return {}
 
-####################################
-##   MONITOR KUBERNETES JOB
-####################################
-def monitor_kubernetes_job(job_obj, job_collection):
-	""" Monitor and update job status in DB """
+	fields= KUBE_JOB_STATUS_FIELDS
+	if job_obj['scheduler']=='slurm':
+		fields= SLURM_JOB_STATUS_FIELDS
+
+	if not is_job_status_changed(job_obj, res, fields):
+		return {}
+
+	update= dict((field, res[field]) for field in fields if field in res)
+	logger.info("Updating job %s state to %s (status=%s) ..." % (job_obj['job_id'], update['state'], update['status']), action="jobmonitor")
+
+	# - Mark output archive as pending for completed jobs (output endpoints wait for it)
+	if not active_jobs.is_active_state(update['state']):
+		update['postproc_state']= 'PENDING'
+		update['postproc_status']= 'Job output archive queued'
+
+	return update
+
+
+def finalize_job(job_obj, res, job_collection, catalog_dir='', db_host='localhost', db_port='27017'):
+	""" Submit output archive task of completed job and clear Kube job resources """
 
-	# - Extract field
-	if not job_obj or job_obj is None:
-		logger.warn("Given job obj is None or empty!", action="jobmonitor")	
-		return -1		
 	job_id= job_obj['job_id']
-	job_dir_name= 'job_' + job_id
-	tar_filename= 'job_' + job_id + '.tar.gz'
-	job_top_dir= ''
-	job_dir= ''
-	tar_file= ''
-	job_dir_existing= False
-	tar_file_existing= False
-	if 'job_top_dir' in job_obj:
-		job_top_dir= job_obj['job_top_dir']
-		job_dir= os.path.join(job_top_dir,job_dir_name)
-		tar_file= os.path.join(job_dir,tar_filename)
-		job_dir_existing= os.path.isdir(job_dir)
-		tar_file_existing= os.path.isfile(tar_file)
-
-	# - Check job collection
-	if job_collection is None:
-		logger.warn("Given mongo job collection is None!", action="jobmonitor")
+	state= res['state']
+
+	# - Record time saved before run by Slurm jobs (read before archiving, as wait time file is removed)
+	if job_obj['scheduler']=='slurm' and jobmgr_slurm is not None:
+		record_slurm_time_saved(job_obj)
+
+	submit_archive_task(job_obj, state, job_collection, db_host, db_port, catalog_dir)
+
+	# - If SUCCESS or FAILURE clear the Kube job (unless already deleted)
+	#   NB: ttl option not working when job is SUCCESS.
+	if job_obj['scheduler']=='kubernetes' and jobmgr_kube is not None:
+		jobmgr_kube.clear_cached_job_status(job_id)
+		if (state=='SUCCESS' or state=='FAILURE') and not res.get('deleted', False):
+			logger.info("Clearing job %s (state=%s) ..." % (job_id, state), action="jobmonitor")
+			try:
+				jobmgr_kube.delete_job(job_id, wait=False)
+			except Exception as e:
+				logger.warn("Failed to delete job %s (err=%s)" % (job_id, str(e)), action="jobmonitor")
+				return -1
+
+	return 0
+
+
+def record_slurm_time_saved(job_obj):
+	""" Record time saved wrt former fixed sleep before run for a completed Slurm job, given the time its script waited for the job directory """
+
+	job_dir= get_job_dir(job_obj)
+	if job_dir=="":
 		return -1
 
+	wait_time= jobmgr_slurm.read_jobdir_wait_time(job_dir)
+	if wait_time is None:
+		logger.debug("No job directory wait time found for Slurm job %s (job not run or wait disabled) ..." % job_obj['job_id'], action="jobmonitor")
+		return -1
+
+	sync_time= job_obj.get('jobdir_sync_time', 0.)
+	time_saved= jobmgr_slurm.record_time_saved(wait_time, sync_time)
+	logger.info("Slurm job %s waited %.3f s for job directory (dir sync time=%.3f s, time saved before run=%.1f s) ..." % (job_obj['job_id'], wait_time, sync_time, time_saved), action="jobmonitor")
+
+	return 0
+
+
+def map_concurrent(func, items, nthreads=MONITOR_NTHREADS):
+	""" Apply function to items using a bounded thread pool (serially if not available) and return results in order """
+
+	if ThreadPoolExecutor is None or nthreads<=1 or len(items)<=1:
+		return [func(item) for item in items]
+
+	with ThreadPoolExecutor(max_workers=min(nthreads, len(items))) as executor:
+		return list(executor.map(func, items))
+
+
+####################################
+##   MONITOR KUBERNETES JOBS
+####################################
+def get_kubernetes_job_statuses(job_objs, nthreads=MONITOR_NTHREADS):
+	""" Return status of given Kubernetes jobs as a dict indexed by job id, using job watch cache if available """
+
 	# - Check kube client instance
 	if jobmgr_kube is None:
 		logger.warn("Kube client is None!", action="jobmonitor")
-		return -1
+		return {}
+
+	# - Get job status from watch cache
+	#   NB: Jobs not found in cache (e.g. created without service label) are queried directly
+	resdict= {}
+	job_ids= []
+	use_cache= jobmgr_kube.is_job_watch_synced()
+	for job_obj in job_objs:
+		job_id= job_obj['job_id']
+		res= None
+		if use_cache:
+			res= jobmgr_kube.get_cached_job_status(job_id)
+		if res is None:
+			job_ids.append(job_id)
+			continue
+
+		# - Set jobs deleted from cluster before completion to CLEARED
+		if res.get('deleted', False) and active_jobs.is_active_state(res['state']):
+			res['state']= 'CLEARED'
+			res['status']= 'Job was deleted from cluster before completion'
+
+		resdict[job_id]= res
+
+	if use_cache:
+		logger.info("#%d/%d Kube job status taken from job watch cache ..." % (len(resdict), len(job_objs)), action="jobmonitor", event_type="jobmonitor.kube_cache")
+
+	# - Query remaining jobs concurrently
+	if job_ids:
+		logger.info("#%d Kube jobs to be queried for status ..." % len(job_ids), action="jobmonitor", event_type="jobmonitor.kube_query")
+		for job_id, res in zip(job_ids, map_concurrent(get_kubernetes_job_status, job_ids, nthreads)):
+			if res:
+				resdict[job_id]= res
+
+	return resdict
+
+
+def get_kubernetes_job_status(job_id):
+	""" Query Kubernetes job status. Return None on failure. """
 
-	# - Get Kube job status
 	try:
 		res= jobmgr_kube.get_job_status(job_id)
 	except Exception as e:
 		logger.warn("Failed to retrieve job %s status (err=%s)" % (job_id, str(e)), action="jobmonitor")
-		return -1
+		return None
 
-	# - Check result
 	if not res:
-		logger.warn("Empty dict returned from kube client get_job_status(), cannot update job!", action="jobmonitor")
-		return -1
-		
-	state= res['state']
-	status= res['status']
-	elapsed_time= res['elapsed_time']
-
-	# - Create tar file with job output if job completed
-	if state=='SUCCESS' or state=='FAILURE' or state=='CLEARED':
-		if job_dir_existing and tar_file!="":
-			if tar_file_existing:
-				logger.info("Job %s output tar file %s already existing, won't create it again ..." % (job_id, tar_file), action="jobmonitor")
-			else:
-				logger.info("Creating a tar file %s with job output data ..." % tar_file, action="jobmonitor")
-				utils.make_tar(tar_file, job_dir)
-		else:
-			logger.warn("Won't create output data tar file %s as job output directory %s not found ..." % (tar_file, job_dir), action="jobmonitor")
-
-			
-	# - Update job status
-	try:
-		logger.info("Updating job %s state to %s (status=%s) ..." % (job_id, state, status), action="jobmonitor")
-		job_collection.update_one({'job_id':job_id},{'$set':{'state':state,'status':status,'elapsed_time':elapsed_time}},upsert=False)
-	except Exception as e:
-		errmsg= 'Exception caught when updating job ' + str(job_id) + ' in DB (err=' + str(e) + ')!'
-		logger.warn(errmsg, action="jobmonitor")
-		return -1
-
-	# - If SUCCESS or FAILURE clear the pod
-	#   NB: ttl option not working when job is SUCCESS.
-	if state=='SUCCESS' or state=='FAILURE':
+		logger.warn("Empty dict returned from kube client get_job_status(), cannot update job %s!" % job_id, action="jobmonitor")
+		return None
 
-		# - Clearing job state
-		logger.info("Clearing job %s (state=%s) ..." % (job_id, state), action="jobmonitor")
-		try:
-			res= jobmgr_kube.delete_job(job_id)
-		except Exception as e:
-			logger.warn("Failed to delete job %s (err=%s)" % (job_id, str(e)), action="jobmonitor")
-			return -1
-	
-	return 0
+	return res
 
 
 ####################################
-##   MONITOR SLURM JOB
+##   MONITOR SLURM JOBS
 ####################################
-def monitor_slurm_jobs(job_objs, job_collection):
-	""" Monitor and update job status in DB """
+def get_slurm_job_statuses(user_job_objs):
+	""" Return status of given Slurm jobs (a dict of job lists indexed by user) as a dict indexed by job id (jobs purged from Slurm are resolved from accounting, or set to CLEARED if previously RUNNING and not found) """
 
 	# - Check Slurm client instance
 	if jobmgr_slurm is None:
 		logger.warn("Slurm client is None!", action="jobmonitor")
-		return -1
+		return {}
 
-	# - Check job collection
-	if job_collection is None:
-		logger.warn("Given mongo job collection is None!", action="jobmonitor")
-		return -1
-
-	# - Check job objs
-	if not job_objs or job_objs is None:
-		logger.warn("Given job objs is None or empty!", action="jobmonitor")	
-		return -1
-
-	# - Find list of job pids to be monitored
+	# - Find list of job pids to be monitored (all users)
+	job_objs= [job_obj for job_list in user_job_objs.values() for job_obj in job_list]
 	job_pids= []
 	for job_obj in job_objs:
-		job_id= job_obj['job_id']
 		job_pid= str(job_obj['pid'])
 		if job_pid=="":
 			logger.warn("Current Slurm job pid is empty, skip to next ...", action="jobmonitor")	
@@ -388,206 +558,104 @@ def monitor_slurm_jobs(job_objs, job_collection):
 
 		job_pids.append(job_pid)
 
-	# - Query Slurm job status
-	logger.info("#%d/%d Slurm jobs to be queried for status ..." % (len(job_pids), len(job_objs)), action="jobmonitor")
+	# - Query Slurm job status with a single client call
+	#   NB: Client asks only for jobs changed since last poll, splitting pid queries in bounded chunks
+	logger.info("#%d/%d Slurm jobs to be queried for status ..." % (len(job_pids), len(job_objs)), action="jobmonitor", event_type="jobmonitor.slurm_query")
 	
 	try:
-		resdict= jobmgr_slurm.get_job_statuses(job_pids)
+		pid_resdict= jobmgr_slurm.get_job_statuses(job_pids)
 	except Exception as e:
 		logger.warn("Failed to retrieve Slurm job statuses (err=%s)" % (str(e)), action="jobmonitor")
-		return -1
-
-	if resdict is None:
-		logger.warn("None reply returned from Slurm client get_job_statuses(), cannot update job!", action="jobmonitor")
-		return -1
+		return {}
+
+	if pid_resdict is None:
+		logger.warn("None reply returned from Slurm client get_job_statuses(), cannot update jobs!", action="jobmonitor")
+		return {}
+
+	# - Log connection pool stats
+	pool_stats= jobmgr_slurm.get_pool_stats()
+	nconnections= sum(pool['nconnections'] for pool in pool_stats['pools'])
+	logger.info("Slurm rest client stats: #%d requests (#%d failed) over #%d connections, #%d token renewals ..." % (pool_stats['nrequests'], pool_stats['nrequest_errors'], nconnections, pool_stats['ntoken_renewals']), action="jobmonitor", event_type="jobmonitor.slurm_client_stats")
+	submit_stats= jobmgr_slurm.get_submit_stats()
+	logger.info("Slurm job submit stats: #%d completed jobs, time saved before run=%.1f s (mean=%.2f s/job) ..." % (submit_stats['njobs_submitted'], submit_stats['time_saved_before_run'], submit_stats['time_saved_before_run_mean']), action="jobmonitor", event_type="jobmonitor.slurm_submit_stats")
+
+	# - Retrieve final status of jobs already purged from Slurm controller from accounting (batched & cached in client)
+	missing_pids= [job_pid for job_pid in job_pids if job_pid not in pid_resdict]
+	accounting_resdict= {}
+	if missing_pids:
+		try:
+			accounting_resdict= jobmgr_slurm.get_accounting_job_statuses(missing_pids)
+		except Exception as e:
+			logger.warn("Failed to retrieve Slurm job statuses from accounting (err=%s)" % (str(e)), action="jobmonitor")
+			accounting_resdict= None
+
+		if accounting_resdict is None:
+			logger.warn("Slurm accounting query failed, leaving #%d jobs not found in Slurm unchanged until next cycle ..." % len(missing_pids), action="jobmonitor")
+			missing_pids_set= set(missing_pids)
+			job_objs= [job_obj for job_obj in job_objs if str(job_obj['pid']) not in missing_pids_set]
+			accounting_resdict= {}
+		else:
+			logger.info("#%d/%d jobs not found in Slurm controller resolved from accounting ..." % (len(accounting_resdict), len(missing_pids)), action="jobmonitor")
 
-	if not resdict:
-		logger.warn("Empty reply returned from Slurm client get_job_statuses(), will set previously RUNNING jobs to CLEARED state ...", action="jobmonitor")
-		for job_obj in job_objs:
-			job_id= job_obj['job_id']
-			job_pid= str(job_obj['pid'])
-			job_state= job_obj['state']
-			elapsed= job_obj['elapsed_time']
-
-			if job_state=='RUNNING':
-				resdict[job_pid]= {
-					'state': 'CLEARED',
-					'status': 'Job was presumably cleared and finished with unknown state',
-					'elapsed_time': elapsed,
-					'exit_code': -1
-				}
-				
-
-	print("resdict")
-	print(resdict)
-
-	# - Loop over jobs and update their status
+	# - Map status data to jobs
+	resdict= {}
 	for job_obj in job_objs:
 		job_id= job_obj['job_id']
 		job_pid= str(job_obj['pid'])
-		job_state= job_obj['state']
-		elapsed= job_obj['elapsed_time']
 
 		# - Search status data with this pid
-		if job_pid not in resdict:
-			#logger.warn("Cannot find Slurm job pid %s in dictionary of job status data, skip to next job ..." % job_pid, action="jobmonitor")
-			#continue
-			logger.warn("Cannot find Slurm job pid %s in dictionary of job status data, probably it was cleared, will set to CLEARED if it was previously RUNNING ..." % job_pid, action="jobmonitor")
-			res= {}
-			if job_state=='RUNNING':
-				res= {
-					'state': 'CLEARED',
-					'status': 'Job was presumably cleared and finished with unknown state',
-					'elapsed_time': elapsed,
-					'exit_code': -1
-				}
-		else:	
-			res= resdict[job_pid]
-
-		if not res or res is None:
-			logger.warn("Empty or None job status dict for job pid %s, cannot update job, skip to next job ..." % job_pid, action="jobmonitor")
+		if job_pid in pid_resdict:
+			resdict[job_id]= pid_resdict[job_pid]
 			continue
 
-		# - Update status in DB and perform actions on completed jobs
-		if update_slurm_job(job_obj, res, job_collection)<0:
-			logger.warn("Failed to update Slurm job (id=%s, pid=%s), skip to next..." % (job_id, job_pid), action="jobmonitor")
+		if job_pid in accounting_resdict:
+			resdict[job_id]= accounting_resdict[job_pid]
 			continue
 
+		if jobmgr_slurm.is_accounting_lookup_pending(job_pid):
+			logger.info("Slurm job pid %s not yet found in accounting, will retry at next cycle ..." % job_pid, action="jobmonitor", event_type="jobmonitor.job")
+			continue
 
-	return 0
-	
-
-def monitor_slurm_job(job_obj, job_collection):
-	""" Monitor and update job status in DB """
-	
-	# - Extract field
-	if not job_obj or job_obj is None:
-		logger.warn("Given job obj is None or empty!", action="jobmonitor")	
-		return -1		
-	job_id= job_obj['job_id']
-	job_pid= str(job_obj['pid'])
-
-	if job_pid=="":
-		logger.warn("Given job pid is empty, cannot retrieve job status from Slurm cluster!", action="jobmonitor")	
-		return -1
+		logger.warn("Cannot find Slurm job pid %s in Slurm controller or accounting, probably it was cleared, will set to CLEARED if it was previously RUNNING ..." % job_pid, action="jobmonitor")
+		if job_obj['state']=='RUNNING':
+			resdict[job_id]= {
+				'state': 'CLEARED',
+				'status': 'Job was presumably cleared and finished with unknown state',
+				'elapsed_time': job_obj.get('elapsed_time', ''),
+				'exit_code': -1
+			}
 
-	job_dir_name= 'job_' + job_id
-	tar_filename= 'job_' + job_id + '.tar.gz'
-	job_top_dir= ''
-	job_dir= ''
-	tar_file= ''
-	job_dir_existing= False
-	tar_file_existing= False
-	if 'job_top_dir' in job_obj:
-		job_top_dir= job_obj['job_top_dir']
-		job_dir= os.path.join(job_top_dir,job_dir_name)
-		tar_file= os.path.join(job_dir,tar_filename)
-		job_dir_existing= os.path.isdir(job_dir)
-		tar_file_existing= os.path.isfile(tar_file)
-
-	# - Check job collection
-	if job_collection is None:
-		logger.warn("Given mongo job collection is None!", action="jobmonitor")
-		return -1
+	return resdict
 
-	# - Check Slurm client instance
-	if jobmgr_slurm is None:
-		logger.warn("Slurm client is None!", action="jobmonitor")
-		return -1
 
-	# - Get Slurm job status
-	try:
-		res= jobmgr_slurm.get_job_status(job_pid)
-	except Exception as e:
-		logger.warn("Failed to retrieve job %s (pid=%s) status (err=%s)" % (job_id, job_pid, str(e)), action="jobmonitor")
-		return -1
+####################################
+##   INGEST JOB CATALOG
+####################################
+def ingest_job_catalog(job_obj, job_collection, job_dir, catalog_dir=''):
+	""" Ingest completed job source catalog in columnar catalog store """
 
-	# - Check result
-	if not res:
-		logger.warn("Empty dict returned from Slurm client get_job_status(), cannot update job!", action="jobmonitor")
-		return -1
-		
-	state= res['state']
-	status= res['status']
-	elapsed_time= res['elapsed_time']
-	exit_code= res['exit_code']
-
-	# - Create tar file with job output if job completed
-	if state=='SUCCESS' or state=='FAILURE' or state=='CLEARED':
-		if job_dir_existing and tar_file!="":
-			if tar_file_existing:
-				logger.info("Job %s output tar file %s already existing, won't create it again ..." % (job_id, tar_file), action="jobmonitor")
-			else:
-				logger.info("Creating a tar file %s with job output data ..." % tar_file, action="jobmonitor")
-				utils.make_tar(tar_file, job_dir)
-		else:
-			logger.warn("Won't create output data tar file %s as job output directory %s not found ..." % (tar_file, job_dir), action="jobmonitor")
+	# - Check if ingestion is enabled
+	if catalog_dir is None or catalog_dir=="":
+		return 0
 
-			
-	# - Update job status
-	try:
-		logger.info("Updating job %s state to %s (status=%s) ..." % (job_id, state, status), action="jobmonitor")
-		job_collection.update_one({'job_id':job_id},{'$set':{'state':state,'status':status,'exit_code':exit_code,'elapsed_time':elapsed_time}},upsert=False)
-	except Exception as e:
-		errmsg= 'Exception caught when updating job ' + str(job_id) + ' in DB (err=' + str(e) + ')!'
-		logger.warn(errmsg, action="jobmonitor")
+	if job_dir=="" or not os.path.isdir(job_dir):
+		logger.warn("Job output directory %s not found, cannot ingest catalog ..." % job_dir, action="jobmonitor")
 		return -1
 
-	return 0
-
-
-
-def update_slurm_job(job_obj, res, job_collection):
-	""" Update slurm job status """
-
-	# - Check result
-	if not res or res is None:
-		logger.warn("Empty or None job status dict given, cannot update job!", action="jobmonitor")
-		return -1
-	
-	# - Get fields
+	# - Get username from job collection name (<username>.jobs)
 	job_id= job_obj['job_id']
-	job_pid= str(job_obj['pid'])
-
-	job_dir_name= 'job_' + job_id
-	tar_filename= 'job_' + job_id + '.tar.gz'
-	job_top_dir= ''
-	job_dir= ''
-	tar_file= ''
-	job_dir_existing= False
-	tar_file_existing= False
-	if 'job_top_dir' in job_obj:
-		job_top_dir= job_obj['job_top_dir']
-		job_dir= os.path.join(job_top_dir,job_dir_name)
-		tar_file= os.path.join(job_dir,tar_filename)
-		job_dir_existing= os.path.isdir(job_dir)
-		tar_file_existing= os.path.isfile(tar_file)
-
-	state= res['state']
-	status= res['status']
-	elapsed_time= res['elapsed_time']
-	exit_code= res['exit_code']
-
-	# - Create tar file with job output if job completed
-	if state=='SUCCESS' or state=='FAILURE':
-		if job_dir_existing and tar_file!="":
-			if tar_file_existing:
-				logger.info("Job %s output tar file %s already existing, won't create it again ..." % (job_id, tar_file), action="jobmonitor")
-			else:
-				logger.info("Creating a tar file %s with job output data ..." % tar_file, action="jobmonitor")
-				utils.make_tar(tar_file, job_dir)
-		else:
-			logger.warn("Won't create output data tar file %s as job output directory %s not found ..." % (tar_file, job_dir), action="jobmonitor")
+	username= job_collection.name.rsplit('.jobs', 1)[0]
 
-	# - Update job status
-	try:
-		logger.info("Updating job %s state to %s (status=%s) ..." % (job_id, state, status), action="jobmonitor")
-		job_collection.update_one({'job_id':job_id},{'$set':{'state':state,'status':status,'exit_code':exit_code,'elapsed_time':elapsed_time}},upsert=False)
-	except Exception as e:
-		errmsg= 'Exception caught when updating job ' + str(job_id) + ' in DB (err=' + str(e) + ')!'
-		logger.warn(errmsg, action="jobmonitor")
+	# - Ingest catalog
+	logger.info("Ingesting source catalog of job %s ..." % job_id, action="jobmonitor", user=username)
+	if catalog_store.ingest_job_catalog(job_collection.database, username, job_id, job_dir, catalog_dir)<0:
+		logger.warn("Failed to ingest source catalog of job %s!" % job_id, action="jobmonitor", user=username)
 		return -1
 
 	return 0
 
 
+##############################
+#   DEFAULT INSTANCES
+##############################
+job_monitor_writer= JobUpdateWriter(flush_period=0, name='job_monitor_writer') # flushed at the end of each monitoring cycle
@@ -9,7 +9,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import glob
 import base64
 
@@ -26,6 +25,7 @@ except ImportError:
 # Import flask modules
 from flask import current_app, Blueprint, render_template, request, redirect, url_for, flash, g
 from flask import send_file, send_from_directory, safe_join, abort, make_response, jsonify
+from flask import Response, stream_with_context
 from werkzeug.utils import secure_filename
 
 # Import celery modules
@@ -39,7 +39,15 @@ from caesar_rest.workers import background_task
 from caesar_rest import oidc
 from caesar_rest import utils
 from caesar_rest.decorators import custom_require_login
+from caesar_rest.identity import get_identity
 from caesar_rest import mongo
+from caesar_rest import preview
+from caesar_rest import route_common
+from caesar_rest import active_jobs
+from caesar_rest import storage_usage
+from caesar_rest.quotas import quota_manager
+from caesar_rest import job_events
+from caesar_rest.job_events import job_event_bus, wsgi_stream_slots
 from caesar_rest import jobmgr_kube
 from caesar_rest import jobmgr_slurm
 
@@ -60,6 +68,7 @@ job_component_catalog_bp = Blueprint('job_component_catalog', __name__,url_prefi
 job_component_catalog_file_bp = Blueprint('job_component_catalog_file', __name__,url_prefix='/caesar/api/v1.0')
 job_preview_bp = Blueprint('job_preview', __name__,url_prefix='/caesar/api/v1.0')
 job_preview_file_bp = Blueprint('job_preview_file', __name__,url_prefix='/caesar/api/v1.0')
+job_events_bp = Blueprint('job_events', __name__,url_prefix='/caesar/api/v1.0')
 
 
 #=================================
@@ -79,10 +88,8 @@ def submit_job():
 	res['submit_date']= ''
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Get mongo info
 	mongo_dbhost= current_app.config['MONGO_HOST']
@@ -131,7 +138,7 @@ def submit_job():
 		return make_response(jsonify(res),400)
 
 	inputfile_uid= req_data['data_inputs']
-	inputfile= get_filepath_from_uuid(inputfile_uid, username)
+	inputfile= get_filepath_from_uuid(inputfile_uid, identity)
 	if inputfile=='':
 		logger.warn("Cannot find file for user %s corresponding to uid=%s!" % (username,inputfile_uid), action="submitjob", user=username)	
 		res['state']= 'ABORTED'	
@@ -151,6 +158,13 @@ def submit_job():
 	if cmd_arg_list:
 		cmd_args= ' '.join(cmd_arg_list)
 	
+	# - Check user quotas (from cached usage counters)
+	quota_check= quota_manager.check_submit(mongo.db, username, current_app.config)
+	if quota_check is not None:
+		status_code, quota_res= quota_check
+		res.update(quota_res)
+		return make_response(jsonify(res),status_code)
+
 	# - Set job top directory
 	job_top_dir= current_app.config['JOB_DIR'] + '/' + username
 
@@ -193,12 +207,12 @@ def submit_job():
 		"elapsed_time": '0',
 		"exit_code": -1
 	}
-
-	collection_name= username + '.jobs'
+	if 'jobdir_sync_time' in submit_res:
+		job_obj['jobdir_sync_time']= submit_res['jobdir_sync_time']
 
 	try:
 		logger.info("Creating or retrieving job collection for user %s ..." % username, action="submitjob", user=username)
-		job_collection= mongo.db[collection_name]
+		job_collection= identity.jobs_collection
 
 		logger.info("Adding job obj to collection ...", action="submitjob", user=username)
 		try:
@@ -215,6 +229,14 @@ def submit_job():
 		res['status']= 'WARN: Job submitted but failed to be registered in DB!'
 		return make_response(jsonify(res),500)
 
+	# - Register job in active jobs index (used by job monitors)
+	#   NB: pass job collection so that jobs already finished (e.g. fast failing celery jobs) are not left in the index
+	status= active_jobs.register_active_job(mongo.db, username, job_obj, job_collection)
+	if status<0:
+		logger.warn("Failed to register job %s in active jobs index!" % job_id, action="submitjob", user=username)
+	if status==0:
+		quota_manager.add_usage(username, active_jobs=1)
+
 
 	# - Fill response
 	res['job_id']= job_id
@@ -240,11 +262,13 @@ def submit_job_celery(app_name, cmd, cmd_args, job_top_dir, username, mongo_dbho
 	now = datetime.datetime.now()
 	submit_date= now.isoformat()
 	job_monitoring_period= current_app.config['JOB_MONITORING_PERIOD']
+	catalog_dir= current_app.config['CATALOG_DIR']
+	preview_renderer= current_app.config['PREVIEW_RENDERER']
 
 	# - Submit task to queue
 	logger.info("Submitting job %s async (cmd=%s, args=%s) ..." % (app_name,cmd,cmd_args), action="submitjob", user=username)
 	task = background_task.apply_async(
-		[app_name, cmd, cmd_args, job_top_dir, username, mongo_dbhost, mongo_dbport, mongo_dbname, job_monitoring_period],
+		[app_name, cmd, cmd_args, job_top_dir, username, mongo_dbhost, mongo_dbport, mongo_dbname, job_monitoring_period, catalog_dir, preview_renderer],
 		queue= app_name # set queue name to app name
 	)
 	job_id= task.id
@@ -382,6 +406,10 @@ def submit_job_slurm(app_name, inputfile, cmd_args, job_top_dir, username, run_o
 			logger.error(errmsg, action="submitjob", user=username)
 			return None
 
+	# - Flush job dir to storage so that it is visible in the cluster as soon as possible
+	#   NB: Job script waits for the job dir to appear (with backoff) instead of sleeping a fixed time
+	sync_time= utils.sync_dir(job_dir)
+
 	# - Set job options
 	image= ''
 	if app_name=="caesar":
@@ -439,7 +467,7 @@ def submit_job_slurm(app_name, inputfile, cmd_args, job_top_dir, username, run_o
 
 	pid= submit_job['job_id']
 
-	logger.info("Submitted job with id=%s (pid=%s) ..." % (job_id, pid), action="submitjob", user=username)
+	logger.info("Submitted job with id=%s (pid=%s, dir sync time=%.3f s) ..." % (job_id, pid, sync_time), action="submitjob", user=username)
 	
 	# - Response
 	res= {
@@ -447,7 +475,8 @@ def submit_job_slurm(app_name, inputfile, cmd_args, job_top_dir, username, run_o
 		"pid": pid,
 		"submit_date": submit_date,
 		"state": "PENDING",
-		"status": "Job submitted to Slurm scheduler"
+		"status": "Job submitted to Slurm scheduler",
+		"jobdir_sync_time": sync_time
 	}
 
 	return res
@@ -461,17 +490,13 @@ def get_job_ids():
 	""" Retrieve all job ids per user """
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
 
 	# - Get all job ids from DB
 	res= {}	
-	collection_name= username + '.jobs'
 	try:
-		job_collection= mongo.db[collection_name]
-		job_cursor= job_collection.find({},projection={"_id":0})
+		job_collection= identity.jobs_collection
+		job_cursor= job_collection.find({},projection=route_common.JOB_LIST_PROJECTION)
 		res = list(job_cursor)
 
 	except Exception as e:
@@ -495,10 +520,8 @@ def cancel_job(task_id):
 	res['status']= ''
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Get mongo info
 	mongo_dbhost= current_app.config['MONGO_HOST']
@@ -509,10 +532,9 @@ def cancel_job(task_id):
 	job_scheduler= current_app.config['JOB_SCHEDULER']
 
 	# - Search job id in user collection
-	collection_name= username + '.jobs'
 	job= None
 	try:
-		job_collection= mongo.db[collection_name]
+		job_collection= identity.jobs_collection
 		job= job_collection.find_one({'job_id': str(task_id)})
 	except Exception as e:
 		errmsg= 'Exception catched when searching job id in DB (err=' + str(e) + ')!'
@@ -563,15 +585,13 @@ def cancel_job(task_id):
 		return make_response(jsonify(res),500)
 
 	# - If job was canceled with success set CANCELED status in DB
-	collection_name= username + '.jobs'
-
 	state= "CANCELED"
 	status= "Job canceled by user"
 	exit_code= -1
 	#elapsed_time= task_info['elapsed_time']
 	
 	try:
-		job_collection= mongo.db[collection_name]
+		job_collection= identity.jobs_collection
 		job_collection.update_one({'job_id':task_id},{'$set':{'state':state,'status':status,'exit_code':exit_code}},upsert=False)
 	except Exception as e:
 		errmsg= 'Exception caught when updating job ' + str(task_id) + ' in DB (err=' + str(e) + ')!'
@@ -579,6 +599,8 @@ def cancel_job(task_id):
 		res['status']= errmsg
 		return make_response(jsonify(res),500)
 
+	active_jobs.update_active_job(mongo.db, username, task_id, {'state':state})
+
 	res['status']= "Job canceled and status updated in DB"
 
 	return make_response(jsonify(res),200)
@@ -785,48 +807,24 @@ def compute_job_status(task_id):
 def get_job_status(task_id):
 	""" Get job status """
     
-	# - Init response
-	res= {}
-	res['job_id']= task_id
-	res['pid']= ''
-	res['state']= ''
-	res['status']= ''
-	res['exit_code']= ''
-	res['elapsed_time']= ''
-	res['tag']= ''
-
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Search job id in user collection
-	collection_name= username + '.jobs'
 	job= None
 	try:
-		job_collection= mongo.db[collection_name]
-		job= job_collection.find_one({'job_id': str(task_id)})
+		job_collection= identity.jobs_collection
+		job= job_collection.find_one(route_common.get_job_query(task_id))
 	except Exception as e:
 		errmsg= 'Exception catched when searching job id in DB (err=' + str(e) + ')!'
 		logger.error(errmsg, action="jobstatus", user=username)
-		res['status']= errmsg
-		return make_response(jsonify(res),404)
-
-	if not job or job is None:
-		errmsg= 'Job ' + task_id + ' not found for user ' + username + '!'
-		logger.warn(errmsg, action="jobstatus", user=username)
+		res= route_common.init_job_status_reply(task_id)
 		res['status']= errmsg
 		return make_response(jsonify(res),404)
 
 	# - Retrieve job status from Mongo DB
-	res['pid']= job['pid']
-	res['state']= job['state']
-	res['status']= job['status']
-	res['exit_code']= job['exit_code']
-	res['elapsed_time']= job['elapsed_time']
-	if 'tag' in job:
-		res['tag']= job['tag']
+	res, status_code= route_common.make_job_status_reply(task_id, job, username)
 
 	##########################################################################
 	##     ORIGINAL METHOD (RETRIEVE STATUS FROM CELERY RESULT BACKEND)
@@ -839,22 +837,180 @@ def get_job_status(task_id):
 	#	return make_response(jsonify(res),404)
 	###########################################################################
 
-	return make_response(jsonify(res),200)
+	return make_response(jsonify(res),status_code)
+
+
+#=================================
+#===      JOB EVENTS (SSE)
+#=================================
+def open_event_stream(topics, username):
+	""" Take a WSGI stream slot and subscribe to given job event topics. Return None if max number of streams is reached. """
+
+	# - Each stream holds a worker thread for up to JOB_EVENTS_MAX_STREAM_TIME, so limit them (serve SSE with the ASGI front-end for many clients)
+	max_streams= current_app.config['JOB_EVENTS_MAX_WSGI_STREAMS']
+	if not wsgi_stream_slots.acquire(max_streams):
+		logger.warn("Max number of event streams (%d) reached in this process, refusing stream ..." % max_streams, action="jobevents", user=username, event_type="jobevents.refused")
+		return None
+
+	return job_event_bus.subscribe(topics)
+
+
+def close_event_stream(sub):
+	""" Release subscription and WSGI stream slot """
+
+	job_event_bus.unsubscribe(sub)
+	wsgi_stream_slots.release()
+
+
+def get_sse_response(stream, sub):
+	""" Return SSE streaming response. Subscription is released when response is closed (also if client disconnects before the stream is started). """
+
+	response= Response(stream_with_context(stream), mimetype='text/event-stream')
+	response.headers.update(job_events.SSE_HEADERS)
+	response.call_on_close(lambda: close_event_stream(sub))
+	return response
+
+
+def make_too_many_streams_response(res):
+	""" Return response sent when max number of event streams is reached """
+
+	res['status']= 'Too many event streams open on this server, retry later (hint: poll job status)!'
+	response= make_response(jsonify(res),503)
+	response.headers['Retry-After']= str(current_app.config['JOB_EVENTS_KEEPALIVE_PERIOD'])
+	return response
+
+
+@job_events_bp.route('/job/<task_id>/events',methods=['GET'])
+@custom_require_login
+def get_job_events(task_id):
+	""" Stream job state/elapsed time updates as Server-Sent Events """
+
+	# - Init response
+	res= {}
+	res['job_id']= task_id
+	res['status']= ''
+
+	# - Get aai info
+	identity= get_identity()
+	username= identity.username
+
+	# - Search job id in user collection
+	job= None
+	try:
+		job_collection= identity.jobs_collection
+		job= job_collection.find_one({'job_id': str(task_id)}, projection={'_id': 0})
+	except Exception as e:
+		errmsg= 'Exception catched when searching job id in DB (err=' + str(e) + ')!'
+		logger.error(errmsg, action="jobevents", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),404)
+
+	if not job or job is None:
+		errmsg= 'Job ' + task_id + ' not found for user ' + username + '!'
+		logger.warn(errmsg, action="jobevents", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),404)
+
+	# - Subscribe to job events before sending current state, so that no transition is lost
+	#   NB: All watchers of the same job share the same backend event source
+	sub= open_event_stream([job_events.get_job_topic(task_id)], username)
+	if sub is None:
+		return make_too_many_streams_response(res)
+	keepalive_period= current_app.config['JOB_EVENTS_KEEPALIVE_PERIOD']
+	recheck_period= current_app.config['JOB_EVENTS_RECHECK_PERIOD']
+	max_stream_time= current_app.config['JOB_EVENTS_MAX_STREAM_TIME']
+
+	def stream():
+		# - Send current state
+		event_stream= job_events.JobEventStream(single_job=True)
+		yield event_stream.process(job_events.make_job_event(username, job), force=True)
+		if event_stream.completed:
+			return
+
+		start= time.time()
+		last_check= start
+		while time.time()-start<max_stream_time:
+			event= sub.get(timeout=keepalive_period)
+
+			# - Re-check state in DB from time to time in case an event was missed
+			if event is None and time.time()-last_check>=recheck_period:
+				last_check= time.time()
+				job_obj= job_collection.find_one({'job_id': str(task_id)}, projection={'_id': 0})
+				if job_obj:
+					event= job_events.make_job_event(username, job_obj)
+
+			if event is None:
+				yield job_events.SSE_KEEPALIVE
+				continue
+
+			# - Send only if state fields changed
+			msg= event_stream.process(event)
+			if msg is not None:
+				yield msg
+				if event_stream.completed:
+					return
+
+	logger.info("Streaming events for job %s ..." % task_id, action="jobevents", user=username, event_type="jobevents.stream")
+	return get_sse_response(stream(), sub)
+
+
+@job_events_bp.route('/jobs/events',methods=['GET'])
+@custom_require_login
+def get_jobs_events():
+	""" Stream state/elapsed time updates of all user jobs as Server-Sent Events """
+
+	# - Get aai info
+	identity= get_identity()
+	username= identity.username
+
+	# - Subscribe to user job events before reading current states
+	sub= open_event_stream([job_events.get_user_topic(username)], username)
+	if sub is None:
+		return make_too_many_streams_response({})
+	keepalive_period= current_app.config['JOB_EVENTS_KEEPALIVE_PERIOD']
+	max_stream_time= current_app.config['JOB_EVENTS_MAX_STREAM_TIME']
+
+	# - Get current state of active user jobs
+	job_list= []
+	try:
+		job_list= active_jobs.get_active_jobs(mongo.db, username=username)
+	except Exception as e:
+		logger.warn("Failed to get active jobs from DB (err=%s)!" % str(e), action="jobevents", user=username)
+
+	def stream():
+		event_stream= job_events.JobEventStream()
+		for job_obj in job_list:
+			yield event_stream.process(job_events.make_job_event(username, job_obj), force=True)
+		
+		start= time.time()
+		while time.time()-start<max_stream_time:
+			event= sub.get(timeout=keepalive_period)
+			if event is None:
+				yield job_events.SSE_KEEPALIVE
+				continue
+
+			# - Send only if state fields changed
+			msg= event_stream.process(event)
+			if msg is not None:
+				yield msg
+
+	logger.info("Streaming events for all jobs ...", action="jobevents", user=username, event_type="jobevents.stream")
+	return get_sse_response(stream(), sub)
 
 
 #=================================
 #===      DATA INPUTS 
 #=================================
-def get_filepath_from_uuid(file_uuid, username):
+def get_filepath_from_uuid(file_uuid, identity):
 	""" Transform input file from uuid to actual path """		
 
 	# - Inspect inputfile (expect it is a uuid, so convert to filename)
+	username= identity.username
 	logger.info("Finding inputfile uuid %s ..." % file_uuid, action="submitjob", user=username)
-	collection_name= username + '.files'
 
 	file_path= ''
 	try:
-		data_collection= mongo.db[collection_name]
+		data_collection= identity.files_collection
 		item= data_collection.find_one({'fileid': str(file_uuid)})
 		if item and item is not None:
 			file_path= item['filepath']
@@ -886,16 +1042,13 @@ def get_job_out_file(task_id, label):
 	res['status']= ''
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 
 	# - Search job id in user collection
-	collection_name= username + '.jobs'
 	job= None
 	try:
-		job_collection= mongo.db[collection_name]
+		job_collection= identity.jobs_collection
 		job= job_collection.find_one({'job_id': str(task_id)})
 	except Exception as e:
 		errmsg= 'Exception catched when searching job id in DB (err=' + str(e) + ')!'
@@ -924,6 +1077,14 @@ def get_job_out_file(task_id, label):
 		res['status']= errmsg
 		return make_response(jsonify(res),202)
 
+	# - If job post-processing (archive, previews) is still running return
+	postproc_state= job.get('postproc_state', '')
+	if postproc_state=='PENDING' or postproc_state=='STARTED':
+		errmsg= 'Job ' + task_id + ' output still being post-processed (state=' + postproc_state + '), output not yet available'
+		logger.info(errmsg, action="joboutput", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),202)
+
 	# - Check if file exists
 	job_top_dir= current_app.config['JOB_DIR'] + '/' + username
 	job_dir_name= 'job_' + task_id
@@ -973,27 +1134,10 @@ def get_job_out_file(task_id, label):
 	filename= filenames[0]
 
 	# - Send file as attachment in most case
-	#   For preview send the image as base64 encoded string in json
+	#   For preview send the image as binary (image/png or image/webp) or,
+	#   for legacy clients, as base64 encoded string in json
 	if label=='preview':
-		# - Send image as string
-		image= ''
-		try:
-			with open(filename, "rb") as f:
-				image_binary = f.read()
-				image = base64.b64encode(image_binary).decode("utf-8")
-		except Exception as e:	
-			errmsg= 'Failed to convert file ' + filename + ' to b64 string (err=' + str(e) + ')!'
-			logger.warn(errmsg, action="joboutput", user=username)
-			res['status']= errmsg
-			return make_response(jsonify(res),500)
-
-		if image=='':
-			errmsg= 'Failed to convert file ' + filename + ' to b64 string (err=' + str(e) + ')!'
-			logger.warn(errmsg, action="joboutput", user=username)
-			res['status']= errmsg
-			return make_response(jsonify(res),500)
-		else:
-			return make_response(jsonify({'status': '', 'image': image}), 200)
+		return send_job_preview(task_id, filename, job_top_dir, username)
 	
 	elif label=='islands-json' or label=='components-json':
 		# - Send as json string
@@ -1025,6 +1169,115 @@ def get_job_out_file(task_id, label):
 	return make_response(jsonify(res),200)
 	
 
+def get_preview_request_options():
+	""" Return the preview format (json/png/webp) and width requested by client """
+
+	# - Get format from query arg or from Accept header (json by default for legacy clients)
+	fmt= request.args.get('format', '').lower()
+	if fmt=='':
+		mimetype= request.accept_mimetypes.best_match(['application/json', 'image/png', 'image/webp'], default='application/json')
+		if mimetype=='image/png':
+			fmt= 'png'
+		elif mimetype=='image/webp':
+			fmt= 'webp'
+		else:
+			fmt= 'json'
+
+	if fmt!='json' and fmt not in preview.PREVIEW_MIMETYPES:
+		raise ValueError('Unsupported preview format ' + fmt + ' (hint: supported are {json,png,webp})')
+
+	# - Get width
+	width= None
+	if 'width' in request.args:
+		width= int(request.args['width'])
+		if width<preview.PREVIEW_MIN_WIDTH or width>preview.PREVIEW_MAX_WIDTH:
+			raise ValueError('Preview width must be in range [' + str(preview.PREVIEW_MIN_WIDTH) + ',' + str(preview.PREVIEW_MAX_WIDTH) + ']')
+		
+	return fmt, width
+
+
+def send_job_preview(task_id, filename, job_top_dir, username):
+	""" Send job preview image with content negotiation, ETag caching and optional resizing """
+	
+	res= {}
+	res['job_id']= task_id
+	res['status']= ''
+
+	# - Get requested format & width
+	try:
+		fmt, width= get_preview_request_options()
+	except ValueError as e:
+		errmsg= 'Invalid preview options given (err=' + str(e) + ')!'
+		logger.warn(errmsg, action="joboutput", user=username)
+		res['status']= errmsg
+		return make_response(jsonify(res),400)
+
+	# - Get preview file variant (from cache if already created)
+	img_fmt= 'png' if fmt=='json' else fmt
+	cache_dir= preview.get_preview_cache_dir(job_top_dir, task_id)
+	if (width is not None or img_fmt!='png') and not preview.has_image_support():
+		logger.warn("Image resizing/conversion not supported, sending original preview ...", action="joboutput", user=username)
+		width= None
+		img_fmt= 'png'
+
+	preview_file, nbytes= preview.get_preview_file(filename, cache_dir, width, img_fmt)
+	if nbytes!=0:
+		storage_usage.add_storage_usage(mongo.db, username, jobsize=nbytes)
+	if preview_file is None:
+		logger.warn("Failed to create preview variant (width=%s, format=%s), sending original preview ..." % (str(width), img_fmt), action="joboutput", user=username)
+		preview_file= filename
+		width= None
+		img_fmt= 'png'
+	
+	# - Return 304 if client has the same variant already
+	etag= preview.get_preview_etag(preview_file, width, fmt if fmt=='json' else img_fmt)
+	if etag is not None and etag in request.if_none_match:
+		response= make_response('', 304)
+		response.set_etag(etag)
+		response.headers['Vary']= 'Accept'
+		return response
+
+	# - Send image as base64 string in json (legacy clients)
+	if fmt=='json':
+		image= ''
+		try:
+			with open(preview_file, "rb") as f:
+				image_binary = f.read()
+				image = base64.b64encode(image_binary).decode("utf-8")
+		except Exception as e:	
+			errmsg= 'Failed to convert file ' + preview_file + ' to b64 string (err=' + str(e) + ')!'
+			logger.warn(errmsg, action="joboutput", user=username)
+			res['status']= errmsg
+			return make_response(jsonify(res),500)
+
+		if image=='':
+			errmsg= 'Failed to convert file ' + preview_file + ' to b64 string (empty image)!'
+			logger.warn(errmsg, action="joboutput", user=username)
+			res['status']= errmsg
+			return make_response(jsonify(res),500)
+		
+		response= make_response(jsonify({'status': '', 'image': image}), 200)
+
+	# - Send image as binary
+	else:
+		logger.info("Sending job preview file %s ..." % preview_file, action="joboutput", user=username)
+		try:
+			response= send_file(
+				preview_file,
+				mimetype=preview.PREVIEW_MIMETYPES[img_fmt]
+			)
+		except FileNotFoundError:
+			res['status']= 'Job preview file ' + preview_file + ' not found!'
+			return make_response(jsonify(res),500)
+
+	if etag is not None:
+		response.set_etag(etag)
+	response.headers['Cache-Control']= 'private, max-age=0, must-revalidate'
+	response.headers['Vary']= 'Accept'
+	
+	return response
+
+
 ################################
 ##     JOB OUTPUT TAR FILE
 ################################
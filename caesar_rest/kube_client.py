@@ -11,14 +11,15 @@ import time
 import datetime
 from dateutil.tz import tzutc
 import logging
-import numpy as np
 import pprint
+import threading
 
 # - Import Kubernetes and related modules
 import yaml
 #from kubernetes import client, config, utils
 from kubernetes import client
 from kubernetes import config as config_kube
+from kubernetes import watch
 
 from kubernetes.client.rest import ApiException
 
@@ -29,6 +30,13 @@ from caesar_rest import utils
 #logger = logging.getLogger(__name__)
 from caesar_rest import logger
 
+##############################
+#      JOB LABELS
+##############################
+# - Label set on all jobs created by the service (used to select them in list/watch calls)
+SERVICE_LABEL_KEY= 'caesar-rest/managed-by'
+SERVICE_LABEL_VALUE= 'caesar-rest'
+
 ##############################
 #      CLASSES
 ##############################
@@ -54,6 +62,16 @@ class KubeJobManager(object):
 		self.keyfile= ''
 		self.cafile= ''
 		self.verify_ssl = True
+
+		# - Job watch options & cache
+		self.watch_timeout= 300 # server-side timeout of each watch request in seconds
+		self.watch_thread= None
+		self.watch_stop_event= threading.Event()
+		self.watch_lock= threading.Lock()
+		self.watch_synced= False
+		self.watch_resource_version= None
+		self.job_status_cache= {} # job name -> last job status dict
+		self.cleared_jobs= set() # names of jobs whose final state has been stored, ignored by the watch until deleted
 		
 		# - Initialize
 		#if self.initialize()<0:
@@ -220,14 +238,7 @@ class KubeJobManager(object):
 		
 
 
-		print("== KUBE CLIENT CONFIG ==")
-		print("cluster=%s (host=%s)" % (self.cluster, self.cluster_host))
-		print("user=%s" % self.cluster_user)
-		print("namespace=%s" % self.cluster_namespace)
-		print("certfile=%s" % self.configuration.cert_file)
-		print("keyfile=%s" % self.configuration.key_file)
-		print("ssl_ca_certfile=%s" % self.configuration.ssl_ca_cert)
-		print("========================")
+		logger.info("Kube client config: cluster=%s (host=%s), user=%s, namespace=%s, certfile=%s, keyfile=%s, ssl_ca_certfile=%s" % (self.cluster, self.cluster_host, self.cluster_user, self.cluster_namespace, self.configuration.cert_file, self.configuration.key_file, self.configuration.ssl_ca_cert))
 
 		return 0
 
@@ -270,21 +281,12 @@ class KubeJobManager(object):
 	def get_job_status(self, job_name):
 		""" Retrieve job status """
 
-		res= {}
-		res['job_id']= job_name
-		res['pid']= job_name
-		res['state']= ''
-		res['status']= ''
-		res['exit_code']= ''
-		res['elapsed_time']= ''
-
 		# - Get job with given name
 		submitted_job= None
 		try:
 			submitted_job = self.api_instance.read_namespaced_job(
 				name=job_name, 
-				namespace=self.cluster_namespace, 
-				pretty=True
+				namespace=self.cluster_namespace
 			)
 			#pprint(submitted_job)
 
@@ -292,6 +294,22 @@ class KubeJobManager(object):
 			logger.warn("Exception when calling BatchV1Api->read_namespaced_job_status: %s" % str(e), action="jobstatus") 
 			raise e
 
+		return self.parse_job_status(submitted_job)
+
+
+	def parse_job_status(self, submitted_job):
+		""" Compute job status dict from a V1Job object """
+
+		job_name= submitted_job.metadata.name
+
+		res= {}
+		res['job_id']= job_name
+		res['pid']= job_name
+		res['state']= ''
+		res['status']= ''
+		res['exit_code']= ''
+		res['elapsed_time']= ''
+
 		# - Compute job status
 		jobstatus_obj = submitted_job.status
 		jobcond= jobstatus_obj.conditions
@@ -319,7 +337,7 @@ class KubeJobManager(object):
 			errmsg= ''
 			if jobcond is not None and len(jobcond)>0:
 				errmsg= jobcond[0].message
-			res['status']= 'Job failed (err=' + errmsg + ')'
+			res['status']= 'Job failed (err=' + str(errmsg) + ')'
 		if success:
 			res['state']= 'SUCCESS'
 			res['status']= 'Job completed with success'
@@ -328,8 +346,9 @@ class KubeJobManager(object):
 		if success:
 			t0= jobstatus_obj.start_time
 			t1= jobstatus_obj.completion_time
-			elapsed= (t1-t0).total_seconds()
-			res['elapsed_time']= elapsed
+			if t0 is not None and t1 is not None:
+				elapsed= (t1-t0).total_seconds()
+				res['elapsed_time']= elapsed
 
 		# - Get exit code (possibly not supported!)
 		# ...
@@ -343,8 +362,7 @@ class KubeJobManager(object):
 	
 		try:
 			jobs = self.api_instance.list_namespaced_job(
-				namespace=self.cluster_namespace, 
-				pretty=True	
+				namespace=self.cluster_namespace
 			)
 			pprint(jobs)
 
@@ -355,8 +373,8 @@ class KubeJobManager(object):
 	#============================
 	#==     DELETE JOB
 	#============================
-	def delete_job(self, job_name):
-		""" Delete job and relative pod (TBD) """
+	def delete_job(self, job_name, wait=True):
+		""" Delete job and relative pod (TBD). If wait is False the request is sent asynchronously without waiting for the reply. """
 		
 		logger.info("Cleaning up job %s ..." % job_name, action="canceljob")
 		try: 
@@ -365,11 +383,12 @@ class KubeJobManager(object):
 			res= self.api_instance.delete_namespaced_job(
 				name=job_name,
 				namespace=self.cluster_namespace,
-				pretty=True,
 				grace_period_seconds= 0, 
-				propagation_policy='Background'
+				propagation_policy='Background',
+				async_req=not wait
 			)
-			print(res)
+			if wait:
+				logger.debug("Kube reply to delete job %s: status=%s" % (job_name, str(getattr(res, 'status', ''))), action="canceljob")
             
 		except ApiException as e:
 			logger.warn("Exception when calling BatchV1Api->delete_namespaced_job: %s" % str(e), action="canceljob")
@@ -412,7 +431,7 @@ class KubeJobManager(object):
 		template= None
 		try:
 			template = client.V1PodTemplateSpec(
-				metadata=client.V1ObjectMeta(labels={"app": label}),
+				metadata=client.V1ObjectMeta(labels={"app": label, SERVICE_LABEL_KEY: SERVICE_LABEL_VALUE}),
 				spec=client.V1PodSpec(
 					restart_policy="Never", 
 					containers=[container], 
@@ -442,7 +461,7 @@ class KubeJobManager(object):
 			job = client.V1Job(
 				api_version="batch/v1",
 				kind="Job",
-				metadata=client.V1ObjectMeta(name=job_name),
+				metadata=client.V1ObjectMeta(name=job_name, labels={"app": label, SERVICE_LABEL_KEY: SERVICE_LABEL_VALUE}),
 				spec=spec
 			)
 		except:
@@ -527,8 +546,7 @@ class KubeJobManager(object):
 		try:
 			jobout= self.api_instance.create_namespaced_job(
 				namespace=self.cluster_namespace, 
-				body=job, 
-				pretty=True
+				body=job
 			)
 			
 		except ApiException as e:
@@ -539,3 +557,193 @@ class KubeJobManager(object):
 
 
 
+
+
+	#============================
+	#==     WATCH JOBS
+	#============================
+	def get_service_label_selector(self):
+		""" Return label selector matching jobs created by the service """
+		return SERVICE_LABEL_KEY + '=' + SERVICE_LABEL_VALUE
+
+
+	def start_job_watch(self, timeout=300):
+		""" Start a background thread watching service jobs and caching their status """
+
+		if self.api_instance is None:
+			logger.warn("Batch API instance not created, cannot start job watch!", action="jobmonitor")
+			return -1
+
+		if self.watch_thread is not None and self.watch_thread.is_alive():
+			return 0
+
+		self.watch_timeout= timeout
+		self.watch_stop_event.clear()
+		self.watch_thread= threading.Thread(target=self.watch_jobs, name='KubeJobWatch')
+		self.watch_thread.daemon= True
+		self.watch_thread.start()
+
+		logger.info("Kube job watch started (namespace=%s, selector=%s) ..." % (self.cluster_namespace, self.get_service_label_selector()), action="jobmonitor")
+
+		return 0
+
+
+	def stop_job_watch(self):
+		""" Stop job watch thread """
+		self.watch_stop_event.set()
+
+
+	def is_job_watch_synced(self):
+		""" Return True if job status cache is in sync with the cluster """
+		return self.watch_synced and self.watch_thread is not None and self.watch_thread.is_alive()
+
+
+	def get_cached_job_status(self, job_name):
+		""" Return cached status dict of given job (None if job was not seen by the watch) """
+
+		with self.watch_lock:
+			res= self.job_status_cache.get(job_name, None)
+			if res is None:
+				return None
+			return dict(res)
+
+
+	def clear_cached_job_status(self, job_name):
+		""" Remove job from status cache (e.g. once its final state has been stored). Later watch events of the job are ignored. """
+
+		with self.watch_lock:
+			res= self.job_status_cache.pop(job_name, None)
+
+			# - Remember job until its deletion is seen (only if watched and not yet deleted)
+			if self.watch_thread is not None and (res is None or not res.get('deleted', False)):
+				self.cleared_jobs.add(job_name)
+
+
+	def list_jobs(self):
+		""" List service jobs and rebuild status cache. Return the list resource version. """
+
+		jobs= self.api_instance.list_namespaced_job(
+			namespace=self.cluster_namespace,
+			label_selector=self.get_service_label_selector()
+		)
+
+		listed_jobs= {}
+		for job in jobs.items:
+			listed_jobs[job.metadata.name]= self.parse_job_status(job)
+
+		with self.watch_lock:
+			# - Forget cleared jobs no more in the cluster and skip the others
+			self.cleared_jobs&= set(listed_jobs.keys())
+			cache= dict((job_name, res) for job_name, res in listed_jobs.items() if job_name not in self.cleared_jobs)
+
+			# - Keep last known status of jobs deleted since previous listing, not yet collected by the monitor
+			#   NB: Jobs already marked as deleted in previous listing are not carried forward again
+			for job_name, res in self.job_status_cache.items():
+				if job_name not in cache and not res.get('deleted', False):
+					res['deleted']= True
+					cache[job_name]= res
+			self.job_status_cache= cache
+
+		logger.info("#%d jobs listed in namespace %s ..." % (len(jobs.items), self.cluster_namespace), action="jobmonitor")
+
+		return jobs.metadata.resource_version
+
+
+	def process_job_event(self, event):
+		""" Update job status cache from a watch event """
+
+		event_type= event['type']
+		job= event['object']
+		job_name= job.metadata.name
+
+		if event_type=='ADDED' or event_type=='MODIFIED':
+			res= self.parse_job_status(job)
+			with self.watch_lock:
+				if job_name not in self.cleared_jobs:
+					self.job_status_cache[job_name]= res
+
+		elif event_type=='DELETED':
+			# - Keep final status (jobs can be deleted by ttl before the monitor sees the last transition), unless already cleared
+			res= self.parse_job_status(job)
+			res['deleted']= True
+			with self.watch_lock:
+				if job_name in self.cleared_jobs:
+					self.cleared_jobs.discard(job_name)
+					self.job_status_cache.pop(job_name, None)
+				else:
+					self.job_status_cache[job_name]= res
+
+
+	def watch_jobs(self):
+		""" Thread main loop: list service jobs then watch for changes, re-listing when the resource version expires """
+
+		nfailures= 0
+
+		while not self.watch_stop_event.is_set():
+
+			# - List jobs to (re)build cache and get starting resource version
+			if self.watch_resource_version is None:
+				try:
+					self.watch_resource_version= self.list_jobs()
+					self.watch_synced= True
+					nfailures= 0
+				except Exception as e:
+					self.watch_synced= False
+					nfailures+= 1
+					delay= min(60, 2**nfailures)
+					logger.warn("Failed to list Kube jobs (err=%s), retrying in %d s ..." % (str(e), delay), action="jobmonitor")
+					self.watch_stop_event.wait(delay)
+					continue
+
+			# - Watch job changes starting from last seen resource version
+			w= watch.Watch()
+			try:
+				for event in w.stream(
+					self.api_instance.list_namespaced_job,
+					namespace=self.cluster_namespace,
+					label_selector=self.get_service_label_selector(),
+					resource_version=self.watch_resource_version,
+					timeout_seconds=self.watch_timeout,
+					allow_watch_bookmarks=True
+				):
+					if self.watch_stop_event.is_set():
+						w.stop()
+						break
+
+					# - Resource version too old: re-list
+					if event['type']=='ERROR':
+						code= event['raw_object'].get('code', 0)
+						logger.info("Kube job watch returned an error event (code=%s), re-listing jobs ..." % str(code), action="jobmonitor")
+						self.watch_resource_version= None
+						w.stop()
+						break
+
+					self.watch_resource_version= event['raw_object']['metadata']['resourceVersion']
+					if event['type']!='BOOKMARK':
+						self.process_job_event(event)
+
+				nfailures= 0
+
+			except ApiException as e:
+				if e.status==410:
+					logger.info("Kube job watch resource version expired, re-listing jobs ...", action="jobmonitor")
+					self.watch_resource_version= None
+				else:
+					self.watch_synced= False
+					self.watch_resource_version= None
+					nfailures+= 1
+					delay= min(60, 2**nfailures)
+					logger.warn("Kube job watch failed (err=%s), retrying in %d s ..." % (str(e), delay), action="jobmonitor")
+					self.watch_stop_event.wait(delay)
+
+			except Exception as e:
+				self.watch_synced= False
+				self.watch_resource_version= None
+				nfailures+= 1
+				delay= min(60, 2**nfailures)
+				logger.warn("Kube job watch interrupted (err=%s), retrying in %d s ..." % (str(e), delay), action="jobmonitor")
+				self.watch_stop_event.wait(delay)
+
+		self.watch_synced= False
+		logger.info("Kube job watch stopped", action="jobmonitor")
+
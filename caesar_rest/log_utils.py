@@ -0,0 +1,230 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import time
+import atexit
+import logging
+import threading
+
+try:
+	import queue # python3
+except ImportError:
+	import Queue as queue # python2
+
+try:
+	from logging.handlers import QueueHandler, QueueListener # python>=3.2
+except ImportError:
+	QueueHandler= None
+	QueueListener= None
+
+# Import structlog
+import structlog
+
+# NB: This module is imported by caesar_rest/__init__.py before the package logger is created, so it must not use it
+
+##############################
+#   LOG OPTIONS
+##############################
+# - Supported log renderers
+LOG_FORMATS= ['json', 'console']
+
+# - Max number of log records waiting to be written (records are dropped when full, never blocking the caller)
+LOG_QUEUE_SIZE= 10000
+
+# - Default max number of events of the same type emitted per period (0=no limit)
+LOG_RATE_BURST= 10
+
+# - Default rate limit period in seconds
+LOG_RATE_PERIOD= 60
+
+# - Log levels never dropped by rate limiter
+LOG_RATE_EXEMPT_LEVELS= set(['error', 'critical', 'exception'])
+
+
+def make_log_formatter(fmt='json'):
+	""" Return a structlog formatter rendering events as json lines or colored console lines """
+
+	if fmt=='console':
+		renderer= structlog.dev.ConsoleRenderer()
+	else:
+		renderer= structlog.processors.JSONRenderer()
+
+	return structlog.stdlib.ProcessorFormatter(processor=renderer)
+
+
+##############################
+#   RATE LIMITER
+##############################
+class LogRateLimiter(object):
+	""" structlog processor limiting repetitive log events (e.g. per-request or per-poll messages).
+	    Events are grouped by their event_type key: at most burst events per type are emitted per period, and the number of dropped events is added to the first event emitted in the next period.
+	    Events without event_type and errors are never dropped.
+	"""
+
+	def __init__(self, burst=LOG_RATE_BURST, period=LOG_RATE_PERIOD, limits=None):
+
+		self.burst= burst
+		self.period= period
+		self.limits= dict(limits or {}) # event_type -> (burst, period), overriding defaults
+		self.lock= threading.Lock()
+		self.windows= {} # event_type -> [window start, nevents, ndropped]
+
+	def __call__(self, logger, method_name, event_dict):
+
+		event_type= event_dict.get('event_type', None)
+		if event_type is None or method_name in LOG_RATE_EXEMPT_LEVELS:
+			return event_dict
+
+		burst, period= self.limits.get(event_type, (self.burst, self.period))
+		if burst<=0:
+			return event_dict
+
+		now= time.time()
+		with self.lock:
+			window= self.windows.get(event_type)
+			if window is None or now-window[0]>=period:
+				ndropped= window[2] if window is not None else 0
+				window= [now, 0, 0]
+				self.windows[event_type]= window
+				if ndropped>0:
+					event_dict['ndropped']= ndropped
+
+			if window[1]>=burst:
+				window[2]+= 1
+				raise structlog.DropEvent
+
+			window[1]+= 1
+
+		return event_dict
+
+
+##############################
+#   ASYNC HANDLER
+##############################
+if QueueHandler is not None:
+	class NonBlockingQueueHandler(QueueHandler):
+		""" Queue handler passing records as they are (structlog event dicts are rendered by target handlers) and dropping them if queue is full """
+
+		def __init__(self, log_queue):
+			QueueHandler.__init__(self, log_queue)
+			self.ndropped= 0
+
+		def prepare(self, record):
+			# - Records are consumed in-process, so keep event dict in record msg for ProcessorFormatter
+			return record
+
+		def enqueue(self, record):
+			try:
+				self.queue.put_nowait(record)
+			except queue.Full:
+				self.ndropped+= 1
+
+
+class LogDispatcher(object):
+	""" Write log records in a background thread: the logger gets a queue handler and the actual (stream/file) handlers are run by a queue listener.
+	    Falls back to synchronous handlers if queue handlers are not available (python2).
+	"""
+
+	def __init__(self, maxsize=LOG_QUEUE_SIZE):
+
+		self.maxsize= maxsize
+		self.handlers= []
+		self.listener= None
+		self.pid= None
+		self.lock= threading.Lock()
+		self.logger= None
+		self.queue_handler= None
+		if QueueHandler is not None:
+			self.queue_handler= NonBlockingQueueHandler(queue.Queue(maxsize))
+
+	def attach(self, logger):
+		""" Attach dispatcher to given (stdlib) logger """
+
+		self.logger= logger
+		if self.queue_handler is not None:
+			logger.addHandler(self.queue_handler)
+		else:
+			for handler in self.handlers:
+				logger.addHandler(handler)
+
+	def add_handler(self, handler):
+		""" Add a target handler """
+
+		with self.lock:
+			self.handlers.append(handler)
+			if self.listener is not None:
+				self.listener.handlers= tuple(self.handlers)
+
+		if self.queue_handler is None and self.logger is not None:
+			self.logger.addHandler(handler)
+
+	def start(self):
+		""" Start listener thread in this process (restarted if process was forked) """
+
+		if self.queue_handler is None:
+			return
+
+		with self.lock:
+			if self.listener is not None and self.pid==os.getpid():
+				return
+
+			# - A listener inherited with fork is not running in this process and its queue locks may be held, so replace both
+			if self.pid is not None:
+				self.queue_handler.queue= queue.Queue(self.maxsize)
+
+			self.listener= QueueListener(self.queue_handler.queue, *self.handlers, respect_handler_level=True)
+			self.listener.start()
+			self.pid= os.getpid()
+
+	def restart_after_fork(self):
+		""" Start listener in a forked child (locks inherited with fork may be held by threads not existing in child, so recreate them) """
+
+		self.lock= threading.Lock()
+		self.start()
+
+	def stop(self):
+		""" Flush pending records and stop listener thread """
+
+		with self.lock:
+			if self.listener is None or self.pid!=os.getpid():
+				return
+			try:
+				self.listener.stop()
+			except queue.Full:
+				pass
+			self.listener= None
+
+	def get_stats(self):
+		""" Return dispatcher stats """
+
+		if self.queue_handler is None:
+			return {'async': False}
+		return {
+			'async': True,
+			'pending': self.queue_handler.queue.qsize(),
+			'ndropped': self.queue_handler.ndropped
+		}
+
+
+##############################
+#   DEFAULT INSTANCES
+##############################
+log_rate_limiter= LogRateLimiter()
+log_dispatcher= LogDispatcher()
+
+
+def reinit_after_fork():
+	""" Recreate locks and restart log listener in forked processes (uWSGI workers, Celery pool processes) """
+
+	log_rate_limiter.lock= threading.Lock()
+	log_dispatcher.restart_after_fork()
+
+
+# - Restart listener in forked processes and flush pending records at exit
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child=reinit_after_fork)
+atexit.register(log_dispatcher.stop)
+
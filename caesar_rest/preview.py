@@ -0,0 +1,180 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import time
+import hashlib
+import logging
+import threading
+
+# Import image modules (optional, used for resizing/webp encoding)
+try:
+	from PIL import Image
+except ImportError:
+	Image= None
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   PREVIEW OPTIONS
+##############################
+# - Supported preview formats and corresponding mimetypes
+PREVIEW_MIMETYPES= {
+	'png': 'image/png',
+	'webp': 'image/webp'
+}
+
+# - Name of cache directory (placed in the user job top directory, next to job directories)
+#   NB: Kept out of job directories so that cached variants are not included in job archives
+PREVIEW_CACHE_DIRNAME= '.preview_cache'
+
+# - Limits on requested preview width
+PREVIEW_MIN_WIDTH= 16
+PREVIEW_MAX_WIDTH= 4096
+
+# - Locks used to avoid concurrent renderings of the same variant in this process (one per variant file being created)
+_variant_locks= {} # outfile -> [lock, nusers]
+_variant_locks_lock= threading.Lock()
+
+
+##############################
+#   PREVIEW HELPERS
+##############################
+def has_image_support():
+	""" Return True if resizing/re-encoding is supported """
+	return Image is not None
+
+
+def get_preview_cache_dir(job_top_dir, job_id):
+	""" Return the preview cache directory of given job """
+	return os.path.join(job_top_dir, PREVIEW_CACHE_DIRNAME, 'job_' + job_id)
+
+
+def acquire_variant_lock(outfile):
+	""" Acquire the lock of given variant file """
+
+	with _variant_locks_lock:
+		item= _variant_locks.get(outfile)
+		if item is None:
+			item= [threading.Lock(), 0]
+			_variant_locks[outfile]= item
+		item[1]+= 1
+
+	item[0].acquire()
+
+
+def release_variant_lock(outfile):
+	""" Release the lock of given variant file (removed when no more used) """
+
+	with _variant_locks_lock:
+		item= _variant_locks[outfile]
+		item[1]-= 1
+		if item[1]<=0:
+			del _variant_locks[outfile]
+
+	item[0].release()
+
+
+def is_variant_valid(outfile, filename):
+	""" Return True if cached variant exists and is not older than original file """
+
+	try:
+		return os.path.getmtime(outfile)>=os.path.getmtime(filename)
+	except OSError:
+		return False
+
+
+def get_preview_etag(filename, width=None, fmt='png'):
+	""" Return an ETag for the given preview file variant computed from file stats (no read needed) """
+
+	try:
+		st= os.stat(filename)
+	except OSError:
+		return None
+
+	key= '%s:%s:%d:%s:%s' % (filename, repr(st.st_mtime), st.st_size, str(width), fmt)
+	return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def get_preview_variant_path(filename, cache_dir, width=None, fmt='png'):
+	""" Return the path of the cached preview variant for given (width, format) """
+
+	basename= os.path.splitext(os.path.basename(filename))[0]
+	width_str= 'orig' if width is None else 'w' + str(width)
+	return os.path.join(cache_dir, basename + '_' + width_str + '.' + fmt)
+
+
+def make_preview_variant(filename, outfile, width=None, fmt='png'):
+	""" Resize/re-encode the preview image and save it to outfile. Return 0 on success, -1 otherwise """
+
+	if Image is None:
+		logger.warn("PIL module not available, cannot resize/convert preview image %s!" % filename, action="jobpreview")
+		return -1
+
+	try:
+		img= Image.open(filename)
+		img.load()
+
+		# - Resize keeping aspect ratio (never upscale)
+		if width is not None and width<img.width:
+			height= max(1, int(round(float(img.height)*width/img.width)))
+			img= img.resize((width, height), Image.LANCZOS)
+
+		# - Save to a temporary file and move it in place atomically
+		outfile_tmp= outfile + '.tmp' + str(os.getpid())
+		if fmt=='webp':
+			img.save(outfile_tmp, format='WEBP', quality=85, method=4)
+		else:
+			img.save(outfile_tmp, format='PNG', optimize=False)
+		os.rename(outfile_tmp, outfile)
+
+	except Exception as e:
+		logger.warn("Failed to create preview variant %s from file %s (err=%s)!" % (outfile, filename, str(e)), action="jobpreview")
+		return -1
+
+	return 0
+
+
+def get_preview_file(filename, cache_dir, width=None, fmt='png'):
+	""" Return the path of the preview file to be served for the requested width and format, creating and caching it if needed, and the change in bytes of the cache size (to be added to user storage usage). Return (None, 0) on failure. """
+
+	# - Serve original file if no resize/conversion is requested
+	if width is None and fmt=='png':
+		return filename, 0
+
+	# - Check if cached variant exists and is not older than original file
+	outfile= get_preview_variant_path(filename, cache_dir, width, fmt)
+	if is_variant_valid(outfile, filename):
+		return outfile, 0
+
+	# - Create the variant (re-checking the cache, as another thread may have created it while waiting)
+	acquire_variant_lock(outfile)
+	try:
+		if is_variant_valid(outfile, filename):
+			return outfile, 0
+
+		if not os.path.isdir(cache_dir):
+			try:
+				os.makedirs(cache_dir)
+			except OSError:
+				if not os.path.isdir(cache_dir):
+					logger.warn("Failed to create preview cache dir %s!" % cache_dir, action="jobpreview")
+					return None, 0
+
+		# - Replaced (stale) variant size is subtracted from the cache size change
+		nbytes_old= os.path.getsize(outfile) if os.path.isfile(outfile) else 0
+
+		t0= time.time()
+		if make_preview_variant(filename, outfile, width, fmt)<0:
+			return None, 0
+		nbytes= os.path.getsize(outfile) - nbytes_old
+		logger.info("Created preview variant %s (%d bytes) in %.3f s" % (outfile, nbytes+nbytes_old, time.time()-t0), action="jobpreview")
+
+	finally:
+		release_variant_lock(outfile)
+
+	return outfile, nbytes
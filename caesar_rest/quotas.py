@@ -0,0 +1,166 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+import threading
+
+# Import caesar_rest modules
+from caesar_rest import storage_usage
+from caesar_rest import active_jobs
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   QUOTA OPTIONS
+##############################
+# - Default time (in seconds) user usage counters are cached in process before being read again from DB
+QUOTA_CACHE_TTL= 10
+
+# - HTTP status codes returned when a quota is exceeded
+HTTP_TOO_MANY_REQUESTS= 429
+HTTP_INSUFFICIENT_STORAGE= 507
+
+
+##############################
+#   QUOTA MANAGER
+##############################
+class QuotaManager(object):
+	""" Check per-user storage, concurrent job and CPU-hour quotas against usage counters cached in process """
+
+	def __init__(self, cache_ttl=QUOTA_CACHE_TTL):
+
+		self.cache_ttl= cache_ttl
+		self.lock= threading.Lock()
+		self.cache= {} # username -> usage dict
+
+	def get_usage(self, db, username):
+		""" Return user usage (storage in bytes, number of active jobs, CPU hours), read from DB counters at most once per cache TTL. Return None on failure. """
+
+		now= time.time()
+		with self.lock:
+			usage= self.cache.get(username)
+			if usage is not None and now-usage['time']<self.cache_ttl:
+				return dict(usage)
+
+		# - Read counters from DB
+		#   NB: storage usage is updated incrementally (see storage_usage module), CPU hours are taken from last accounter run
+		try:
+			counter= storage_usage.get_storage_usage(db, username) or {}
+			nactive_jobs= active_jobs.count_active_jobs(db, username)
+			account_info= db[username + '.accounting'].find_one({}, projection={'_id': 0, 'job_runtime': 1}) or {}
+		except Exception as e:
+			logger.warn("Failed to read usage counters of user %s from DB (err=%s)!" % (username, str(e)), user=username)
+			return None
+
+		usage= {
+			'time': now,
+			'storage': counter.get('datasize', 0) + counter.get('jobsize', 0),
+			'active_jobs': nactive_jobs,
+			'cpu_hours': account_info.get('job_runtime', 0)/3600.
+		}
+
+		with self.lock:
+			self.cache[username]= usage
+
+		return dict(usage)
+
+	def add_usage(self, username, storage=0, active_jobs=0):
+		""" Apply usage deltas to cached counters (so that they are accounted before cache expires) """
+
+		with self.lock:
+			usage= self.cache.get(username)
+			if usage is None:
+				return
+			usage['storage']+= storage
+			usage['active_jobs']+= active_jobs
+
+	def invalidate(self, username=None):
+		""" Drop cached usage of given user (or of all users) """
+
+		with self.lock:
+			if username is None:
+				self.cache= {}
+			else:
+				self.cache.pop(username, None)
+
+	def check_upload(self, db, username, nbytes, config):
+		""" Check storage quota before uploading nbytes. Return None if allowed or (http status code, response dict) otherwise. """
+
+		max_storage= config.get('QUOTA_MAX_STORAGE', 0)*1024*1024*1024 # GB -> bytes
+		if max_storage<=0:
+			return None
+
+		usage= self.get_usage(db, username)
+		if usage is None:
+			return None # do not block users if counters are not available
+
+		if usage['storage'] + nbytes > max_storage:
+			res= {
+				'status': 'Storage quota exceeded!',
+				'quota': {'storage': max_storage},
+				'usage': {'storage': usage['storage'], 'upload_size': nbytes}
+			}
+			logger.warn("Storage quota exceeded for user %s (usage=%d bytes, upload=%d bytes, quota=%d bytes)!" % (username, usage['storage'], nbytes, max_storage), action="upload", user=username)
+			return HTTP_INSUFFICIENT_STORAGE, res
+
+		return None
+
+	def check_submit(self, db, username, config):
+		""" Check concurrent job, CPU-hour and storage quotas before submitting a job. Return None if allowed or (http status code, response dict) otherwise. """
+
+		max_active_jobs= config.get('QUOTA_MAX_ACTIVE_JOBS', 0)
+		max_cpu_hours= config.get('QUOTA_MAX_CPU_HOURS', 0)
+		max_storage= config.get('QUOTA_MAX_STORAGE', 0)*1024*1024*1024 # GB -> bytes
+		if max_active_jobs<=0 and max_cpu_hours<=0 and max_storage<=0:
+			return None
+
+		usage= self.get_usage(db, username)
+		if usage is None:
+			return None # do not block users if counters are not available
+
+		quota= {}
+		if max_active_jobs>0:
+			quota['active_jobs']= max_active_jobs
+		if max_cpu_hours>0:
+			quota['cpu_hours']= max_cpu_hours
+		if max_storage>0:
+			quota['storage']= max_storage
+		usage_info= {'active_jobs': usage['active_jobs'], 'cpu_hours': usage['cpu_hours'], 'storage': usage['storage']}
+
+		errmsg= ''
+		status_code= HTTP_TOO_MANY_REQUESTS
+		if max_active_jobs>0 and usage['active_jobs']>=max_active_jobs:
+			errmsg= 'Max number of concurrent jobs reached!'
+		elif max_cpu_hours>0 and usage['cpu_hours']>=max_cpu_hours:
+			errmsg= 'CPU hours quota exceeded!'
+		elif max_storage>0 and usage['storage']>=max_storage:
+			errmsg= 'Storage quota exceeded!'
+			status_code= HTTP_INSUFFICIENT_STORAGE
+
+		if errmsg=='':
+			return None
+
+		logger.warn("Job submission rejected for user %s (%s, usage=%s, quota=%s)" % (username, errmsg, str(usage_info), str(quota)), action="submitjob", user=username)
+		res= {
+			'state': 'ABORTED',
+			'status': errmsg,
+			'quota': quota,
+			'usage': usage_info
+		}
+
+		return status_code, res
+
+
+##############################
+#   DEFAULT INSTANCES
+##############################
+quota_manager= QuotaManager()
+
@@ -0,0 +1,104 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   QUERIES
+##############################
+# - Request handling logic shared by the Flask (WSGI) routes and the ASGI front-end
+#   NB: Functions here do not depend on the web framework nor on the DB driver (sync or async)
+
+# - Projections used in file/job list replies
+FILE_LIST_PROJECTION= {"_id":0, "filepath":0, "stats.hist":0}
+JOB_LIST_PROJECTION= {"_id":0}
+
+
+def get_file_query(file_uuid):
+	""" Return DB query of file with given uuid """
+	return {'fileid': str(file_uuid)}
+
+
+def get_job_query(task_id):
+	""" Return DB query of job with given id """
+	return {'job_id': str(task_id)}
+
+
+##############################
+#   REPLIES
+##############################
+def init_job_status_reply(task_id):
+	""" Return job status reply with empty fields """
+
+	res= {}
+	res['job_id']= task_id
+	res['pid']= ''
+	res['state']= ''
+	res['status']= ''
+	res['exit_code']= ''
+	res['elapsed_time']= ''
+	res['tag']= ''
+	res['postproc_state']= ''
+	res['postproc_status']= ''
+
+	return res
+
+
+def make_job_status_reply(task_id, job, username):
+	""" Return (reply dict, http status code) with status of given job document (None if job was not found) """
+
+	res= init_job_status_reply(task_id)
+	if not job or job is None:
+		errmsg= 'Job ' + task_id + ' not found for user ' + username + '!'
+		logger.warn(errmsg, action="jobstatus", user=username)
+		res['status']= errmsg
+		return res, 404
+
+	res['pid']= job['pid']
+	res['state']= job['state']
+	res['status']= job['status']
+	res['exit_code']= job['exit_code']
+	res['elapsed_time']= job['elapsed_time']
+	if 'tag' in job:
+		res['tag']= job['tag']
+	if 'postproc_state' in job:
+		res['postproc_state']= job['postproc_state']
+		res['postproc_status']= job['postproc_status']
+
+	return res, 200
+
+
+def make_file_not_found_reply(file_uuid, username, action="download"):
+	""" Return (reply dict, http status code) for a file not found """
+
+	errmsg= 'File with uuid ' + file_uuid + ' not found on the system!'
+	logger.warn(errmsg, action=action, user=username)
+	return {'status': errmsg}, 404
+
+
+def get_download_filepath(file_uuid, item, username):
+	""" Return (file path, reply dict, http status code) of file to be downloaded from given file document (None if file was not found) """
+
+	file_path= ''
+	if item and item is not None:
+		file_path= item['filepath']
+		logger.info("File with uuid=%s found at path=%s ..." % (file_uuid, file_path), action="download", user=username)
+	else:
+		logger.warn("File with uuid=%s not found in DB!" % file_uuid, action="download", user=username)
+
+	if not file_path or file_path=='':
+		res, status_code= make_file_not_found_reply(file_uuid, username)
+		return '', res, status_code
+
+	return file_path, {'status': ''}, 200
+
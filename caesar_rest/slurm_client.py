@@ -12,11 +12,12 @@ import datetime
 from datetime import datetime, timedelta, timezone
 from dateutil.tz import tzutc
 import logging
-import numpy as np
 import pprint
 
 # - Import additional modules
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import jwt
 from jwt import JWT
 from jwt.jwa import HS256
@@ -51,16 +52,54 @@ class SlurmJobManager(object):
 		self.cluster_datadir= ''
 		self.app_jobdir= ''
 		self.app_datadir= ''
-		self.sleep_before_run= True # to enable job directory to be created in nextcloud
-		self.sleeptime_before_run= 10
+		self.wait_jobdir_before_run= True # wait until job directory is visible in cluster (e.g. created in nextcloud) before running
+		self.jobdir_max_wait= 30 # max time in seconds to wait for job directory
+		self.jobdir_wait_delay= 100 # initial delay in ms between job directory checks (doubled at each check up to 2 s)
+		self.reference_sleeptime_before_run= 10 # fixed sleep formerly done before run (used to compute time saved)
+		self.jobdir_wait_filename= '.jobdir_wait_ms' # file written by job script in job directory with time waited for it (in ms)
 		self.max_cores= 4
 			
 		# - Options read or automatically computed from others
 		self.cluster_url= ''
+		self.accounting_url= ''
 		self.key= ''
 		self.token= '' # JWT token
+		self.token_exp= 0 # token expiration time (unix time)
+		self.token_duration= 3600 # in seconds
+		self.token_renew_margin= 60 # regenerate token when expiring within this time in seconds
 		self.request_timeout= 10
 
+		# - HTTP session options (connection pool & retries)
+		self.pool_connections= 4 # number of host pools to cache
+		self.pool_maxsize= 16 # max number of connections kept alive per host
+		self.max_retries= 3 # retries on connection errors & 502/503/504 replies (no retries of POST once sent)
+		self.retry_backoff= 0.5 # backoff factor in seconds (sleep backoff*2^(nretries-1))
+		self.session= None
+		self.session_pid= None
+
+		# - Job status options & cache
+		self.incremental_status= True # query only jobs changed since last poll
+		self.max_incremental_period= 300 # do a full query if last poll is older than this time in seconds
+		self.update_time_margin= 5 # in seconds, subtracted to last poll time to account for clock skews
+		self.max_pids_per_request= 200 # max number of job pids requested in a single query
+		self.job_state_cache= {} # job pid -> last job status dict
+		self.last_poll_time= 0
+
+		# - Accounting (slurmdbd) options & cache, used for jobs already purged from slurmctld
+		self.accounting_fallback= True
+		self.max_accounting_lookups= 3 # give up resolving a job pid in accounting after this number of successful lookups with job not found
+		self.accounting_state_cache= {} # job pid -> final job status dict
+		self.accounting_lookups= {} # job pid -> number of lookups with job not found
+
+		# - Request stats
+		self.nrequests= 0
+		self.nrequest_errors= 0
+		self.ntoken_renewals= 0
+
+		# - Submission stats (recorded when submitted jobs complete)
+		self.njobs_submitted= 0
+		self.time_saved_before_run= 0. # in seconds, sum over completed jobs
+
 
 	#############################
 	##  CHECK/SET VARS
@@ -69,6 +108,7 @@ class SlurmJobManager(object):
 		""" Set cluster url """
 		
 		self.cluster_url= 'http://' + self.host + ':' + str(self.port) + '/slurm/v0.0.36' 
+		self.accounting_url= 'http://' + self.host + ':' + str(self.port) + '/slurmdb/v0.0.36' 
 
 
 	def check_submit_vars(self):
@@ -133,10 +173,15 @@ class SlurmJobManager(object):
 			return -1
 
 		# - Generate a token
-		if self.generate_token()<0:
+		if self.generate_token(self.token_duration)<0:
 			logger.warn("Failed to generate Slurm JWT token!")
 			return -1
 
+		# - Create HTTP session
+		if self.create_session() is None:
+			logger.warn("Failed to create HTTP session!")
+			return -1
+
 		# ...
 		# ...
 
@@ -193,15 +238,47 @@ class SlurmJobManager(object):
 			return -1
 		else:
 			self.token= jwt_token
+			self.token_exp= expiration_time
 
 		# - Check token
 		if not self.is_token_valid():
 			logger.warn("Generated token is invalid, set to empty string.")
 			self.token= ""
+			self.token_exp= 0
 			return -1
 
+		self.ntoken_renewals+= 1
+
 		return 0
 
+	def get_token(self):
+		""" Return cached token, regenerating it only when missing or about to expire (no decoding at each request). Return None on failure. """
+
+		if self.token and time.time()<self.token_exp-self.token_renew_margin:
+			return self.token
+
+		logger.info("Slurm rest auth token missing or about to expire, regenerating it ...")
+		if self.generate_token(self.token_duration)<0:
+			logger.warn("Failed to regenerate Slurm auth token!")
+			return None
+
+		return self.token
+
+	def get_headers(self):
+		""" Return request headers with auth token. Return None if token cannot be generated. """
+
+		token= self.get_token()
+		if token is None:
+			return None
+
+		headers = {
+			'Content-Type': 'application/json',
+			'X-SLURM-USER-NAME': self.username,
+			'X-SLURM-USER-TOKEN': token,
+		}
+
+		return headers
+
 	def is_token_active(self):
 		""" Check if token is valid and not expired """
 
@@ -283,9 +360,6 @@ class SlurmJobManager(object):
 		tdiff= expiration_date-now
 		tdiff_sec= tdiff.total_seconds()
 
-		print("tdiff")
-		print(tdiff)
-
 		return tdiff_sec
 		
 
@@ -309,6 +383,93 @@ class SlurmJobManager(object):
 
 		return status
 
+	#############################
+	##   HTTP SESSION
+	#############################
+	def create_session(self):
+		""" Create HTTP session with keep-alive connection pool and retry/backoff policy """
+
+		retry= Retry(
+			total=self.max_retries,
+			connect=self.max_retries,
+			read=self.max_retries,
+			status=self.max_retries,
+			backoff_factor=self.retry_backoff,
+			status_forcelist=[502, 503, 504],
+			raise_on_status=False
+		)
+		adapter= HTTPAdapter(
+			pool_connections=self.pool_connections,
+			pool_maxsize=self.pool_maxsize,
+			max_retries=retry
+		)
+
+		try:
+			session= requests.Session()
+			session.mount('http://', adapter)
+			session.mount('https://', adapter)
+		except Exception as e:
+			logger.warn("Failed to create HTTP session (err=%s)!" % str(e))
+			return None
+
+		self.session= session
+		self.session_pid= os.getpid()
+
+		return session
+
+	def get_session(self):
+		""" Return HTTP session, creating a new one in forked processes (connections cannot be shared across processes) """
+
+		if self.session is None or self.session_pid!=os.getpid():
+			return self.create_session()
+		return self.session
+
+	def send_request(self, method, url, **kwargs):
+		""" Send request through pooled session and update request stats """
+
+		session= self.get_session()
+		if session is None:
+			raise requests.ConnectionError("No HTTP session available")
+
+		self.nrequests+= 1
+		try:
+			return session.request(method, url, timeout=self.request_timeout, **kwargs)
+		except Exception:
+			self.nrequest_errors+= 1
+			raise
+
+	def get_pool_stats(self):
+		""" Return HTTP connection pool stats """
+
+		stats= {
+			'nrequests': self.nrequests,
+			'nrequest_errors': self.nrequest_errors,
+			'ntoken_renewals': self.ntoken_renewals,
+			'token_time_left': max(0, self.token_exp-time.time()),
+			'pools': []
+		}
+		if self.session is None:
+			return stats
+
+		for adapter in set(self.session.adapters.values()):
+			pool_manager= getattr(adapter, 'poolmanager', None)
+			if pool_manager is None:
+				continue
+			for key in list(pool_manager.pools.keys()):
+				pool= pool_manager.pools.get(key)
+				if pool is None:
+					continue
+				stats['pools'].append({
+					'host': pool.host,
+					'port': pool.port,
+					'nconnections': pool.num_connections, # connections opened so far
+					'nrequests': pool.num_requests,
+					'nidle': pool.pool.qsize() if pool.pool is not None else 0,
+					'maxsize': pool.pool.maxsize if pool.pool is not None else 0
+				})
+
+		return stats
+
 	#############################
 	##   SUBMIT JOB
 	#############################
@@ -325,20 +486,11 @@ class SlurmJobManager(object):
 		##  }
 		#####################################
 
-		# - Check token is active
-		if not self.is_token_active():
-			logger.warn("Slurm rest auth token not valid or expired, regenerating it ...", action="submitjob")
-			if self.generate_token()<0:
-				logger.warn("Failed to regenerate Slurm auth token, cannot submit job!", action="submitjob")
-				return None
-		 
-
-		# - Set header
-		headers = {
-			'Content-Type': 'application/json',
-			'X-SLURM-USER-NAME': self.username,
-			'X-SLURM-USER-TOKEN': self.token,
-		}
+		# - Set header (with cached auth token)
+		headers= self.get_headers()
+		if headers is None:
+			logger.warn("Failed to get Slurm auth token, cannot submit job!", action="submitjob")
+			return None
 
 		# - Set url
 		url= self.cluster_url + '/job/submit'
@@ -347,14 +499,12 @@ class SlurmJobManager(object):
 		logger.info("Submitting job (data=%s, url=%s) ..." % (job_data, url), action="submitjob")
 		jobout= None
 		try:
-			jobout= requests.post(
+			jobout= self.send_request(
+				'POST',
 				url, 
 				headers=headers, 
-				data=job_data,
-				timeout= self.request_timeout
+				data=job_data
 			)
-			print("--> slurm jobout")
-			print(jobout)
 
 		except requests.Timeout:
 			logger.warn("Failed to submit job to url %s (err=request timeout)" % url, action="submitjob")
@@ -485,8 +635,8 @@ class SlurmJobManager(object):
 		
 		# - Set job script
 		script= "#!/bin/bash \n "
-		if self.sleep_before_run:
-			script+= "".join("sleep %d \n " % self.sleeptime_before_run)
+		if self.wait_jobdir_before_run and job_outdir_cluster!="":
+			script+= self.get_wait_dir_script(job_outdir_cluster)
 		script+= "".join("%s" % cmd)
 		
 		logger.info("Slurm script: %s" % script, action="submitjob")
@@ -529,52 +679,313 @@ class SlurmJobManager(object):
 		return job_data
 
 
+	def get_wait_dir_script(self, dirname):
+		""" Return bash lines waiting (with exponential backoff, up to jobdir_max_wait) for given directory to be visible. Time waited is written to a file in the directory. """
+
+		max_wait_ms= int(self.jobdir_max_wait*1000)
+		delay_ms= max(1, int(self.jobdir_wait_delay))
+		wait_file= os.path.join(dirname, self.jobdir_wait_filename)
+
+		script= ""
+		script+= "waited=0; delay=%d \n " % delay_ms
+		script+= "while [ ! -d \"%s\" ] && [ $waited -lt %d ]; do sleep $(printf '%%d.%%03d' $((delay/1000)) $((delay%%1000))); waited=$((waited+delay)); delay=$((delay*2>2000?2000:delay*2)); done \n " % (dirname, max_wait_ms)
+		script+= "echo \"Waited $waited ms for job directory %s\" \n " % dirname
+		script+= "[ -d \"%s\" ] && echo $waited > \"%s\" \n " % (dirname, wait_file)
+
+		return script
+
+
+	def read_jobdir_wait_time(self, job_dir, remove=True):
+		""" Return time (in seconds) the job script waited for given job directory, as written in job directory by the job script (None if not available) """
+
+		wait_file= os.path.join(job_dir, self.jobdir_wait_filename)
+		if not os.path.isfile(wait_file):
+			return None
+
+		wait_time= None
+		try:
+			with open(wait_file, 'r') as f:
+				wait_time= float(f.read().strip())/1000.
+			if remove:
+				os.remove(wait_file)
+		except Exception as e:
+			logger.warn("Failed to read job directory wait time from file %s (err=%s)!" % (wait_file, str(e)), action="jobstatus")
+			return None
+
+		return wait_time
+
+
+	def record_time_saved(self, wait_time, sync_time=0.):
+		""" Record time saved wrt fixed sleep before run for a completed job, given the time the job script waited for the job directory and the time spent syncing it before submission. Return time saved in seconds. """
+
+		time_saved= max(0., self.reference_sleeptime_before_run - max(0., wait_time) - max(0., sync_time))
+		self.njobs_submitted+= 1
+		self.time_saved_before_run+= time_saved
+
+		return time_saved
+
+
+	def get_submit_stats(self):
+		""" Return job submission stats """
+
+		return {
+			'njobs_submitted': self.njobs_submitted,
+			'time_saved_before_run': self.time_saved_before_run,
+			'time_saved_before_run_mean': self.time_saved_before_run/self.njobs_submitted if self.njobs_submitted>0 else 0.
+		}
+
+
 	#============================
 	#==     GET JOB STATUS
 	#============================
-	def get_job_statuses(self, job_pids):
-		""" Retrieve job status for selected list of jobs """
+	def get_job_statuses(self, job_pids, incremental=None):
+		""" Retrieve job status for selected list of jobs. In incremental mode only jobs changed since last poll are requested, the others are taken from cache. """
 	
 		# - Check pid list
 		if not job_pids or job_pids is None:
 			logger.warn("Given input list of job pids is empty or None!")
 			return None
 
-		# - Check token is active
-		if not self.is_token_active():
-			logger.warn("Slurm rest auth token not valid or expired, regenerating it ...", action="jobstatus")
-			if self.generate_token()<0:
-				logger.warn("Failed to regenerate Slurm auth token, cannot submit job!", action="jobstatus")
-				return None
-		 
-		# - Set header
-		headers = {
-			'Content-Type': 'application/json',
-			'X-SLURM-USER-NAME': self.username,
-			'X-SLURM-USER-TOKEN': self.token,
-		}
+		if incremental is None:
+			incremental= self.incremental_status
+		job_pids= [str(job_pid) for job_pid in job_pids]
+
+		# - Get jobs changed since last successful poll
+		#   NB: Full query is done the first time and when the last poll is too old (finished jobs may have been purged in the meantime)
+		#   NB: slurmctld replies to update_time queries with nothing (no change in the whole job table since given time) or with all jobs,
+		#       so pid filter is kept on incremental queries to avoid receiving the whole cluster job table at each change
+		poll_time= time.time()
+		last_poll_time= self.last_poll_time
+		changed_pids= set()
+		cached_pids= []
+		missing_pids= job_pids
+
+		if incremental and last_poll_time>0 and poll_time-last_poll_time<self.max_incremental_period:
+			cached_pids= [job_pid for job_pid in job_pids if job_pid in self.job_state_cache]
+			missing_pids= [job_pid for job_pid in job_pids if job_pid not in self.job_state_cache]
+
+		update_time= int(last_poll_time - self.update_time_margin)
+		nunchanged_chunks= 0
+		for index in range(0, len(cached_pids), self.max_pids_per_request):
+			chunk= cached_pids[index:index+self.max_pids_per_request]
+			job_objs= self.query_jobs({"update_time": update_time, "job_name": ','.join(chunk)})
+			if job_objs is None:
+				logger.warn("Failed to query Slurm jobs changed since last poll, querying them by pid ...", action="jobstatus")
+				missing_pids.extend(chunk)
+				continue
+			if not job_objs:
+				nunchanged_chunks+= 1
+				continue
+			changed_pids.update(self.update_job_state_cache(chunk, job_objs))
+
+		if cached_pids:
+			logger.info("#%d/%d job chunks unchanged since last poll, #%d jobs updated, #%d/%d given jobs not in cache ..." % (nunchanged_chunks, (len(cached_pids)+self.max_pids_per_request-1)//self.max_pids_per_request, len(changed_pids), len(missing_pids), len(job_pids)), action="jobstatus")
+
+		# - Query jobs not in cache by pid, in chunks of bounded size
+		nfailed_chunks= 0
+		for index in range(0, len(missing_pids), self.max_pids_per_request):
+			chunk= missing_pids[index:index+self.max_pids_per_request]
+			job_objs= self.query_jobs({"job_name": ','.join(chunk)})
+			if job_objs is None:
+				nfailed_chunks+= 1
+				continue
+			changed_pids.update(self.update_job_state_cache(chunk, job_objs))
+
+		if missing_pids and nfailed_chunks*self.max_pids_per_request>=len(missing_pids):
+			logger.warn("All job status queries failed, cannot get job status!", action="jobstatus")
+			return None
 
-		# - Set url
-		url= self.cluster_url + '/jobs'
+		# - Set poll time only if no query failed (otherwise next poll repeats missed updates)
+		if nfailed_chunks==0:
+			self.last_poll_time= poll_time
 
-		# - Set request parameters
-		job_pids_str= ','.join(map(str, job_pids)) 
-		params= {
-			"job_name": job_pids_str
-		}
+		# - Get status of given jobs from cache, dropping entries of jobs no more tracked
+		resdict= {}
+		for job_pid in job_pids:
+			if job_pid in self.job_state_cache:
+				resdict[job_pid]= self.job_state_cache[job_pid]
+
+		tracked_pids= set(job_pids)
+		for cache in [self.job_state_cache, self.accounting_state_cache, self.accounting_lookups]:
+			for job_pid in list(cache.keys()):
+				if job_pid not in tracked_pids:
+					del cache[job_pid]
+
+		if not resdict:
+			logger.warn("Empty job status list reply, jobs not found or already cleared in Slurm", action="jobstatus")
+			return {}
+
+		if len(resdict)!=len(job_pids):
+			logger.warn("Retrieved job status has size different wrt given job pids (possibly some jobs have not been found because already cleared) ...", action="jobstatus")
+
+		return resdict
+
+
+	def update_job_state_cache(self, chunk, job_objs):
+		""" Update job state cache with jobs of given pid chunk found in reply. Jobs of the chunk missing in the reply are removed from cache (no more known by slurmctld). Return the set of updated pids. """
+
+		chunk_pids= set(chunk)
+		updated_pids= set()
+		for job_obj in job_objs:
+			res= self.get_job_state_data_from_slurm_obj(job_obj)
+			job_pid= str(res['pid'])
+			if job_pid not in chunk_pids:
+				continue
+			updated_pids.add(job_pid)
+			self.job_state_cache[job_pid]= res
+
+		for job_pid in chunk_pids-updated_pids:
+			self.job_state_cache.pop(job_pid, None)
+
+		return updated_pids
+
+
+	def reset_job_status_cache(self):
+		""" Clear job status cache, forcing a full query at next poll """
+
+		self.job_state_cache= {}
+		self.last_poll_time= 0
+		self.accounting_state_cache= {}
+		self.accounting_lookups= {}
+
+
+	def get_accounting_job_statuses(self, job_pids):
+		""" Retrieve final status of jobs no more known by slurmctld from Slurm accounting (slurmdbd), querying jobs in chunks. Resolved jobs are cached and never queried again. Return a dict indexed by pid or None if all queries failed. """
+
+		if not self.accounting_fallback:
+			return {}
+
+		# - Take jobs already resolved from cache and skip jobs not found too many times
+		resdict= {}
+		query_pids= []
+		for job_pid in job_pids:
+			job_pid= str(job_pid)
+			if job_pid in self.accounting_state_cache:
+				resdict[job_pid]= self.accounting_state_cache[job_pid]
+			elif self.accounting_lookups.get(job_pid, 0)<self.max_accounting_lookups:
+				query_pids.append(job_pid)
+
+		if not query_pids:
+			return resdict
+
+		# - Query accounting in chunks of bounded size
+		#   NB: step param accepts a list of job ids (whole jobs are returned)
+		logger.info("Retrieving final status of #%d jobs from Slurm accounting (#%d already resolved) ..." % (len(query_pids), len(resdict)), action="jobstatus")
+		nfailed_chunks= 0
+		for index in range(0, len(query_pids), self.max_pids_per_request):
+			chunk= query_pids[index:index+self.max_pids_per_request]
+			job_objs= self.query_jobs({"step": ','.join(chunk)}, url=self.accounting_url + '/jobs')
+			if job_objs is None:
+				nfailed_chunks+= 1 # failed lookups are not counted (e.g. slurmdbd not available)
+				continue
+
+			chunk_pids= set(chunk)
+			found_pids= set()
+			for job_obj in job_objs:
+				res= self.get_job_state_data_from_slurmdb_obj(job_obj)
+				job_pid= str(res['pid'])
+				if job_pid not in chunk_pids:
+					continue
+				found_pids.add(job_pid)
+
+				# - Cache only final states (accounting may lag behind slurmctld)
+				if res['state'] in ['PENDING', 'RUNNING', 'UNKNOWN']:
+					logger.info("Job %s found in Slurm accounting in non-final state %s, will retry later ..." % (job_pid, res['state']), action="jobstatus")
+					continue
+				self.accounting_state_cache[job_pid]= res
+				self.accounting_lookups.pop(job_pid, None)
+				resdict[job_pid]= res
+
+			# - Count lookups only for jobs not found in a successful reply (jobs found in non-final state are searched again)
+			for job_pid in chunk:
+				if job_pid not in found_pids:
+					self.accounting_lookups[job_pid]= self.accounting_lookups.get(job_pid, 0) + 1
+
+		if nfailed_chunks*self.max_pids_per_request>=len(query_pids) and not resdict:
+			logger.warn("All Slurm accounting queries failed, cannot get final job status!", action="jobstatus")
+			return None
+
+		return resdict
+
+
+	def is_accounting_lookup_pending(self, job_pid):
+		""" Check if given job pid, not yet resolved, will be searched again in accounting (at most max_accounting_lookups times) """
+
+		if not self.accounting_fallback:
+			return False
+		job_pid= str(job_pid)
+		if job_pid in self.accounting_state_cache:
+			return False
+
+		return self.accounting_lookups.get(job_pid, 0)<self.max_accounting_lookups
+
+
+	def get_job_state_data_from_slurmdb_obj(self, job_obj):
+		""" Set job state data from Slurm accounting job object """
+
+		# - Init data
+		res= {}
+		res['pid']= ''
+		res['state']= ''
+		res['status']= ''
+		res['exit_code']= ''
+		res['elapsed_time']= ''
+
+		# - Check obj
+		if job_obj is None or not job_obj:
+			logger.warn("Given slurmdb job object is empty or None...")
+			return res
+
+		# - Get job id
+		res['pid']= job_obj.get("job_id", '')
+
+		# - Map state (current state is nested in accounting records)
+		job_state= job_obj.get("state", {})
+		if isinstance(job_state, dict):
+			job_state= job_state.get("current", '')
+		mapped_state= self.get_job_state_from_slurm_state(str(job_state))
+		res['state']= mapped_state[0]
+		res['status']= mapped_state[1]
+
+		# - Get elapsed time
+		job_time= job_obj.get("time", {})
+		if "elapsed" in job_time:
+			res['elapsed_time']= job_time["elapsed"]
+		elif "start" in job_time and "end" in job_time:
+			res['elapsed_time']= job_time["end"]-job_time["start"]
+
+		# - Get exit code
+		exit_code= job_obj.get("exit_code", '')
+		if isinstance(exit_code, dict):
+			exit_code= exit_code.get("return_code", '')
+		res['exit_code']= exit_code
+
+		return res
+
+
+	def query_jobs(self, params, url=None):
+		""" Query /jobs endpoint (of slurmctld by default) with given parameters. Return list of Slurm job objects or None on failure. """
+
+		# - Set header (with cached auth token)
+		headers= self.get_headers()
+		if headers is None:
+			logger.warn("Failed to get Slurm auth token, cannot send request!", action="jobstatus")
+			return None
+
+		# - Set url
+		if url is None:
+			url= self.cluster_url + '/jobs'
 
 		# - Get job statuses
-		logger.info("Retrieving job statuses (pids=%s, url=%s) ..." % (job_pids_str, url), action="jobstatus")
+		logger.debug("Retrieving job statuses (params=%s, url=%s) ..." % (str(params), url), action="jobstatus")
 		jobout= None
 		try:
-			jobout= requests.get(
+			jobout= self.send_request(
+				'GET',
 				url, 
 				headers=headers,
-				params= params,
-				timeout= self.request_timeout 
+				params= params
 			)
-			#print("--> slurm jobout")
-			#print(jobout)
 
 		except requests.Timeout:
 			logger.warn("Failed to query job status to url %s (err=request timeout)" % url, action="jobstatus")
@@ -588,66 +999,47 @@ class SlurmJobManager(object):
 			logger.warn("Failed to query job status to url %s (err=%s)" % (url,str(e)), action="jobstatus")
 			return None
 
+		if jobout.status_code!=200:
+			logger.warn("Failed to query job status to url %s (err=server replied with status code %d)" % (url, jobout.status_code), action="jobstatus")
+			return None
+
 		# - Parse reply and convert to dictionary
 		reply= None
 		try:
-			reply= json.loads(jobout.text)
+			reply= jobout.json()
 		except Exception as e:
 			logger.warn("Failed to convert reply to dict (err=%s)!" % str(e), action="jobstatus")
 			return None
 
-		job_objs= reply["jobs"]
-		if not job_objs:
-			logger.warn("Empty job status list reply, jobs not found or already cleared in Slurm", action="jobstatus")
-			return {}
-
-		if len(job_objs)!=len(job_pids):
-			logger.warn("Retrieved job status has size different wrt given job pids (possibly some jobs have not been found because already cleared) ...")
-
-		# - Loop over job objs and get data
-		resdict= {}
-		for job_obj in job_objs:
-			res= self.get_job_state_data_from_slurm_obj(job_obj)
-			print("res")
-			print(res)
-			job_pid= str(res['pid'])
-			resdict[job_pid]= res
+		if "jobs" not in reply:
+			logger.warn("No jobs field in reply!", action="jobstatus")
+			return None
 
-		return resdict
+		return reply["jobs"]
 		
 		
 
 	def get_job_status(self, job_pid):
 		""" Retrieve job status """
 
-		# - Check token is active
-		if not self.is_token_active():
-			logger.warn("Slurm rest auth token not valid or expired, regenerating it ...", action="jobstatus")
-			if self.generate_token()<0:
-				logger.warn("Failed to regenerate Slurm auth token, cannot submit job!", action="jobstatus")
-				return None
-		 
-		# - Set header
-		headers = {
-			'Content-Type': 'application/json',
-			'X-SLURM-USER-NAME': self.username,
-			'X-SLURM-USER-TOKEN': self.token,
-		}
+		# - Set header (with cached auth token)
+		headers= self.get_headers()
+		if headers is None:
+			logger.warn("Failed to get Slurm auth token, cannot send request!", action="jobstatus")
+			return None
 
 		# - Set url
 		url= self.cluster_url + '/job/' + job_pid
 
 		# - Get job status
-		logger.info("Retrieving job status (pid=%s, url=%s) ..." % (job_pid, url), action="jobstatus")
+		logger.debug("Retrieving job status (pid=%s, url=%s) ..." % (job_pid, url), action="jobstatus")
 		jobout= None
 		try:
-			jobout= requests.get(
+			jobout= self.send_request(
+				'GET',
 				url, 
-				headers=headers,
-				timeout= self.request_timeout 
+				headers=headers
 			)
-			print("--> slurm jobout")
-			print(jobout)
 
 		except requests.Timeout:
 			logger.warn("Failed to query job status to url %s (err=request timeout)" % url, action="jobstatus")
@@ -771,19 +1163,11 @@ class SlurmJobManager(object):
 	def delete_job(self, job_pid):
 		""" Cancel a job """
 		
-		# - Check token is active
-		if not self.is_token_active():
-			logger.warn("Slurm rest auth token not valid or expired, regenerating it ...", action="canceljob")
-			if self.generate_token()<0:
-				logger.warn("Failed to regenerate Slurm auth token, cannot submit job!", action="canceljob")
-				return None
-		 
-		# - Set header
-		headers = {
-			'Content-Type': 'application/json',
-			'X-SLURM-USER-NAME': self.username,
-			'X-SLURM-USER-TOKEN': self.token,
-		}
+		# - Set header (with cached auth token)
+		headers= self.get_headers()
+		if headers is None:
+			logger.warn("Failed to get Slurm auth token, cannot send request!", action="canceljob")
+			return None
 
 		# - Set url
 		url= self.cluster_url + '/job/' + job_pid
@@ -791,14 +1175,11 @@ class SlurmJobManager(object):
 		logger.info("Deleting job with pid=%s ..." % job_pid, action="canceljob")
 		status_code= 0
 		try:
-			reply= requests.delete(
+			reply= self.send_request(
+				'DELETE',
 				url, 
-				headers=headers, 
-				timeout= self.request_timeout
+				headers=headers
 			)
-			print("--> slurm reply to delete")
-			print(reply)
-
 			status_code= reply.status_code	
 
 		except requests.Timeout:
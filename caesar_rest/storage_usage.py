@@ -0,0 +1,246 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir # python2 backport
+	except ImportError:
+		scandir= None # fallback to listdir+lstat
+
+try:
+	from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+	ThreadPoolExecutor= None # python2 without futures backport: run serially
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   STORAGE USAGE COUNTERS
+##############################
+# - Global collection holding one document per user with storage usage counters (in bytes):
+#     {'_id': <username>, 'datasize': <bytes>, 'jobsize': <bytes>, 'datasize_inc': <bytes>, 'jobsize_inc': <bytes>, ...}
+#   NB: Counters are updated with deltas by upload/delete/job completion paths and periodically
+#       reset to the actual usage by the reconciler. *_inc fields sum all deltas ever applied and are
+#       used by the reconciler to keep deltas applied while scanning the storage.
+STORAGE_USAGE_COLLECTION= 'storage_usage'
+
+# - Storage areas tracked per user
+STORAGE_AREAS= ['datasize', 'jobsize']
+
+# - Default number of threads used by reconciler to walk directories
+RECONCILE_NTHREADS= 8
+
+
+def add_storage_usage(db, username, datasize=0, jobsize=0):
+	""" Apply storage usage deltas (in bytes) to user counters """
+
+	if db is None:
+		return -1
+	if datasize==0 and jobsize==0:
+		return 0
+
+	inc= {}
+	if datasize!=0:
+		inc['datasize']= datasize
+		inc['datasize_inc']= datasize
+	if jobsize!=0:
+		inc['jobsize']= jobsize
+		inc['jobsize_inc']= jobsize
+
+	try:
+		db[STORAGE_USAGE_COLLECTION].update_one(
+			{'_id': username},
+			{'$inc': inc, '$set': {'update_date': datetime.datetime.utcnow()}},
+			upsert=True
+		)
+	except Exception as e:
+		logger.warn("Failed to update storage usage counters of user %s (err=%s)!" % (username, str(e)))
+		return -1
+
+	return 0
+
+
+def get_storage_usage(db, username):
+	""" Return storage usage counters of given user (None if not found or on failure) """
+
+	try:
+		return db[STORAGE_USAGE_COLLECTION].find_one({'_id': username})
+	except Exception as e:
+		logger.warn("Failed to get storage usage counters of user %s (err=%s)!" % (username, str(e)))
+		return None
+
+
+def get_all_storage_usage(db):
+	""" Return storage usage counters of all users as a dict indexed by username (None on failure) """
+
+	try:
+		return dict((item['_id'], item) for item in db[STORAGE_USAGE_COLLECTION].find({}))
+	except Exception as e:
+		logger.warn("Failed to get storage usage counters (err=%s)!" % str(e))
+		return None
+
+
+##############################
+#   DIRECTORY WALKER
+##############################
+def list_dir_entries(dirname):
+	""" Return list of (path, is_dir, size) for entries of given directory (symlinks are not followed) """
+
+	entries= []
+	if scandir is not None:
+		it= scandir(dirname)
+		try:
+			for entry in it:
+				if entry.is_dir(follow_symlinks=False):
+					entries.append((entry.path, True, 0))
+				else:
+					entries.append((entry.path, False, entry.stat(follow_symlinks=False).st_size))
+		finally:
+			if hasattr(it, 'close'):
+				it.close()
+		return entries
+
+	for name in os.listdir(dirname):
+		path= os.path.join(dirname, name)
+		st= os.lstat(path)
+		if os.path.isdir(path) and not os.path.islink(path):
+			entries.append((path, True, 0))
+		else:
+			entries.append((path, False, st.st_size))
+
+	return entries
+
+
+def get_dir_size(dirname):
+	""" Return total size in bytes of files in directory tree (unreadable entries are skipped) """
+
+	size= 0
+	stack= [dirname]
+	while stack:
+		path= stack.pop()
+		try:
+			entries= list_dir_entries(path)
+		except OSError as e:
+			logger.debug("Failed to scan directory %s (err=%s), skipping it ..." % (path, str(e)))
+			continue
+		for entry_path, is_dir, entry_size in entries:
+			if is_dir:
+				stack.append(entry_path)
+			else:
+				size+= entry_size
+
+	return size
+
+
+def get_user_dir_sizes(top_dir, nthreads=RECONCILE_NTHREADS):
+	""" Return dict with size in bytes of each user directory under given top dir. Subdirectories of all users are walked in parallel. Return None if top dir cannot be read. """
+
+	try:
+		users= [name for name in os.listdir(top_dir) if os.path.isdir(os.path.join(top_dir, name))]
+	except OSError as e:
+		logger.warn("Cannot list directory %s (err=%s)!" % (top_dir, str(e)))
+		return None
+
+	# - Sum top-level files and collect first-level subdirectories (e.g. job dirs) to be walked
+	sizes= {}
+	tasks= [] # (username, subdir)
+	for user in users:
+		sizes[user]= 0
+		try:
+			entries= list_dir_entries(os.path.join(top_dir, user))
+		except OSError as e:
+			logger.warn("Failed to scan directory of user %s (err=%s)!" % (user, str(e)))
+			continue
+		for entry_path, is_dir, entry_size in entries:
+			if is_dir:
+				tasks.append((user, entry_path))
+			else:
+				sizes[user]+= entry_size
+
+	# - Walk subdirectories in parallel
+	subdirs= [subdir for user, subdir in tasks]
+	if ThreadPoolExecutor is None or nthreads<=1 or len(subdirs)<=1:
+		subdir_sizes= [get_dir_size(subdir) for subdir in subdirs]
+	else:
+		executor= ThreadPoolExecutor(max_workers=nthreads)
+		try:
+			subdir_sizes= list(executor.map(get_dir_size, subdirs))
+		finally:
+			executor.shutdown(wait=True)
+
+	for (user, subdir), subdir_size in zip(tasks, subdir_sizes):
+		sizes[user]+= subdir_size
+
+	return sizes
+
+
+##############################
+#   RECONCILER
+##############################
+def reconcile_storage_usage(db, job_dir, data_dir, nthreads=RECONCILE_NTHREADS):
+	""" Rescan job and data directories and reset user storage usage counters to the actual usage. Deltas applied while scanning are kept. """
+
+	if db is None:
+		return -1
+
+	logger.info("Reconciling storage usage counters (jobdir=%s, datadir=%s, nthreads=%d) ..." % (job_dir, data_dir, nthreads), action="accounter")
+	t0= time.time()
+	collection= db[STORAGE_USAGE_COLLECTION]
+
+	# - Get deltas applied before scan
+	counters= get_all_storage_usage(db)
+	if counters is None:
+		return -1
+
+	# - Scan storage
+	scanned= {}
+	for field, top_dir in [('jobsize', job_dir), ('datasize', data_dir)]:
+		if top_dir is None or top_dir=="":
+			continue
+		sizes= get_user_dir_sizes(top_dir, nthreads)
+		if sizes is None:
+			logger.warn("Failed to scan %s, storage usage counters not reconciled!" % top_dir, action="accounter")
+			return -1
+		for user, size in sizes.items():
+			scanned.setdefault(user, {})[field]= size
+
+	# - Reset counters adding deltas applied while scanning
+	#   NB: Users having counters but no more directories on storage are reset to 0
+	now= datetime.datetime.utcnow()
+	usernames= set(scanned.keys()) | set(counters.keys())
+	nerrors= 0
+	for username in usernames:
+		counter= counters.get(username, {})
+		sizes= scanned.get(username, {})
+		update_fields= {'reconcile_date': now, 'update_date': now}
+		for field in STORAGE_AREAS:
+			inc_field= field + '_inc'
+			inc0= counter.get(inc_field, 0)
+			update_fields[field]= {'$add': [sizes.get(field, 0), {'$subtract': [{'$ifNull': ['$' + inc_field, 0]}, inc0]}]}
+			if field in counter:
+				drift= counter[field]-sizes.get(field, 0)
+				if drift!=0:
+					logger.info("User %s %s counter drift=%d bytes ..." % (username, field, drift), action="accounter", user=username)
+
+		try:
+			collection.update_one({'_id': username}, [{'$set': update_fields}], upsert=True)
+		except Exception as e:
+			logger.warn("Failed to reconcile storage usage counters of user %s (err=%s)!" % (username, str(e)), action="accounter", user=username)
+			nerrors+= 1
+
+	logger.info("Storage usage counters of #%d users reconciled in %.1f s (#%d errors) ..." % (len(usernames), time.time()-t0, nerrors), action="accounter")
+
+	return 0 if nerrors==0 else -1
+
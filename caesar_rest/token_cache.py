@@ -0,0 +1,247 @@
+##############################
+#   MODULE IMPORTS
+##############################
+# Import standard modules
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Import requests
+import requests
+
+# Import jwt modules
+from jwt import JWT
+from jwt.jwk import jwk_from_dict
+from jwt.utils import b64decode
+
+# Get logger
+#logger = logging.getLogger(__name__)
+from caesar_rest import logger
+
+##############################
+#   TOKEN CACHE OPTIONS
+##############################
+# - Default max number of validated tokens kept in cache
+TOKEN_CACHE_SIZE= 1024
+
+# - Time (in seconds) a validated token without exp claim is kept in cache
+TOKEN_CACHE_DEFAULT_TTL= 60
+
+# - Signing algorithms accepted in local JWT verification
+JWKS_ALLOWED_ALGS= set(['RS256', 'RS384', 'RS512'])
+
+# - Time (in seconds) after which JWKS keys are fetched again
+JWKS_REFRESH_PERIOD= 3600
+
+# - Min time (in seconds) between two JWKS fetch attempts (triggered by unknown key ids, expired or failed fetches)
+JWKS_MIN_REFRESH_PERIOD= 60
+
+
+##############################
+#   TOKEN CACHE
+##############################
+class TokenCache(object):
+	""" Bounded LRU cache of validated token info, keyed by token hash and expiring at token exp. Shared by all threads of the process. """
+
+	def __init__(self, maxsize=TOKEN_CACHE_SIZE, default_ttl=TOKEN_CACHE_DEFAULT_TTL):
+
+		self.maxsize= maxsize
+		self.default_ttl= default_ttl
+		self.lock= threading.Lock()
+		self.cache= OrderedDict() # token hash -> (token info, expire time)
+		self.nhits= 0
+		self.nmisses= 0
+
+	@staticmethod
+	def get_key(token):
+		""" Return cache key of token (tokens are never stored in clear) """
+
+		if not isinstance(token, bytes):
+			token= token.encode('utf-8')
+		return hashlib.sha256(token).hexdigest()
+
+	def get(self, token):
+		""" Return cached token info (None if not found or expired) """
+
+		key= self.get_key(token)
+		now= time.time()
+		with self.lock:
+			entry= self.cache.get(key)
+			if entry is None:
+				self.nmisses+= 1
+				return None
+			token_info, expire_time= entry
+			if now>=expire_time:
+				del self.cache[key]
+				self.nmisses+= 1
+				return None
+			self.cache.pop(key)
+			self.cache[key]= entry # move to end (most recently used)
+			self.nhits+= 1
+
+		return token_info
+
+	def put(self, token, token_info):
+		""" Add validated token info to cache, expiring at token exp claim """
+
+		if self.maxsize<=0 or not token_info:
+			return
+
+		now= time.time()
+		try:
+			expire_time= float(token_info.get('exp', now + self.default_ttl))
+		except (TypeError, ValueError):
+			expire_time= now + self.default_ttl
+		if expire_time<=now:
+			return
+
+		key= self.get_key(token)
+		with self.lock:
+			self.cache.pop(key, None)
+			self.cache[key]= (token_info, expire_time)
+			while len(self.cache)>self.maxsize:
+				self.cache.popitem(last=False)
+
+	def clear(self):
+		""" Remove all cached tokens """
+
+		with self.lock:
+			self.cache.clear()
+
+	def get_stats(self):
+		""" Return cache stats """
+
+		with self.lock:
+			return {
+				'size': len(self.cache),
+				'maxsize': self.maxsize,
+				'nhits': self.nhits,
+				'nmisses': self.nmisses
+			}
+
+
+##############################
+#   JWKS VERIFIER
+##############################
+class JWKSVerifier(object):
+	""" Verify JWT access tokens locally against signing keys fetched from the identity provider JWKS endpoint """
+
+	def __init__(self):
+
+		self.issuer= '' # Token issuer, e.g. https://host/auth/realms/neanias-development
+		self.jwks_uri= '' # If empty, discovered from issuer openid configuration
+		self.timeout= 10
+		self.lock= threading.Lock()
+		self.keys= {} # kid -> jwk
+		self.fetch_time= 0 # time of last successful fetch
+		self.attempt_time= 0 # time of last fetch attempt (successful or not)
+		self.jwt= JWT()
+
+	def discover_jwks_uri(self):
+		""" Get JWKS uri from issuer openid configuration """
+
+		if self.issuer is None or self.issuer=="":
+			logger.warn("No issuer given, cannot discover JWKS uri!")
+			return ''
+
+		url= self.issuer.rstrip('/') + '/.well-known/openid-configuration'
+		try:
+			r= requests.get(url, timeout=self.timeout)
+			r.raise_for_status()
+			return r.json().get('jwks_uri', '')
+		except Exception as e:
+			logger.warn("Failed to get openid configuration from url %s (err=%s)!" % (url, str(e)))
+			return ''
+
+	def fetch_keys(self):
+		""" Fetch signing keys from JWKS endpoint. Return 0 on success, -1 otherwise (previously fetched keys are kept). """
+
+		self.attempt_time= time.time()
+
+		if self.jwks_uri is None or self.jwks_uri=="":
+			self.jwks_uri= self.discover_jwks_uri()
+			if self.jwks_uri=="":
+				return -1
+
+		try:
+			r= requests.get(self.jwks_uri, timeout=self.timeout)
+			r.raise_for_status()
+			jwks= r.json()
+		except Exception as e:
+			logger.warn("Failed to get JWKS keys from url %s (err=%s)!" % (self.jwks_uri, str(e)))
+			return -1
+
+		keys= {}
+		for key_dict in jwks.get('keys', []):
+			if key_dict.get('use', 'sig')!='sig' or 'kid' not in key_dict:
+				continue
+			try:
+				keys[key_dict['kid']]= jwk_from_dict(key_dict)
+			except Exception as e:
+				logger.warn("Failed to load JWKS key %s (err=%s), skipping it ..." % (key_dict['kid'], str(e)))
+
+		logger.info("#%d JWKS signing keys fetched from url %s ..." % (len(keys), self.jwks_uri))
+		self.keys= keys
+		self.fetch_time= time.time()
+
+		return 0
+
+	def get_key(self, kid):
+		""" Return signing key with given id, fetching keys again if expired or if the key id is unknown (e.g. after key rotation). Fetch attempts are done at most once per JWKS_MIN_REFRESH_PERIOD, so that cached keys are served without blocking requests while the identity provider is down. """
+
+		with self.lock:
+			now= time.time()
+			if now-self.attempt_time>JWKS_MIN_REFRESH_PERIOD:
+				if now-self.fetch_time>JWKS_REFRESH_PERIOD or kid not in self.keys:
+					self.fetch_keys()
+			return self.keys.get(kid)
+
+	def verify(self, token):
+		""" Verify token signature, time claims and issuer. Return token info (with active=True as in introspection replies) or None if invalid. """
+
+		try:
+			header= json.loads(b64decode(token.split('.')[0]).decode('utf-8'))
+		except Exception as e:
+			logger.debug("Failed to decode token header (err=%s)!" % str(e))
+			return None
+
+		alg= header.get('alg', '')
+		kid= header.get('kid', '')
+		if alg not in JWKS_ALLOWED_ALGS:
+			logger.warn("Token signing algorithm %s not allowed!" % alg)
+			return None
+
+		key= self.get_key(kid)
+		if key is None:
+			logger.warn("No JWKS signing key found for token (kid=%s)!" % kid)
+			return None
+
+		try:
+			token_info= self.jwt.decode(token, key, do_verify=True, algorithms=set([alg]), do_time_check=True)
+		except Exception as e:
+			logger.debug("Token verification failed (err=%s)!" % str(e))
+			return None
+
+		if self.issuer and token_info.get('iss', '')!=self.issuer:
+			logger.warn("Token issuer %s does not match expected issuer %s!" % (token_info.get('iss', ''), self.issuer))
+			return None
+		if token_info.get('typ', 'Bearer')!='Bearer':
+			logger.warn("Token is not a Bearer access token (typ=%s)!" % token_info.get('typ', ''))
+			return None
+
+		token_info['active']= True
+
+		return token_info
+
+
+##############################
+#   DEFAULT INSTANCES
+##############################
+token_cache= TokenCache()
+jwks_verifier= JWKSVerifier()
+
@@ -8,7 +8,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import uuid
 
 try:
@@ -29,9 +28,13 @@ from werkzeug.utils import secure_filename
 from caesar_rest import oidc
 from caesar_rest import utils
 from caesar_rest.decorators import custom_require_login
+from caesar_rest.identity import get_identity
 #from caesar_rest import db
 #from caesar_rest.data_model import DataFile #, DataCollection 
 from caesar_rest import mongo
+from caesar_rest import img_stats
+from caesar_rest import storage_usage
+from caesar_rest.quotas import quota_manager
 
 # Get logger
 #logger = logging.getLogger(__name__)
@@ -54,10 +57,8 @@ def upload_file():
 	""" Upload image """
 
 	# - Get aai info
-	username= 'anonymous'
-	if ('oidc_token_info' in g) and (g.oidc_token_info is not None and 'email' in g.oidc_token_info):
-		email= g.oidc_token_info['email']
-		username= utils.sanitize_username(email)
+	identity= get_identity()
+	username= identity.username
 		
 
 	# - Init response
@@ -72,8 +73,15 @@ def upload_file():
 		'status': ''
 	}
 	
+	# - Check storage quota (before request body is parsed, using declared content length)
+	quota_check= quota_manager.check_upload(mongo.db, username, request.content_length or 0, current_app.config)
+	if quota_check is not None:
+		status_code, quota_res= quota_check
+		res.update(quota_res)
+		return make_response(jsonify(res),status_code)
+
 	# - Check for file
-	logger.info("Checking for file key in request ...")
+	logger.debug("Checking for file key in request ...")
 	if 'file' not in request.files:
 		errmsg= "Missing file field in request!"
 		flash(errmsg)
@@ -120,7 +128,7 @@ def upload_file():
 		logger.warn("form not present in request...", action="upload", user=username)
 
 	# - Create username directory if not existing before
-	logger.info("Creating username directory if not existing before ...", action="upload", user=username)
+	logger.debug("Creating username directory if not existing before ...", action="upload", user=username)
 	try: 
 		os.makedirs(filename_dest_dir)
 	except OSError:
@@ -136,10 +144,15 @@ def upload_file():
 	f.save(filename_dest_fullpath)
 	flash('File successfully uploaded')
 
+	# - Update user storage usage counters
+	file_nbytes= os.path.getsize(filename_dest_fullpath)
+	storage_usage.add_storage_usage(mongo.db, username, datasize=file_nbytes)
+	quota_manager.add_usage(username, storage=file_nbytes)
+
 	# - Set file info
 	now = datetime.datetime.now()
 	file_upload_date= now.isoformat()
-	file_size= os.path.getsize(filename_dest_fullpath)/(1024.*1024.) # in MB
+	file_size= file_nbytes/(1024.*1024.) # in MB
 
 	res['filename_orig']= filename
 	res['tag'] = file_tag
@@ -151,7 +164,7 @@ def upload_file():
 	res['status']= 'File uploaded with success'
 
 	# - Register file in MongoDB
-	logger.info("Creating data file object ...", action="upload", user=username)
+	logger.debug("Creating data file object ...", action="upload", user=username)
 	data_fileobj= {
 		"filepath": filename_dest_fullpath,
 		"fileid": file_uuid,
@@ -163,13 +176,20 @@ def upload_file():
 		"tag": file_tag
 	}
 
-	collection_name= username + '.files'
-		
+	# - Compute image stats (sample-based) and store them in file document
+	if file_ext.lower() in img_stats.IMG_STATS_FILE_FORMATS:
+		logger.info("Computing image stats for file %s ..." % filename_dest_fullpath, action="upload", user=username)
+		stats= img_stats.compute_img_stats(filename_dest_fullpath)
+		if stats is None:
+			logger.warn("Failed to compute image stats for file %s, will be computed on first use ..." % filename_dest_fullpath, action="upload", user=username)
+		else:
+			data_fileobj['stats']= stats
+
 	try:			
-		logger.info("Creating or retrieving data collection %s for user %s ..." % (collection_name, username), action="upload", user=username)
-		data_collection= mongo.db[collection_name]
+		logger.debug("Creating or retrieving data collection %s for user %s ..." % (identity.files_collection_name, username), action="upload", user=username)
+		data_collection= identity.files_collection
 
-		logger.info("Adding data file obj to collection ...", action="upload", user=username)
+		logger.debug("Adding data file obj to collection ...", action="upload", user=username)
 		try:
 			item_id= data_collection.insert(data_fileobj)
 		except Exception as ex:
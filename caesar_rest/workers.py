@@ -10,7 +10,6 @@ import json
 import time
 import datetime
 import logging
-import numpy as np
 import subprocess
 
 try:
@@ -35,6 +34,11 @@ from celery.exceptions import Ignore, SoftTimeLimitExceeded
 # Import Celery app
 from caesar_rest.app import celery as celery_app
 from caesar_rest import utils
+from caesar_rest import img_utils
+from caesar_rest import catalog_store
+from caesar_rest import img_stats
+from caesar_rest import storage_usage
+from caesar_rest.bulk_writer import job_update_writer
 #from caesar_rest.app import CustomTask
 
 # Import mongo
@@ -47,11 +51,14 @@ from pymongo import MongoClient
 #logger = logging.getLogger(__name__)
 from caesar_rest import logger
 
+# - Set job update writer options (batch size, flush period) from env in Celery workers
+job_update_writer.initialize_from_env()
+
 ##############################
 #      WORKERS
 ##############################
 @celery_app.task(bind=True)
-def background_task(self,app_name,cmd,cmd_args,job_top_dir,username='anonymous',db_host='localhost', db_port='27017', db_name='caesardb',monitoring_period=10):
+def background_task(self,app_name,cmd,cmd_args,job_top_dir,username='anonymous',db_host='localhost', db_port='27017', db_name='caesardb',monitoring_period=10,catalog_dir='',preview_renderer='fast'):
 	"""Background task """
 
 	# - Initialize task info
@@ -188,9 +195,9 @@ def background_task(self,app_name,cmd,cmd_args,job_top_dir,username='anonymous',
 					update_celery_task_state(self,'RUNNING',task_info)
 
 					# - Update state & status in DB
-					#if task_info['state']!=last_state or task_info['status']!=last_status:
+					#   NB: Only elapsed time changes while running, so these updates are batched
 					logger.info("Updating task state (RUNNING) in DB ...")
-					if update_job_status_in_db(client, db_name, task_id, task_info, username)<0:
+					if update_job_status_in_db(client, db_name, task_id, task_info, username, defer=(last_state=='RUNNING'))<0:
 						logger.warn("Failed to update task state (RUNNING) in DB!")
 
 					last_status= task_info['status']
@@ -229,12 +236,6 @@ def background_task(self,app_name,cmd,cmd_args,job_top_dir,username='anonymous',
 		logger.info("Task monitoring interrupted with ctrl-c signal")		
 		raise Ignore()		
 
-	# - Create a tar.gz with job files (output, logs, submission scripts, etc)
-	tar_filename= 'job_' + task_id + '.tar.gz'
-	tar_file= os.path.join(job_dir,tar_filename)
-	logger.info("Creating a tar file %s with job output data ..." % tar_file)
-	utils.make_tar(tar_file,job_dir)
-
 	# - Check return code after task finish
 	end = time.time()
 	elapsed = end - start	
@@ -269,11 +270,9 @@ def background_task(self,app_name,cmd,cmd_args,job_top_dir,username='anonymous',
 	if update_job_status_in_db(client, db_name, task_id, task_info, username)<0:
 		logger.warn("Failed to update task state (%s) in DB!" % task_info['state'])
 	
-	# - Execute post actions (in case of SUCCESS)
-	if p.returncode==0:
-		logger.info("Executing post actions after task %s success..." % task_id)
-		if do_post_actions(job_dir, app_name, cmd, cmd_args)<0:
-			logger.warn("Post actions failed for task %s" % task_id)
+	# - Submit post-processing (output archive, previews, catalog ingestion) 
+	#   to post-processing queue, so that this worker slot is freed as soon as the job process exits
+	submit_postprocess_task(client, db_name, task_id, app_name, cmd, cmd_args, job_dir, p.returncode, username, db_host, db_port, catalog_dir, preview_renderer)
 
 	# - Reply to client	
 	res= {
@@ -294,6 +293,101 @@ def background_task(self,app_name,cmd,cmd_args,job_top_dir,username='anonymous',
 
 
 
+#######################################
+####   POST-PROCESSING TASK
+#######################################
+def submit_postprocess_task(client, db_name, job_id, app_name, cmd, cmd_args, job_dir, exit_code, username='anonymous', db_host='localhost', db_port='27017', catalog_dir='', preview_renderer='fast'):
+	""" Submit job post-processing task to post-processing queue """
+
+	# - Set post-processing state in DB
+	if update_job_postproc_status_in_db(client, db_name, job_id, 'PENDING', 'Post-processing pending to be executed', -1, username)<0:
+		logger.warn("Failed to update post-processing state (PENDING) of job %s in DB!" % job_id)
+
+	# - Submit task (routed to post-processing queue, see celery config)
+	logger.info("Submitting post-processing task for job %s ..." % job_id)
+	try:
+		postprocess_task.apply_async(
+			[job_id, app_name, cmd, cmd_args, job_dir, exit_code, username, db_host, db_port, db_name, catalog_dir, preview_renderer]
+		)
+	except Exception as e:
+		errmsg= 'Exception caught when submitting post-processing task for job ' + job_id + ' (err=' + str(e) + ')!'
+		logger.error(errmsg)
+		update_job_postproc_status_in_db(client, db_name, job_id, 'FAILURE', errmsg, -1, username)
+		return -1
+
+	return 0
+
+
+@celery_app.task(bind=True)
+def postprocess_task(self, job_id, app_name, cmd, cmd_args, job_dir, exit_code, username='anonymous', db_host='localhost', db_port='27017', db_name='caesardb', catalog_dir='', preview_renderer='fast'):
+	""" Job post-processing task (output archive, previews, catalog ingestion) """
+
+	res= {
+		'job_id': job_id,
+		'state': 'STARTED',
+		'status': '',
+		'elapsed_time': -1
+	}
+
+	# - Connect to mongoDB	
+	logger.info("Connecting to DB (dbhost=%s, dbname=%s, dbport=%s) ..." % (db_host,db_name,db_port))
+	client= None
+	try:
+		client= MongoClient(db_host, int(db_port))
+	except Exception as e:
+		errmsg= 'Exception caught when connecting to DB server (err=' + str(e) + ')!' 
+		logger.error(errmsg)
+		res['state']= 'FAILURE'
+		res['status']= errmsg
+		return res
+
+	start= time.time()
+	if update_job_postproc_status_in_db(client, db_name, job_id, 'STARTED', 'Post-processing started', -1, username)<0:
+		logger.warn("Failed to update post-processing state (STARTED) of job %s in DB!" % job_id)
+
+	status= 0
+	status_msgs= []
+
+	# - Create a tar.gz with job files (output, logs, submission scripts, etc)
+	tar_filename= 'job_' + job_id + '.tar.gz'
+	tar_file= os.path.join(job_dir,tar_filename)
+	logger.info("Creating a tar file %s with job output data ..." % tar_file)
+	try:
+		utils.make_tar(tar_file,job_dir)
+	except Exception as e:
+		errmsg= 'Failed to create job output archive (err=' + str(e) + ')'
+		logger.warn(errmsg)
+		status_msgs.append(errmsg)
+		status= -1
+
+	# - Execute post actions (in case of SUCCESS)
+	if exit_code==0:
+		logger.info("Executing post actions after task %s success..." % job_id)
+		if do_post_actions(job_dir, app_name, cmd, cmd_args, job_id, username, client[db_name], catalog_dir, preview_renderer)<0:
+			errmsg= 'Post actions failed'
+			logger.warn("Post actions failed for task %s" % job_id)
+			status_msgs.append(errmsg)
+			status= -1
+
+	# - Account job output (including archive & previews) in user storage usage counters
+	storage_usage.add_storage_usage(client[db_name], username, jobsize=storage_usage.get_dir_size(job_dir))
+
+	# - Update post-processing state in DB
+	elapsed= time.time()-start
+	res['elapsed_time']= elapsed
+	if status<0:
+		res['state']= 'FAILURE'
+		res['status']= ', '.join(status_msgs)
+	else:
+		res['state']= 'SUCCESS'
+		res['status']= 'Post-processing terminated with success'
+
+	if update_job_postproc_status_in_db(client, db_name, job_id, res['state'], res['status'], elapsed, username)<0:
+		logger.warn("Failed to update post-processing state (%s) of job %s in DB!" % (res['state'], job_id))
+
+	return res
+
+
 #######################################
 ####   SUBMIT BATCH TASK TO SLURM
 #######################################
@@ -590,8 +684,8 @@ def update_celery_task_state(task_instance, state, task_info):
 
 
 
-def update_job_status_in_db(client, db_name, task_id, task_info, username='anonymous'):
-	""" Update job status in DB """
+def update_job_status_in_db(client, db_name, task_id, task_info, username='anonymous', defer=False):
+	""" Update job status in DB. If defer is True the update is batched with others and written within the writer flush period. """
 
 	# - Search job id in user collection
 	if client.db_name is None:
@@ -606,47 +700,75 @@ def update_job_status_in_db(client, db_name, task_id, task_info, username='anony
 	elapsed_time= task_info['elapsed_time']
 	pid= task_info['pid']
 
+	# - Queue update (also updating active jobs index)
 	try:
 		job_collection= client[db_name][collection_name]
-		job_collection.update_one({'job_id':task_id},{'$set':{'state':state,'status':status,'exit_code':exit_code,'elapsed_time':elapsed_time,'pid':pid}},upsert=False)
+		failed_job_ids= job_update_writer.add(job_collection, task_id, {'state':state,'status':status,'exit_code':exit_code,'elapsed_time':elapsed_time,'pid':pid}, flush=not defer)
 	except Exception as e:
 		errmsg= 'Exception caught when updating job ' + str(task_id) + ' in DB (err=' + str(e) + ')!'
 		logger.error(errmsg)
 		return -1
 
+	if task_id in failed_job_ids:
+		return -1
+
 	return 0
 
 
 
-def do_post_actions(job_dir,app_name,cmd,cmd_args):
+def update_job_postproc_status_in_db(client, db_name, job_id, state, status, elapsed_time=-1, username='anonymous'):
+	""" Update job post-processing status in DB """
+
+	if client is None:
+		logger.error("mongo client instance is None!")	
+		return -1
+	collection_name= username + '.jobs'
+
+	try:
+		job_collection= client[db_name][collection_name]
+		job_collection.update_one({'job_id':job_id},{'$set':{'postproc_state':state,'postproc_status':status,'postproc_elapsed_time':elapsed_time}},upsert=False)
+	except Exception as e:
+		errmsg= 'Exception caught when updating post-processing status of job ' + str(job_id) + ' in DB (err=' + str(e) + ')!'
+		logger.error(errmsg)
+		return -1
+
+	return 0
+
+
+def do_post_actions(job_dir,app_name,cmd,cmd_args,job_id='',username='anonymous',db=None,catalog_dir='',preview_renderer='fast'):
 	""" Execute job post actions """
 
-	#if app_name=='caesar':
-	#	return do_caesar_post_actions(job_dir,app_name,cmd,cmd_args)	
+	status= 0
+
+	# - Draw image+regions plot
+	if app_name=='caesar':
+		if do_caesar_post_actions(job_dir,app_name,cmd,cmd_args,renderer=preview_renderer,db=db,username=username)<0:
+			status= -1
 	# ... Add others
 
-	return 0
+	# - Ingest source catalog in columnar catalog store
+	if catalog_dir and db is not None:
+		logger.info("Ingesting source catalog of job %s ..." % job_id, action="catalogingest", user=username)
+		if catalog_store.ingest_job_catalog(db, username, job_id, job_dir, catalog_dir)<0:
+			logger.warn("Failed to ingest source catalog of job %s!" % job_id, action="catalogingest", user=username)
+			status= -1
+
+	return status
 
-def do_caesar_post_actions(job_dir,app_name,cmd,cmd_args):
-	""" Execute caesar post actions """
+def do_caesar_post_actions(job_dir,app_name,cmd,cmd_args,renderer='fast',db=None,username='anonymous'):
+	""" Execute caesar post actions. Preview renderer options are: {fast,matplotlib} (matplotlib=publication quality but slow) """
 	
 	# - Parse options and get input filename
 	cmd_args_list= cmd_args.split()
-	print(cmd_args)
-	print(cmd_args_list)
 	matching= [s for s in cmd_args_list if "--inputfile=" in s]
-	print(matching)
-	logger.info("")
 	if not matching:
 		logger.warn("Can't find --inputfile option in given cmd args, stop post action.")
 		return -1
 	inputimg= matching[0].replace('--inputfile=','')
 
 	# - Search for region files in job directory
-	regionfiles= []
-	os.chdir(job_dir)
-	for filename in glob.glob("*.reg"):
-		regionfiles.append(filename)
+	#   NB: Use full paths, do not chdir as the working dir is shared by all tasks in the worker process
+	regionfiles= sorted(glob.glob(os.path.join(job_dir, "*.reg")))
 	logger.info("#%d region files found in dir %s..." % (len(regionfiles),job_dir))
 
 	# - Draw and save image+regions
@@ -655,21 +777,45 @@ def do_caesar_post_actions(job_dir,app_name,cmd,cmd_args):
 	contrast= 0.3
 	cmap= "afmhot"
 	save= True
-	outfile="plot.png"
+	outfile= os.path.join(job_dir, "plot.png")
+
+	# - Reuse ZScale limits cached in input file document (computed and stored on first use for files uploaded before stats were introduced)
+	#   NB: If not available the renderer computes them on a pixel sample
+	stats= img_stats.get_file_stats_by_path(db, username, inputimg)
+	if stats is not None and stats.get('zscale_contrast')==contrast and stats.get('zscale_min') is not None:
+		zmin= stats['zscale_min']
+		zmax= stats['zscale_max']
+		logger.info("Using ZScale limits cached in file %s stats (zmin=%g, zmax=%g) ..." % (inputimg, zmin, zmax))
+	else:
+		logger.info("No cached ZScale limits found for file %s, they will be computed by the renderer ..." % inputimg)
 
 	try:
-		utils.plot_img_and_regions(
-			inputimg,
-			regionfiles,
-			zmin=zmin, zmax= zmax,
-			cmap= cmap,
-			contrast=contrast,
-			save=save,
-			outfile=outfile
-		)	
+		if renderer=='matplotlib':
+			status= img_utils.plot_img_and_regions(
+				inputimg,
+				regionfiles,
+				zmin=zmin, zmax= zmax,
+				cmap= cmap,
+				contrast=contrast,
+				save=save,
+				outfile=outfile
+			)
+		else:
+			status= img_utils.render_img_and_regions(
+				inputimg,
+				regionfiles,
+				zmin=zmin, zmax= zmax,
+				cmap= cmap,
+				contrast=contrast,
+				outfile=outfile
+			)
 	except:
 		logger.warn("Failed to draw and save img+regions!")
 		return -1
 
+	if status<0:
+		logger.warn("Failed to draw and save img+regions!")
+		return -1
+
 	return 0
 
@@ -0,0 +1,121 @@
+from __future__ import print_function
+
+############################################################
+#              MODULE IMPORTS
+############################################################
+# - Standard modules
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import subprocess
+
+logging.basicConfig(format="%(asctime)-15s %(levelname)s - %(message)s",datefmt='%Y-%m-%d %H:%M:%S')
+logger= logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+###########################
+##     ARGS
+###########################
+# - Modules imported by API and worker processes at startup
+DEFAULT_MODULES= [
+	'caesar_rest.utils',
+	'caesar_rest.identity',
+	'caesar_rest.upload_route',
+	'caesar_rest.download_route',
+	'caesar_rest.job_route',
+	'caesar_rest.app',
+	'caesar_rest.workers'
+]
+
+# - Modules that must not be loaded at import time (only needed by post-processing)
+DEFAULT_FORBIDDEN_MODULES= ['astropy', 'regions', 'matplotlib']
+
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Measure import time and memory of caesar_rest modules in fresh interpreters, failing if heavy modules are loaded or time exceeds limit (to be run in CI)")
+
+	parser.add_argument('-modules','--modules', dest='modules', default=','.join(DEFAULT_MODULES), required=False, type=str, help='Comma-separated list of modules to be imported (default=API and worker modules)')
+	parser.add_argument('-forbidden_modules','--forbidden_modules', dest='forbidden_modules', default=','.join(DEFAULT_FORBIDDEN_MODULES), required=False, type=str, help='Comma-separated list of modules that must not be loaded at import time (default=astropy,regions,matplotlib)')
+	parser.add_argument('-nruns','--nruns', dest='nruns', default=3, required=False, type=int, help='Number of timed imports per module (best is reported) (default=3)')
+	parser.add_argument('-max_time','--max_time', dest='max_time', default=0, required=False, type=float, help='Max import time in seconds per module (0=no check) (default=0)')
+
+	args = parser.parse_args()
+
+	return args
+
+
+###########################
+##     IMPORT TIME
+###########################
+# - Code run in a fresh interpreter: import module, report time, peak RSS and forbidden modules loaded
+IMPORT_CODE= """
+import sys, time, json
+t0= time.time()
+import %(module)s
+dt= time.time()-t0
+try:
+	import resource
+	maxrss= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024. # MB (Linux)
+except ImportError:
+	maxrss= -1
+forbidden= [m for m in %(forbidden)r if m in sys.modules]
+print(json.dumps({'time': dt, 'maxrss': maxrss, 'forbidden': forbidden}))
+"""
+
+def time_import(module, forbidden_modules):
+	""" Import module in a fresh interpreter. Return result dict or None on failure. """
+
+	code= IMPORT_CODE % {'module': module, 'forbidden': forbidden_modules}
+	p= subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	out, err= p.communicate()
+	if p.returncode!=0:
+		logger.error("Failed to import module %s (err=%s)!" % (module, err.decode('utf-8', 'replace').strip().splitlines()[-1:]))
+		return None
+
+	return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+###########################
+##     MAIN
+###########################
+def main():
+	""" Main function """
+
+	args= get_args()
+	modules= [m.strip() for m in args.modules.split(',') if m.strip()]
+	forbidden_modules= [m.strip() for m in args.forbidden_modules.split(',') if m.strip()]
+
+	status= 0
+	for module in modules:
+		best= None
+		for i in range(args.nruns):
+			res= time_import(module, forbidden_modules)
+			if res is None:
+				break
+			if best is None or res['time']<best['time']:
+				best= res
+
+		if best is None:
+			status= 1
+			continue
+
+		logger.info("module=%s: import time=%.3f s, maxrss=%.1f MB" % (module, best['time'], best['maxrss']))
+		if best['forbidden']:
+			logger.error("Module %s loads heavy modules %s at import time!" % (module, str(best['forbidden'])))
+			status= 1
+		if args.max_time>0 and best['time']>args.max_time:
+			logger.error("Module %s import time %.3f s exceeds limit (%.3f s)!" % (module, best['time'], args.max_time))
+			status= 1
+
+	return status
+
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
+
@@ -0,0 +1,205 @@
+from __future__ import print_function
+
+############################################################
+#              MODULE IMPORTS
+############################################################
+# - Standard modules
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+
+# - Mongo modules
+from pymongo import MongoClient
+
+# - caesar_rest modules
+from caesar_rest.accounter import get_job_stats
+
+logging.basicConfig(format="%(asctime)-15s %(levelname)s - %(message)s",datefmt='%Y-%m-%d %H:%M:%S')
+logger= logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Benchmark job stats computation (client-side loop vs aggregation pipeline) on a seeded job collection")
+
+	parser.add_argument('-njobs','--njobs', dest='njobs', default=1000000, required=False, type=int, help='Number of jobs to be seeded (default=1000000)')
+	parser.add_argument('-batch_size','--batch_size', dest='batch_size', default=10000, required=False, type=int, help='Number of jobs inserted per batch (default=10000)')
+	parser.add_argument('-nruns','--nruns', dest='nruns', default=3, required=False, type=int, help='Number of timed runs per method (default=3)')
+	parser.add_argument('-dbhost','--dbhost', dest='dbhost', default='', required=False, type=str, help='Host of MongoDB database. If empty an in-memory mongomock DB is used (results can be checked but timings are not representative as aggregation runs client-side) (default=empty)')
+	parser.add_argument('-dbport','--dbport', dest='dbport', default=27017, required=False, type=int, help='Port of MongoDB database (default=27017)')
+	parser.add_argument('-dbname','--dbname', dest='dbname', default='caesardb_benchmark', required=False, type=str, help='Name of MongoDB database (dropped at the end) (default=caesardb_benchmark)')
+
+	args = parser.parse_args()
+
+	return args
+
+
+###########################
+##     SEED JOBS
+###########################
+JOB_STATES= ['SUCCESS', 'SUCCESS', 'SUCCESS', 'FAILURE', 'ABORTED', 'RUNNING', 'PENDING', 'CANCELED', 'TIMED-OUT']
+
+def make_job(index):
+	""" Create a job document similar to those stored by the service """
+
+	state= random.choice(JOB_STATES)
+	elapsed_time= round(random.uniform(1, 3600), 2)
+	if state=='PENDING':
+		elapsed_time= '0'
+	elif random.random()<0.01:
+		elapsed_time= -1
+
+	return {
+		"job_id": '%032x' % index,
+		"submit_date": "2024-01-01T00:00:00",
+		"app": "caesar",
+		"job_inputs": "",
+		"data_inputs": "",
+		"job_top_dir": "/opt/caesar-rest/jobs/benchmark",
+		"tag": "",
+		"scheduler": "kubernetes",
+		"state": state,
+		"status": "",
+		"pid": str(index),
+		"elapsed_time": elapsed_time,
+		"exit_code": 0
+	}
+
+
+def seed_jobs(job_collection, njobs, batch_size):
+	""" Insert jobs in collection in batches """
+
+	random.seed(1)
+	for index in range(0, njobs, batch_size):
+		n= min(batch_size, njobs-index)
+		job_collection.insert_many([make_job(index+i) for i in range(n)], ordered=False)
+
+
+###########################
+##     JOB STATS
+###########################
+def get_job_stats_loop(job_collection):
+	""" Compute job stats fetching all jobs and looping over them (as done before aggregation pipeline was introduced) """
+
+	job_list= list(job_collection.find({}))
+
+	job_stats= {
+		"njobs": len(job_list),
+		"njobs_completed": 0,
+		"njobs_failed": 0,
+		"njobs_aborted": 0,
+		"njobs_pending": 0,
+		"njobs_running": 0,
+		"njobs_unknown": 0,
+		"job_runtime": 0,
+		"job_completed_runtime": 0
+	}
+
+	for job in job_list:
+		job_state= job.get("state", "UNKNOWN")
+		job_elapsed_time= 0
+		elapsed_time= job.get("elapsed_time", "")
+		if isinstance(elapsed_time, (int, float)) and elapsed_time>0:
+			job_elapsed_time= elapsed_time
+
+		job_stats["job_runtime"]+= job_elapsed_time
+
+		if job_state=="SUCCESS":
+			job_stats["njobs_completed"]+= 1
+			job_stats["job_completed_runtime"]+= job_elapsed_time
+		elif job_state=="FAILURE":
+			job_stats["njobs_failed"]+= 1
+		elif job_state=="ABORTED":
+			job_stats["njobs_aborted"]+= 1
+		elif job_state=="RUNNING" or job_state=="STARTED":
+			job_stats["njobs_running"]+= 1
+		elif job_state=="PENDING":
+			job_stats["njobs_pending"]+= 1
+		else:
+			job_stats["njobs_unknown"]+= 1
+
+	return job_stats
+
+
+def time_method(func, job_collection, nruns):
+	""" Run method nruns times, return (best time in seconds, result) """
+
+	best= None
+	res= None
+	for i in range(nruns):
+		t0= time.time()
+		res= func(job_collection)
+		dt= time.time()-t0
+		if best is None or dt<best:
+			best= dt
+
+	return best, res
+
+
+def is_equal(stats1, stats2, tol=1.e-6):
+	""" Compare job stats """
+
+	for key in stats1:
+		if abs(stats1[key]-stats2[key])>tol*max(1., abs(stats1[key])):
+			return False
+	return True
+
+
+###########################
+##     MAIN
+###########################
+def main():
+	""" Main function """
+
+	args= get_args()
+
+	# - Connect to DB
+	if args.dbhost=="":
+		import mongomock
+		logger.info("Using in-memory mongomock DB ...")
+		client= mongomock.MongoClient()
+	else:
+		logger.info("Connecting to DB (dbhost=%s, dbport=%d, dbname=%s) ..." % (args.dbhost, args.dbport, args.dbname))
+		client= MongoClient(args.dbhost, args.dbport)
+
+	db= client[args.dbname]
+	job_collection= db['benchmark.jobs']
+	job_collection.drop()
+
+	# - Seed jobs
+	logger.info("Seeding %d jobs ..." % args.njobs)
+	t0= time.time()
+	seed_jobs(job_collection, args.njobs, args.batch_size)
+	logger.info("%d jobs seeded in %.1f s" % (job_collection.count_documents({}), time.time()-t0))
+
+	# - Time methods
+	dt_loop, stats_loop= time_method(get_job_stats_loop, job_collection, args.nruns)
+	logger.info("method=loop: %.3f s (%s)" % (dt_loop, json.dumps(stats_loop)))
+
+	dt_aggr, stats_aggr= time_method(get_job_stats, job_collection, args.nruns)
+	logger.info("method=aggregate: %.3f s (%s)" % (dt_aggr, json.dumps(stats_aggr)))
+
+	logger.info("speedup=%.1f" % (dt_loop/dt_aggr if dt_aggr>0 else 0))
+
+	client.drop_database(args.dbname)
+
+	if not is_equal(stats_loop, stats_aggr):
+		logger.error("Job stats computed with the two methods differ!")
+		return 1
+
+	return 0
+
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
+
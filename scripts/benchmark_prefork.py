@@ -0,0 +1,220 @@
+from __future__ import print_function
+
+############################################################
+#              MODULE IMPORTS
+############################################################
+# - Standard modules
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import logging
+import subprocess
+
+# - Requests
+import requests
+
+logging.basicConfig(format="%(asctime)-15s %(levelname)s - %(message)s",datefmt='%Y-%m-%d %H:%M:%S')
+logger= logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Compare per-worker memory and cold-start latency of the app run by uWSGI in lazy (lazy-apps=true) and preload (lazy-apps=false) mode")
+
+	parser.add_argument('-uwsgi','--uwsgi', dest='uwsgi', default='uwsgi', required=False, type=str, help='uWSGI executable (default=uwsgi)')
+	parser.add_argument('-wsgi_file','--wsgi_file', dest='wsgi_file', default='', required=True, type=str, help='Path to run_app.py')
+	parser.add_argument('-app_args','--app_args', dest='app_args', default='', required=False, type=str, help='Application command line options (passed with --pyargv)')
+	parser.add_argument('-port','--port', dest='port', default=5100, required=False, type=int, help='HTTP port used by uWSGI (default=5100)')
+	parser.add_argument('-nworkers','--nworkers', dest='nworkers', default=4, required=False, type=int, help='Number of uWSGI workers (default=4)')
+	parser.add_argument('-nthreads','--nthreads', dest='nthreads', default=2, required=False, type=int, help='Number of threads per worker (default=2)')
+	parser.add_argument('-app','--app', dest='app', default='caesar', required=False, type=str, help='App whose description is requested (default=caesar)')
+	parser.add_argument('-nrequests','--nrequests', dest='nrequests', default=200, required=False, type=int, help='Number of requests used to measure steady-state latency (default=200)')
+	parser.add_argument('-timeout','--timeout', dest='timeout', default=120, required=False, type=float, help='Max time in seconds to wait for the server to be ready (default=120)')
+	parser.add_argument('-modes','--modes', dest='modes', default='lazy,preload', required=False, type=str, help='Comma-separated list of modes to be run {lazy,preload} (default=lazy,preload)')
+	parser.add_argument('-outfile','--outfile', dest='outfile', default='', required=False, type=str, help='Output json file with results (default=none)')
+
+	args = parser.parse_args()
+
+	return args
+
+
+###########################
+##     MEMORY
+###########################
+def get_children(pid):
+	""" Return pids of child processes of given process """
+
+	children= []
+	for name in os.listdir('/proc'):
+		if not name.isdigit():
+			continue
+		try:
+			with open('/proc/%s/stat' % name) as f:
+				fields= f.read().rsplit(')', 1)[1].split()
+		except (IOError, OSError):
+			continue
+		if int(fields[1])==pid:
+			children.append(int(name))
+
+	return sorted(children)
+
+
+def get_memory(pid):
+	""" Return RSS, PSS and USS (in MB) of given process from /proc/<pid>/smaps_rollup (Linux>=4.14) """
+
+	mem= {'rss': 0., 'pss': 0., 'uss': 0.}
+	try:
+		with open('/proc/%d/smaps_rollup' % pid) as f:
+			for line in f:
+				fields= line.split()
+				if len(fields)<2 or not fields[0].endswith(':'):
+					continue # skip header line
+				key, value= fields[0].rstrip(':'), float(fields[1])/1024. # kB -> MB
+				if key=='Rss':
+					mem['rss']= value
+				elif key=='Pss':
+					mem['pss']= value
+				elif key in ('Private_Clean', 'Private_Dirty'):
+					mem['uss']+= value
+	except (IOError, OSError) as e:
+		logger.warn("Failed to read memory of process %d (err=%s)!" % (pid, str(e)))
+		return None
+
+	return mem
+
+
+###########################
+##     RUN
+###########################
+def wait_ready(url, timeout):
+	""" Poll url until it returns 200. Return elapsed time or -1 on timeout. """
+
+	t0= time.time()
+	while time.time()-t0<timeout:
+		try:
+			r= requests.get(url, timeout=5)
+			if r.status_code==200:
+				return time.time()-t0
+		except requests.exceptions.RequestException:
+			pass
+		time.sleep(0.05)
+
+	return -1
+
+
+def run_mode(args, mode):
+	""" Run uWSGI in given mode and return measurements dict (None on failure) """
+
+	base_url= 'http://127.0.0.1:%d/caesar/api/v1.0' % args.port
+	cmd= [
+		args.uwsgi,
+		'--wsgi-file', args.wsgi_file, '--callable', 'app',
+		'--master', '--processes', str(args.nworkers), '--threads', str(args.nthreads),
+		'--http-socket', '127.0.0.1:%d' % args.port,
+		'--lazy-apps', 'true' if mode=='lazy' else 'false',
+		'--die-on-term', '--disable-logging'
+	]
+	if args.app_args:
+		cmd+= ['--pyargv', args.app_args]
+
+	logger.info("Starting uWSGI in %s mode: %s" % (mode, ' '.join(cmd)))
+	t0= time.time()
+	p= subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+	try:
+		# - Cold start: time to first successful request
+		elapsed= wait_ready(base_url + '/apps', args.timeout)
+		if elapsed<0:
+			logger.error("uWSGI not ready after %.1f s in %s mode!" % (args.timeout, mode))
+			return None
+		startup_time= time.time()-t0
+
+		# - First describe requests (one per worker at most, hitting workers not yet warmed up)
+		url= base_url + '/app/%s/describe' % args.app
+		first_latencies= []
+		for i in range(args.nworkers):
+			t= time.time()
+			requests.get(url, timeout=30)
+			first_latencies.append(time.time()-t)
+
+		# - Steady-state describe latency
+		latencies= []
+		for i in range(args.nrequests):
+			t= time.time()
+			r= requests.get(url, timeout=30)
+			latencies.append(time.time()-t)
+			if r.status_code!=200:
+				logger.warn("Describe request returned status %d!" % r.status_code)
+		latencies.sort()
+
+		# - Memory of master and workers
+		master_mem= get_memory(p.pid)
+		workers= get_children(p.pid)
+		workers_mem= [get_memory(pid) for pid in workers]
+		workers_mem= [m for m in workers_mem if m is not None]
+
+	finally:
+		p.send_signal(signal.SIGTERM)
+		try:
+			p.wait(timeout=30)
+		except subprocess.TimeoutExpired:
+			p.kill()
+
+	nworkers= max(len(workers_mem), 1)
+	res= {
+		'mode': mode,
+		'startup_time': startup_time,
+		'first_latency_max': max(first_latencies),
+		'latency_p50': latencies[len(latencies)//2],
+		'latency_p99': latencies[min(int(len(latencies)*0.99), len(latencies)-1)],
+		'master': master_mem,
+		'nworkers': len(workers_mem),
+		'worker_rss': sum(m['rss'] for m in workers_mem)/nworkers,
+		'worker_pss': sum(m['pss'] for m in workers_mem)/nworkers,
+		'worker_uss': sum(m['uss'] for m in workers_mem)/nworkers
+	}
+
+	return res
+
+
+###########################
+##     MAIN
+###########################
+def main():
+	""" Main function """
+
+	args= get_args()
+	modes= [m.strip() for m in args.modes.split(',') if m.strip()]
+	for mode in modes:
+		if mode not in ('lazy', 'preload'):
+			logger.error("Invalid mode %s given (valid={lazy,preload})!" % mode)
+			return 1
+
+	results= []
+	for mode in modes:
+		res= run_mode(args, mode)
+		if res is None:
+			return 1
+		results.append(res)
+		logger.info("mode=%s: startup=%.2f s, first describe (max)=%.1f ms, describe p50=%.1f ms, p99=%.1f ms" % (mode, res['startup_time'], res['first_latency_max']*1000, res['latency_p50']*1000, res['latency_p99']*1000))
+		logger.info("mode=%s: #%d workers, mean per-worker RSS=%.1f MB, PSS=%.1f MB, USS=%.1f MB" % (mode, res['nworkers'], res['worker_rss'], res['worker_pss'], res['worker_uss']))
+
+	if args.outfile:
+		with open(args.outfile, 'w') as f:
+			json.dump(results, f, indent=2)
+
+	return 0
+
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
+
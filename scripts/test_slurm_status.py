@@ -0,0 +1,248 @@
+from __future__ import print_function
+
+############################################################
+#              MODULE IMPORTS
+############################################################
+# - Standard modules
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import tempfile
+import threading
+
+try:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+	from socketserver import ThreadingMixIn
+	from urllib.parse import urlparse, parse_qs
+except ImportError:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import ThreadingMixIn
+	from urlparse import urlparse, parse_qs
+
+# - caesar_rest modules
+from caesar_rest.slurm_client import SlurmJobManager
+
+logging.basicConfig(format="%(asctime)-15s %(levelname)s - %(message)s",datefmt='%Y-%m-%d %H:%M:%S')
+logger= logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Compare full and incremental Slurm job status polling against a fake slurmrestd server")
+
+	parser.add_argument('-njobs','--njobs', dest='njobs', default=2000, required=False, type=int, help='Number of tracked jobs (default=2000)')
+	parser.add_argument('-npolls','--npolls', dest='npolls', default=10, required=False, type=int, help='Number of status polls (default=10)')
+	parser.add_argument('-change_fraction','--change_fraction', dest='change_fraction', default=0.02, required=False, type=float, help='Fraction of jobs changing state between polls (default=0.02)')
+	parser.add_argument('-max_pids_per_request','--max_pids_per_request', dest='max_pids_per_request', default=200, required=False, type=int, help='Max number of pids per request (default=200)')
+	parser.add_argument('-idle_poll_fraction','--idle_poll_fraction', dest='idle_poll_fraction', default=0.5, required=False, type=float, help='Fraction of polls with no job changed in the cluster since previous poll (default=0.5)')
+	parser.add_argument('-other_jobs','--other_jobs', dest='other_jobs', default=5000, required=False, type=int, help='Number of other (not tracked) jobs in the cluster (default=5000)')
+
+	args = parser.parse_args()
+
+	return args
+
+
+###########################
+##   FAKE SLURMRESTD
+###########################
+class FakeSlurmCluster(object):
+	""" In-memory Slurm job table with update times (update_time filter is all-or-nothing as in slurmctld) """
+
+	def __init__(self):
+		self.lock= threading.Lock()
+		self.jobs= {} # pid -> job obj
+		self.nrequests= 0
+		self.nbytes= 0
+
+	def add_job(self, pid, state='RUNNING'):
+		now= int(time.time())
+		with self.lock:
+			self.jobs[str(pid)]= {
+				'job_id': pid,
+				'job_state': state,
+				'start_time': now,
+				'end_time': now,
+				'exit_code': 0,
+				'last_update': time.time()
+			}
+
+	def set_job_state(self, pid, state, exit_code=0):
+		with self.lock:
+			job= self.jobs[str(pid)]
+			job['job_state']= state
+			job['end_time']= int(time.time())
+			job['exit_code']= exit_code
+			job['last_update']= time.time()
+
+	def get_jobs(self, update_time=None, job_names=None):
+		with self.lock:
+			jobs= list(self.jobs.values())
+		# - Like slurmctld, reply nothing if no job changed since update time, otherwise the whole job table
+		if update_time is not None and not any(job['last_update']>=update_time for job in jobs):
+			jobs= []
+		if job_names is not None:
+			jobs= [job for job in jobs if str(job['job_id']) in job_names]
+		return [dict((k, v) for k, v in job.items() if k!='last_update') for job in jobs]
+
+
+def make_handler(cluster):
+	""" Create request handler class serving given cluster """
+
+	class FakeSlurmRestHandler(BaseHTTPRequestHandler):
+		protocol_version= 'HTTP/1.1' # keep-alive
+
+		def log_message(self, format, *args):
+			pass
+
+		def send_json(self, obj, code=200):
+			body= json.dumps(obj).encode('utf-8')
+			cluster.nrequests+= 1
+			cluster.nbytes+= len(body)
+			self.send_response(code)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def do_GET(self):
+			url= urlparse(self.path)
+			params= parse_qs(url.query)
+			if 'X-SLURM-USER-TOKEN' not in self.headers:
+				self.send_json({'errors': [{'error': 'missing token'}]}, 401)
+				return
+
+			if url.path.endswith('/jobs'):
+				update_time= None
+				job_names= None
+				if 'update_time' in params:
+					update_time= float(params['update_time'][0])
+				if 'job_name' in params:
+					job_names= set(params['job_name'][0].split(','))
+				self.send_json({'errors': [], 'jobs': cluster.get_jobs(update_time, job_names)})
+			elif '/job/' in url.path:
+				pid= url.path.rsplit('/', 1)[-1]
+				self.send_json({'errors': [], 'jobs': cluster.get_jobs(job_names=set([pid]))})
+			else:
+				self.send_json({'errors': [{'error': 'not found'}]}, 404)
+
+	return FakeSlurmRestHandler
+
+
+class FakeSlurmRestServer(ThreadingMixIn, HTTPServer):
+	""" HTTP server handling each (keep-alive) connection in its own thread """
+	daemon_threads= True
+
+
+def start_fake_server(cluster):
+	""" Start fake slurmrestd server in a background thread, return server """
+
+	server= FakeSlurmRestServer(('127.0.0.1', 0), make_handler(cluster))
+	thread= threading.Thread(target=server.serve_forever)
+	thread.daemon= True
+	thread.start()
+	return server
+
+
+###########################
+##     TEST
+###########################
+def create_client(port, keyfile, incremental, max_pids_per_request):
+	""" Create and initialize Slurm client pointing to fake server """
+
+	client= SlurmJobManager()
+	client.host= '127.0.0.1'
+	client.port= port
+	client.username= 'caesar'
+	client.keyfile= keyfile
+	client.incremental_status= incremental
+	client.max_pids_per_request= max_pids_per_request
+	client.update_time_margin= 0
+	if client.initialize()<0:
+		raise RuntimeError("Failed to initialize Slurm client!")
+	return client
+
+
+def run_test(args, incremental):
+	""" Simulate job polling and return (nrequests, nbytes, elapsed, nerrors) """
+
+	random.seed(1)
+
+	# - Create cluster with tracked and other jobs
+	cluster= FakeSlurmCluster()
+	tracked_pids= [str(100000+i) for i in range(args.njobs)]
+	for pid in tracked_pids:
+		cluster.add_job(pid)
+	for i in range(args.other_jobs):
+		cluster.add_job(str(900000+i), state='COMPLETED')
+
+	server= start_fake_server(cluster)
+	keyfile= os.path.join(tempfile.mkdtemp(), 'jwt.key')
+	with open(keyfile, 'wb') as f:
+		f.write(os.urandom(32))
+
+	client= create_client(server.server_address[1], keyfile, incremental, args.max_pids_per_request)
+	cluster.nrequests= 0
+	cluster.nbytes= 0
+
+	# - Poll jobs, changing a fraction of them between polls
+	nerrors= 0
+	elapsed= 0.
+	for poll in range(args.npolls):
+		if poll>0 and random.random()>=args.idle_poll_fraction:
+			nchanged= max(1, int(args.change_fraction*len(tracked_pids)))
+			for pid in random.sample(tracked_pids, nchanged):
+				cluster.set_job_state(pid, random.choice(['RUNNING', 'COMPLETED', 'FAILED']), exit_code=random.randint(0, 1))
+		time.sleep(1.01) # update_time has 1 s resolution
+
+		t0= time.time()
+		resdict= client.get_job_statuses(tracked_pids)
+		elapsed+= time.time()-t0
+
+		# - Check results against cluster
+		truth= dict((str(job['job_id']), job) for job in cluster.get_jobs(job_names=set(tracked_pids)))
+		for pid in tracked_pids:
+			expected= client.get_job_state_from_slurm_state(truth[pid]['job_state'])[0]
+			if pid not in resdict or resdict[pid]['state']!=expected:
+				nerrors+= 1
+
+	pool_stats= client.get_pool_stats()
+	nconnections= sum(pool['nconnections'] for pool in pool_stats['pools'])
+	client.session.close()
+	server.shutdown()
+
+	return cluster.nrequests, cluster.nbytes, elapsed, nerrors, nconnections
+
+
+###########################
+##     MAIN
+###########################
+def main():
+	""" Main function """
+
+	args= get_args()
+
+	logger.info("Polling %d jobs %d times (%d other jobs in cluster, %.1f%% changing between polls, %.0f%% idle polls) ..." % (args.njobs, args.npolls, args.other_jobs, args.change_fraction*100, args.idle_poll_fraction*100))
+
+	status= 0
+	for incremental in [False, True]:
+		nrequests, nbytes, elapsed, nerrors, nconnections= run_test(args, incremental)
+		mode= 'incremental' if incremental else 'full'
+		logger.info("mode=%s: #%d requests over %d connections, %.1f kB received, %.3f s spent in polls, #%d wrong job states" % (mode, nrequests, nconnections, nbytes/1024., elapsed, nerrors))
+		if nerrors>0:
+			status= 1
+
+	return status
+
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
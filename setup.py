@@ -30,6 +30,7 @@ reqs.append('numpy>=1.10')
 if PY_MAJOR_VERSION<=2:
 	print("PYTHON 2 detected")
 	reqs.append('future')
+	reqs.append('futures')
 	reqs.append('zipp==1.2.0')
 	reqs.append('more_itertools==5.0.0')
 else:
@@ -67,5 +68,9 @@ setup(
 	include_package_data=True,
 	zip_safe=False,
 	install_requires=reqs,
-	scripts=['apps/run_app.py','apps/run_jobmonitor.py','apps/run_accounter.py'],
+	extras_require={
+		'asgi': ['starlette', 'motor', 'httpx', 'a2wsgi', 'uvicorn'],
+		'preview': ['Pillow'] # preview resizing & webp encoding
+	},
+	scripts=['apps/run_app.py','apps/run_app_asgi.py','apps/run_jobmonitor.py','apps/run_accounter.py'],
 )